@@ -5,6 +5,7 @@ import (
 	"log"
 	"os"
 	"os/signal"
+	"strconv"
 	"syscall"
 	"time"
 
@@ -27,18 +28,32 @@ func main() {
 		grpcAddr = "ml-service:50051"
 	}
 
-	conn, err := grpc.NewClient(
-		grpcAddr,
-		grpc.WithTransportCredentials(insecure.NewCredentials()),
-		grpc.WithUnaryInterceptor(grpc_retry.UnaryClientInterceptor(grpc_retry.WithMax(3), grpc_retry.WithBackoff(grpc_retry.BackoffExponential(100*time.Millisecond)))),
-	)
-	if err != nil {
-		log.Fatalf("grpc connection failed: %v", err)
+	// Несколько соединений: у ML-сервиса SERVER_WORKERS процессов на одном
+	// порту, и каждое соединение достаётся одному из них
+	connections := 4
+	if v := os.Getenv("GRPC_CONNECTIONS"); v != "" {
+		n, err := strconv.Atoi(v)
+		if err != nil || n < 1 {
+			log.Fatalf("GRPC_CONNECTIONS must be a positive integer, got %q", v)
+		}
+		connections = n
 	}
-	defer conn.Close()
 
-	mlClient := pb.NewQnAClient(conn)
-	service := bot.NewService(mlClient)
+	mlClients := make([]pb.QnAClient, 0, connections)
+	for i := 0; i < connections; i++ {
+		conn, err := grpc.NewClient(
+			grpcAddr,
+			grpc.WithTransportCredentials(insecure.NewCredentials()),
+			grpc.WithUnaryInterceptor(grpc_retry.UnaryClientInterceptor(grpc_retry.WithMax(3), grpc_retry.WithBackoff(grpc_retry.BackoffExponential(100*time.Millisecond)))),
+		)
+		if err != nil {
+			log.Fatalf("grpc connection failed: %v", err)
+		}
+		defer conn.Close()
+		mlClients = append(mlClients, pb.NewQnAClient(conn))
+	}
+
+	service := bot.NewService(mlClients...)
 	handler := bot.NewHandler(token, service)
 
 	ctx, cancel := signal.NotifyContext(context.Background(), os.Interrupt, syscall.SIGTERM)
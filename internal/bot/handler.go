@@ -45,7 +45,8 @@ const (
 	ModeOnline  UserMode = "online"
 )
 
-// userModes — временный in-memory storage (заменить на Redis позже)
+// userModes — режим для выбора обработчика; сам режим передаётся в каждом запросе к ML-сервису,
+// а SetMode сохраняет его на стороне сервиса для клиентов, которые его не передают
 var (
 	userModes = make(map[string]UserMode)
 	mu        sync.RWMutex
@@ -66,6 +67,15 @@ func setUserMode(userID string, mode UserMode) {
 	userModes[userID] = mode
 }
 
+const (
+	// streamEditInterval — как часто обновлять сообщение при потоковом ответе
+	streamEditInterval = 1500 * time.Millisecond
+	// uploadPollInterval — как часто спрашивать статус индексации документа
+	uploadPollInterval = 2 * time.Second
+	// uploadWaitTimeout — сколько ждать индексацию, прежде чем перестать следить
+	uploadWaitTimeout = 15 * time.Minute
+)
+
 type Handler struct {
 	bot     *tgbot.BotAPI
 	service *Service
@@ -148,7 +158,7 @@ func (h *Handler) handleUpdate(ctx context.Context, update tgbot.Update) {
 
 		mode := getUserMode(userID)
 		if mode == ModeOnline {
-			h.handleDirectQuestion(ctx, chatID, text)
+			h.handleDirectQuestion(ctx, userID, chatID, text)
 		} else {
 			h.handleQuestion(ctx, userID, chatID, text, false)
 		}
@@ -156,8 +166,8 @@ func (h *Handler) handleUpdate(ctx context.Context, update tgbot.Update) {
 }
 
 func (h *Handler) handleSetMode(ctx context.Context, userID string, chatID int64, mode string) {
-	req := &pb.SetModeRequest{Mode: mode}
-	_, err := h.service.mlClient.SetMode(ctx, req)
+	req := &pb.SetModeRequest{Mode: mode, UserId: userID}
+	_, err := h.service.mlClient().SetMode(ctx, req)
 	if err != nil {
 		h.bot.Send(tgbot.NewMessage(chatID, "❌ Не удалось переключить режим"))
 		return
@@ -186,19 +196,84 @@ func (h *Handler) handleDocument(ctx context.Context, userID string, chatID int6
 		return
 	}
 
-	data, err := h.downloadFile(file.Link(h.bot.Token))
+	body, err := h.openFile(file.Link(h.bot.Token))
 	if err != nil {
 		h.sendError(chatID, "failed to download file")
 		return
 	}
+	defer body.Close()
 
-	docID, err := h.service.UploadDocument(ctx, userID, doc.FileName, data)
+	// Файл идёт из Telegram в ML-сервис кусками, не оседая целиком в памяти
+	docID, jobID, err := h.service.UploadDocumentStream(ctx, userID, doc.FileName, body)
 	if err != nil {
 		h.sendError(chatID, "upload failed")
 		return
 	}
 
-	h.bot.Send(tgbot.NewMessage(chatID, fmt.Sprintf("Document uploaded: %s", docID)))
+	if jobID == "" {
+		h.bot.Send(tgbot.NewMessage(chatID, fmt.Sprintf("Document uploaded: %s", docID)))
+		return
+	}
+
+	sentMsg, _ := h.bot.Send(tgbot.NewMessage(chatID, "📥 Документ принят, читаю его..."))
+	h.waitForUpload(ctx, chatID, sentMsg.MessageID, docID, jobID)
+}
+
+// waitForUpload опрашивает статус фоновой индексации и обновляет сообщение с прогрессом
+func (h *Handler) waitForUpload(ctx context.Context, chatID int64, messageID int, docID, jobID string) {
+	ctx, cancel := context.WithTimeout(ctx, uploadWaitTimeout)
+	defer cancel()
+
+	ticker := time.NewTicker(uploadPollInterval)
+	defer ticker.Stop()
+
+	lastText := ""
+	report := func(text string) {
+		if text == lastText {
+			return
+		}
+		lastText = text
+		if messageID != 0 {
+			h.bot.Send(tgbot.NewEditMessageText(chatID, messageID, text))
+		} else {
+			h.bot.Send(tgbot.NewMessage(chatID, text))
+		}
+	}
+
+	for {
+		select {
+		case <-ctx.Done():
+			report("⏳ Документ ещё обрабатывается, он появится в /docs, когда будет готов.")
+			return
+		case <-ticker.C:
+		}
+
+		status, err := h.service.UploadStatus(ctx, jobID)
+		if err != nil {
+			log.Printf("Upload status error for job %s: %v", jobID, err)
+			continue
+		}
+
+		switch status.State {
+		case "done":
+			// doc_id мог смениться: файл оказался дубликатом или новой версией загруженного
+			if status.DocId != "" {
+				docID = status.DocId
+			}
+			if status.ChunksReused > 0 {
+				report(fmt.Sprintf("Document uploaded: %s (%d фрагментов без изменений)", docID, status.ChunksReused))
+			} else {
+				report(fmt.Sprintf("Document uploaded: %s", docID))
+			}
+			return
+		case "failed":
+			log.Printf("Upload job %s failed: %s", jobID, status.Error)
+			report("❌ Не удалось обработать документ. Проверьте формат файла.")
+			return
+		case "embedding":
+			report(fmt.Sprintf("📥 Обрабатываю документ: %d/%d фрагментов", status.ChunksStored, status.ChunksTotal))
+		}
+	}
 }
 
 func (h *Handler) handleQuestion(ctx context.Context, userID string, chatID int64, question string, showContexts bool) {
@@ -225,7 +300,21 @@ func (h *Handler) handleQuestion(ctx context.Context, userID string, chatID int6
 	ctx, cancel := context.WithTimeout(ctx, 5*time.Minute)
 	defer cancel()
 
-	resp, err := h.service.Query(ctx, userID, question, 2)
+	// Пока модель генерирует, показываем ответ по частям,
+	// не чаще streamEditInterval — у Telegram лимит на редактирование.
+	lastEdit := time.Now()
+	onUpdate := func(answer string) {
+		if sentMsg.MessageID == 0 || time.Since(lastEdit) < streamEditInterval {
+			return
+		}
+		lastEdit = time.Now()
+		if len(answer) > 4000 {
+			answer = answer[:4000]
+		}
+		h.bot.Send(tgbot.NewEditMessageText(chatID, sentMsg.MessageID, answer+" ▌"))
+	}
+
+	resp, err := h.service.QueryStream(ctx, userID, question, string(ModeOffline), 2, onUpdate)
 	if err != nil {
 		log.Printf("Query error for user %s: %v", userID, err)
 		// Редактируем на ошибку
@@ -254,19 +343,20 @@ func (h *Handler) handleQuestion(ctx context.Context, userID string, chatID int6
 	}
 }
 
-func (h *Handler) handleDirectQuestion(ctx context.Context, chatID int64, question string) {
+func (h *Handler) handleDirectQuestion(ctx context.Context, userID string, chatID int64, question string) {
 	log.Printf("Direct question (online mode): %s", question)
 
 	ctx, cancel := context.WithTimeout(ctx, 30*time.Second)
 	defer cancel()
 
 	req := &pb.QueryRequest{
-		UserId:   "direct",
+		UserId:   userID,
 		Question: question,
 		TopK:     0,
+		Mode:     string(ModeOnline),
 	}
 
-	resp, err := h.service.mlClient.DirectQuery(ctx, req)
+	resp, err := h.service.mlClient().DirectQuery(ctx, req)
 	if err != nil {
 		log.Printf("Direct query error: %v", err)
 		h.sendError(chatID, "query failed")
@@ -335,7 +425,7 @@ func (h *Handler) handleStart(chatID int64) {
 
 func (h *Handler) handleListDocs(ctx context.Context, userID string, chatID int64) {
 	req := &pb.ListDocsRequest{UserId: userID}
-	resp, err := h.service.mlClient.ListDocuments(ctx, req)
+	resp, err := h.service.mlClient().ListDocuments(ctx, req)
 	if err != nil {
 		log.Printf("ListDocs error for user %s: %v", userID, err)
 		h.bot.Send(tgbot.NewMessage(chatID, "❌ Не удалось загрузить список документов"))
@@ -356,7 +446,7 @@ func (h *Handler) handleListDocs(ctx context.Context, userID string, chatID int6
 
 func (h *Handler) handleClearDocs(ctx context.Context, userID string, chatID int64) {
 	req := &pb.ClearDocsRequest{UserId: userID}
-	_, err := h.service.mlClient.ClearDocuments(ctx, req)
+	_, err := h.service.mlClient().ClearDocuments(ctx, req)
 	if err != nil {
 		log.Printf("ClearDocs error for user %s: %v", userID, err)
 		h.bot.Send(tgbot.NewMessage(chatID, "❌ Не удалось удалить документы"))
@@ -366,13 +456,16 @@ func (h *Handler) handleClearDocs(ctx context.Context, userID string, chatID int
 	h.bot.Send(tgbot.NewMessage(chatID, "🗑️ Все твои документы удалены. Пустыня чиста!"))
 }
 
-func (h *Handler) downloadFile(url string) ([]byte, error) {
+func (h *Handler) openFile(url string) (io.ReadCloser, error) {
 	resp, err := http.Get(url)
 	if err != nil {
 		return nil, err
 	}
-	defer resp.Body.Close()
-	return io.ReadAll(resp.Body)
+	if resp.StatusCode != http.StatusOK {
+		resp.Body.Close()
+		return nil, fmt.Errorf("download file: status %d", resp.StatusCode)
+	}
+	return resp.Body, nil
 }
 
 func (h *Handler) sendError(chatID int64, errMsg string) {
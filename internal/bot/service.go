@@ -3,12 +3,17 @@ package bot
 import (
 	"context"
 	"fmt"
+	"io"
+	"strings"
+	"sync/atomic"
 
 	pb "Felis_Margarita/pkg"
 )
 
 type Service struct {
-	mlClient pb.QnAClient
+	// по клиенту на соединение: вызовы раскладываются по ним по кругу
+	mlClients []pb.QnAClient
+	next      atomic.Uint64
 }
 
 type QueryResponse struct {
@@ -22,11 +27,22 @@ type Context struct {
 	Score   float32
 }
 
-func NewService(mlClient pb.QnAClient) *Service {
-	return &Service{mlClient: mlClient}
+// NewService принимает клиентов поверх отдельных соединений с ML-сервисом.
+// Воркеры сервиса слушают один порт (SO_REUSEPORT), и ядро распределяет
+// между ними соединения, а не вызовы, поэтому одно HTTP/2-соединение
+// всегда попадало бы в один и тот же воркер.
+func NewService(mlClients ...pb.QnAClient) *Service {
+	return &Service{mlClients: mlClients}
 }
 
-func (s *Service) UploadDocument(ctx context.Context, userID, filename string, data []byte) (string, error) {
+// mlClient возвращает клиента для очередного вызова
+func (s *Service) mlClient() pb.QnAClient {
+	return s.mlClients[(s.next.Add(1)-1)%uint64(len(s.mlClients))]
+}
+
+// UploadDocument ставит документ в очередь на индексацию и возвращает
+// id документа и id фоновой задачи (см. UploadStatus)
+func (s *Service) UploadDocument(ctx context.Context, userID, filename string, data []byte) (string, string, error) {
 	req := &pb.UploadDocRequest{
 		UserId:    userID,
 		Title:     filename,
@@ -34,12 +50,76 @@ func (s *Service) UploadDocument(ctx context.Context, userID, filename string, d
 		Filename:  filename,
 	}
 
-	resp, err := s.mlClient.UploadDocument(ctx, req)
+	resp, err := s.mlClient().UploadDocument(ctx, req)
+	if err != nil {
+		return "", "", err
+	}
+
+	return resp.DocId, resp.JobId, nil
+}
+
+// uploadChunkSize — размер куска файла в потоковой загрузке
+const uploadChunkSize = 64 * 1024
+
+// UploadDocumentStream отправляет файл кусками, не читая его целиком в память.
+// Возвращает id документа и id фоновой задачи, как UploadDocument.
+func (s *Service) UploadDocumentStream(ctx context.Context, userID, filename string, r io.Reader) (string, string, error) {
+	stream, err := s.mlClient().UploadDocumentStream(ctx)
+	if err != nil {
+		return "", "", err
+	}
+
+	meta := &pb.UploadChunk{
+		Payload: &pb.UploadChunk_Meta{Meta: &pb.UploadDocRequest{
+			UserId:   userID,
+			Title:    filename,
+			Filename: filename,
+		}},
+	}
+	if err := stream.Send(meta); err != nil {
+		return "", "", closeUploadStream(stream, err)
+	}
+
+	for {
+		buf := make([]byte, uploadChunkSize)
+		n, readErr := io.ReadFull(r, buf)
+		if n > 0 {
+			chunk := &pb.UploadChunk{Payload: &pb.UploadChunk_Data{Data: buf[:n]}}
+			if err := stream.Send(chunk); err != nil {
+				return "", "", closeUploadStream(stream, err)
+			}
+		}
+		if readErr == io.EOF || readErr == io.ErrUnexpectedEOF {
+			break
+		}
+		if readErr != nil {
+			stream.CloseSend()
+			return "", "", fmt.Errorf("read upload: %w", readErr)
+		}
+	}
+
+	resp, err := stream.CloseAndRecv()
 	if err != nil {
-		return "", err
+		return "", "", err
 	}
+	return resp.DocId, resp.JobId, nil
+}
 
-	return resp.DocId, nil
+// closeUploadStream: при io.EOF от Send настоящая ошибка приходит из CloseAndRecv
+func closeUploadStream(stream pb.QnA_UploadDocumentStreamClient, sendErr error) error {
+	if sendErr != io.EOF {
+		return sendErr
+	}
+	_, err := stream.CloseAndRecv()
+	return err
+}
+
+func (s *Service) UploadStatus(ctx context.Context, jobID string) (*pb.UploadStatusResponse, error) {
+	resp, err := s.mlClient().GetUploadStatus(ctx, &pb.UploadStatusRequest{JobId: jobID})
+	if err != nil {
+		return nil, fmt.Errorf("grpc upload status failed: %w", err)
+	}
+	return resp, nil
 }
 
 func (s *Service) Query(ctx context.Context, userID, question string, topK int32) (*QueryResponse, error) {
@@ -49,7 +129,7 @@ func (s *Service) Query(ctx context.Context, userID, question string, topK int32
 		TopK:     topK,
 	}
 
-	resp, err := s.mlClient.Query(ctx, req)
+	resp, err := s.mlClient().Query(ctx, req)
 	if err != nil {
 		return nil, fmt.Errorf("grpc query failed: %w", err)
 	}
@@ -67,4 +147,55 @@ func (s *Service) Query(ctx context.Context, userID, question string, topK int32
 		Answer:   resp.Answer,
 		Contexts: contexts,
 	}, nil
-}
\ No newline at end of file
+}
+
+// QueryStream получает ответ по мере генерации: onUpdate вызывается
+// с накопленным текстом ответа после каждой дельты.
+// mode передаётся с каждым запросом, чтобы режим одного пользователя не влиял на другого.
+func (s *Service) QueryStream(ctx context.Context, userID, question, mode string, topK int32, onUpdate func(answer string)) (*QueryResponse, error) {
+	req := &pb.QueryRequest{
+		UserId:   userID,
+		Question: question,
+		TopK:     topK,
+		Mode:     mode,
+	}
+
+	stream, err := s.mlClient().QueryStream(ctx, req)
+	if err != nil {
+		return nil, fmt.Errorf("grpc query stream failed: %w", err)
+	}
+
+	result := &QueryResponse{}
+	var answer strings.Builder
+	for {
+		msg, err := stream.Recv()
+		if err == io.EOF {
+			break
+		}
+		if err != nil {
+			return nil, fmt.Errorf("grpc query stream failed: %w", err)
+		}
+
+		for _, c := range msg.Contexts {
+			result.Contexts = append(result.Contexts, Context{
+				ChunkID: c.ChunkId,
+				Text:    c.Text,
+				Score:   c.Score,
+			})
+		}
+
+		if msg.Delta != "" {
+			answer.WriteString(msg.Delta)
+			if onUpdate != nil {
+				onUpdate(answer.String())
+			}
+		}
+
+		if msg.Done {
+			break
+		}
+	}
+
+	result.Answer = answer.String()
+	return result, nil
+}
@@ -0,0 +1,17 @@
+-- user_id прямо в chunks: фильтр по пользователю применяется
+-- во время обхода векторного индекса, без JOIN с documents
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS user_id TEXT;
+
+UPDATE chunks c
+SET user_id = d.user_id
+FROM documents d
+WHERE c.document_id = d.id AND c.user_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS documents_user_id_idx ON documents (user_id);
+CREATE INDEX IF NOT EXISTS chunks_document_id_idx ON chunks (document_id);
+CREATE INDEX IF NOT EXISTS chunks_user_id_idx ON chunks (user_id);
+
+-- ANN-индекс по косинусному расстоянию (оператор <=>)
+CREATE INDEX IF NOT EXISTS chunks_embedding_hnsw_idx
+  ON chunks USING hnsw (embedding vector_cosine_ops)
+  WITH (m = 16, ef_construction = 64);
@@ -0,0 +1,9 @@
+-- Положение чанка в документе: порядковый номер и смещения в символах
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS chunk_index INTEGER;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS char_start INTEGER;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS char_end INTEGER;
+
+-- Для старых чанков номер берётся из id вида {doc_id}_chunk_{n}
+UPDATE chunks
+SET chunk_index = substring(id FROM '_chunk_([0-9]+)$')::INTEGER
+WHERE chunk_index IS NULL AND id ~ '_chunk_[0-9]+$';
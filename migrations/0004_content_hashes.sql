@@ -0,0 +1,12 @@
+-- Хэши содержимого: дубликаты документов у пользователя и неизменившиеся
+-- чанки при повторной загрузке файла находятся без пересчёта эмбеддингов
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Хэш чанка совпадает с тем, что считает ingest.content_hash (sha256 от UTF-8)
+UPDATE chunks
+SET content_hash = encode(sha256(convert_to(chunk_text, 'UTF8')), 'hex')
+WHERE content_hash IS NULL;
+
+CREATE INDEX IF NOT EXISTS documents_user_hash_idx ON documents (user_id, content_hash);
+CREATE INDEX IF NOT EXISTS documents_user_filename_idx ON documents (user_id, filename);
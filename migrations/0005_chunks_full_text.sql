@@ -0,0 +1,9 @@
+-- Полнотекстовый индекс для гибридного поиска: точные номера, артикулы
+-- и редкие термины, которые плохо ловит векторная модель.
+-- Русская и английская морфология объединены в один tsvector
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS search_vector tsvector
+  GENERATED ALWAYS AS (
+    to_tsvector('russian', coalesce(chunk_text, '')) || to_tsvector('english', coalesce(chunk_text, ''))
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS chunks_search_vector_idx ON chunks USING gin (search_vector);
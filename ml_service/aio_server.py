@@ -0,0 +1,333 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import signal
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+import fm_pb2
+import fm_pb2_grpc
+import metrics
+from llm_client import validate_mode
+from scheduler import Rejected
+from server import (
+    QnAService, OLLAMA_WARMUP, SERVER_GRACE_PERIOD, SERVER_OPTIONS, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_MEMORY,
+)
+
+logger = logging.getLogger(__name__)
+
+class _ContextProxy:
+    """
+    Collects the status a sync handler sets, so it can run in an executor
+    thread and the status is applied to the aio context on the event loop
+    """
+
+    def __init__(self):
+        self.code = None
+        self.details = None
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def apply(self, context):
+        if self.code is not None:
+            context.set_code(self.code)
+        if self.details is not None:
+            context.set_details(self.details)
+
+def scheduled(lane, response=None):
+    """server.scheduled for coroutine and async generator methods"""
+    def decorate(method):
+        if inspect.isasyncgenfunction(method):
+            @functools.wraps(method)
+            async def stream(self, request, context):
+                with metrics.rpc(method.__name__, context):
+                    try:
+                        async with self.scheduler.aadmit(lane, context):
+                            async for message in method(self, request, context):
+                                yield message
+                    except Rejected as e:
+                        e.apply(context)
+            return stream
+
+        @functools.wraps(method)
+        async def unary(self, request, context):
+            with metrics.rpc(method.__name__, context):
+                try:
+                    async with self.scheduler.aadmit(lane, context):
+                        return await method(self, request, context)
+                except Rejected as e:
+                    e.apply(context)
+                    return response()
+        return unary
+    return decorate
+
+class AsyncQnAService(fm_pb2_grpc.QnAServicer):
+    """
+    asyncio twin of QnAService for grpc.aio.
+
+    Waiting on Ollama/GLM-4 is a coroutine; embedding runs in its own small
+    executor, and the rest of the blocking work (psycopg2, Redis, reranking)
+    in a shared one, so a slow generation never holds a thread.
+    """
+
+    def __init__(self, service=None):
+        self.service = service or QnAService()
+        self.scheduler = self.service.scheduler
+        self.embed_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("AIO_EMBED_WORKERS", "2")),
+            thread_name_prefix="aio-embed",
+        )
+        self.blocking_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("AIO_BLOCKING_WORKERS", "16")),
+            thread_name_prefix="aio-blocking",
+        )
+
+    async def _blocking(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.blocking_executor, functools.partial(fn, *args, **kwargs))
+
+    async def _embed(self, question):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.embed_executor, self.service._embed_question, question)
+
+    async def _delegate(self, handler, request, context):
+        """
+        Run a short sync handler of QnAService in the blocking executor.
+        The request waits for its lane here, on the event loop, not in a thread.
+        """
+        with metrics.rpc(handler.__name__, context):
+            try:
+                async with self.scheduler.aadmit(handler.lane, context):
+                    proxy = _ContextProxy()
+                    response = await self._blocking(handler.__wrapped__, self.service, request, proxy)
+            except Rejected as e:
+                e.apply(context)
+                return handler.rejected_response()
+            proxy.apply(context)
+            return response
+
+    async def SetMode(self, request, context):
+        return await self._delegate(self.service.SetMode, request, context)
+
+    async def UploadDocument(self, request, context):
+        return await self._delegate(self.service.UploadDocument, request, context)
+
+    async def GetUploadStatus(self, request, context):
+        return await self._delegate(self.service.GetUploadStatus, request, context)
+
+    async def ListDocuments(self, request, context):
+        return await self._delegate(self.service.ListDocuments, request, context)
+
+    async def ClearDocuments(self, request, context):
+        return await self._delegate(self.service.ClearDocuments, request, context)
+
+    @scheduled("bulk", fm_pb2.UploadDocResponse)
+    async def UploadDocumentStream(self, request_iterator, context):
+        spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY)
+        try:
+            meta = None
+            size = 0
+            async for chunk in request_iterator:
+                if chunk.WhichOneof("payload") == "meta":
+                    meta = chunk.meta
+                    continue
+
+                size += len(chunk.data)
+                if size > UPLOAD_MAX_BYTES:
+                    spool.close()
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    context.set_details(f"File is larger than {UPLOAD_MAX_BYTES} bytes")
+                    return fm_pb2.UploadDocResponse(doc_id="", status="error: file too large")
+                spool.write(chunk.data)
+
+            if meta is None:
+                spool.close()
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("Upload stream has no meta message")
+                return fm_pb2.UploadDocResponse(doc_id="", status="error")
+
+            if size == 0 and not meta.text:
+                spool.close()
+                logger.warning("No text extracted or provided")
+                return fm_pb2.UploadDocResponse(doc_id="", status="error: no text")
+
+            logger.info(f"Received {size} bytes of {meta.filename} via stream")
+            spool.seek(0)
+            proxy = _ContextProxy()
+            response = await self._blocking(self.service._queue_upload, meta, spool if size else None, proxy)
+            proxy.apply(context)
+            return response
+        except Exception as e:
+            spool.close()
+            logger.error(f"Streaming upload failed: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return fm_pb2.UploadDocResponse(doc_id="", status="error")
+
+    async def _check_mode(self, request, context):
+        """Aborts the call with INVALID_ARGUMENT if the request names an unknown mode"""
+        if request.mode:
+            try:
+                validate_mode(request.mode)
+            except ValueError as e:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    async def _prepare(self, request, question, context):
+        """
+        Mode, question embedding, cached answer and the corpus version it was
+        looked up in; blocking parts run in executors
+        """
+        mode = await self._blocking(self.service._resolve_mode, request)
+        self.scheduler.check(context, "embed")
+        question_embedding = await self._embed(question)
+        cached, version = await self._blocking(self.service._cached_answer, request, question, mode, question_embedding)
+        return mode, question_embedding, cached, version
+
+    async def _retrieve(self, request, question, question_embedding, context):
+        self.scheduler.check(context, "search")
+        found = await self._blocking(self.service._retrieve_contexts, request, question, question_embedding)
+        context_texts = await self._blocking(self.service._context_texts, found, question)
+        return self.service._context_chunks(found), context_texts
+
+    @scheduled("interactive", fm_pb2.QueryResponse)
+    async def Query(self, request, context):
+        await self._check_mode(request, context)
+        try:
+            question = request.question.strip()
+            if not question:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("Question is empty")
+                return fm_pb2.QueryResponse(answer="", contexts=[])
+
+            logger.info(f"Received query: {question}")
+
+            mode, question_embedding, cached, version = await self._prepare(request, question, context)
+            if cached:
+                answer, contexts = cached
+                return fm_pb2.QueryResponse(answer=answer, contexts=contexts)
+
+            contexts, context_texts = await self._retrieve(request, question, question_embedding, context)
+
+            self.scheduler.check(context, "llm")
+            logger.info(f"Calling LLM with {len(context_texts)} context(s)...")
+            answer = await self.service.llm.agenerate_answer(question, context_texts, mode=mode, user_id=request.user_id)
+            logger.info(f"LLM returned {len(answer)} chars")
+
+            await self._blocking(self.service._remember_answer, request, question, mode, question_embedding, version, answer, contexts)
+            return fm_pb2.QueryResponse(answer=answer, contexts=contexts)
+
+        except Rejected as e:
+            e.apply(context)
+            return fm_pb2.QueryResponse(answer="", contexts=[])
+        except Exception as e:
+            logger.exception("Query failed")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return fm_pb2.QueryResponse(answer="", contexts=[])
+
+    @scheduled("interactive")
+    async def QueryStream(self, request, context):
+        # Отмена клиентом отменяет эту корутину, а с ней закрывается и запрос к Ollama
+        await self._check_mode(request, context)
+        try:
+            question = request.question.strip()
+            if not question:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("Question is empty")
+                return
+
+            logger.info(f"Received streaming query: {question}")
+
+            mode, question_embedding, cached, version = await self._prepare(request, question, context)
+            if cached:
+                answer, contexts = cached
+                yield fm_pb2.QueryStreamResponse(contexts=contexts)
+                yield fm_pb2.QueryStreamResponse(delta=answer)
+                yield fm_pb2.QueryStreamResponse(done=True)
+                return
+
+            contexts, context_texts = await self._retrieve(request, question, question_embedding, context)
+            yield fm_pb2.QueryStreamResponse(contexts=contexts)
+
+            self.scheduler.check(context, "llm")
+            logger.info(f"Streaming LLM answer with {len(context_texts)} context(s)...")
+            deltas = []
+            async for delta in self.service.llm.astream_answer(question, context_texts, mode=mode, user_id=request.user_id):
+                deltas.append(delta)
+                yield fm_pb2.QueryStreamResponse(delta=delta)
+
+            await self._blocking(self.service._remember_answer, request, question, mode, question_embedding, version, "".join(deltas), contexts)
+            yield fm_pb2.QueryStreamResponse(done=True)
+
+        except asyncio.CancelledError:
+            logger.info("QueryStream cancelled by client")
+            raise
+        except Rejected as e:
+            e.apply(context)
+        except Exception as e:
+            logger.exception("QueryStream failed")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+
+    @scheduled("interactive", fm_pb2.QueryResponse)
+    async def DirectQuery(self, request, context):
+        await self._check_mode(request, context)
+        try:
+            question = request.question.strip()
+            if not question:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("Question is empty")
+                return fm_pb2.QueryResponse(answer="", contexts=[])
+
+            logger.info(f"Direct query: {question}")
+            # DirectQuery — свободный диалог, по умолчанию онлайн
+            mode = await self._blocking(self.service._resolve_mode, request, default="online")
+            self.scheduler.check(context, "llm")
+            answer = await self.service.llm.agenerate_answer(question, [], mode=mode)
+            logger.info(f"Direct answer: {len(answer)} chars")
+            return fm_pb2.QueryResponse(answer=answer, contexts=[])
+        except Rejected as e:
+            e.apply(context)
+            return fm_pb2.QueryResponse(answer="", contexts=[])
+        except Exception as e:
+            logger.exception("Direct query failed")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return fm_pb2.QueryResponse(answer="", contexts=[])
+
+async def serve(service=None):
+    """service: QnAService to wrap; built here unless given"""
+    max_rpcs = int(os.environ.get("AIO_MAX_CONCURRENT_RPCS", "0"))
+    server = grpc.aio.server(maximum_concurrent_rpcs=max_rpcs or None, options=SERVER_OPTIONS)
+    service = AsyncQnAService(service)
+    fm_pb2_grpc.add_QnAServicer_to_server(service, server)
+
+    port = os.environ.get("GRPC_PORT", "50051")
+    server.add_insecure_port(f"[::]:{port}")
+    await server.start()
+    if not metrics.MULTIPROCESS:
+        metrics.start_http_server()
+
+    loop = asyncio.get_running_loop()
+    if OLLAMA_WARMUP:
+        loop.run_in_executor(service.blocking_executor, service.service.llm.warm_up)
+
+    # SIGTERM: новые запросы не принимаются, начатые дорабатывают SERVER_GRACE_PERIOD
+    def drain():
+        logger.info(f"SIGTERM received, draining for up to {SERVER_GRACE_PERIOD:.0f}s")
+        loop.create_task(server.stop(SERVER_GRACE_PERIOD))
+    loop.add_signal_handler(signal.SIGTERM, drain)
+
+    logger.info(f"ML gRPC server (asyncio) running on port {port}")
+    try:
+        await server.wait_for_termination()
+    finally:
+        await service.service.llm.aclose()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class AnswerCache:
+    """
+    Cache of generated answers for repeated and near-duplicate questions.
+
+    Entries live in Redis next to the embedding cache and are scoped by user
+    and corpus version: any change to the user's documents bumps the version,
+    so stale answers are never served and simply expire by TTL. Within one
+    scope a hit is either the exact question or the closest cached question
+    with cosine similarity above the threshold; at most max_entries answers
+    are kept per scope, least recently used ones are evicted first.
+
+    Retrieval settings (top_k, search mode, ...) are part of the scope too:
+    the same question asked with other settings gets its own answer.
+    """
+
+    def __init__(self, cache):
+        self.client = cache.client
+        self.threshold = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+        self.ttl = int(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+        self.max_entries = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "64"))
+        self.enabled = os.environ.get("ANSWER_CACHE_ENABLED", "1") == "1" and self.client is not None
+
+    def _version_key(self, user_id):
+        return f"corpus:{user_id}"
+
+    def _keys(self, user_id, version, settings):
+        scope = f"{user_id}:{version}:{settings}"
+        return f"ans:{scope}", f"ansemb:{scope}", f"anslru:{scope}"
+
+    def _entry_id(self, question):
+        return hashlib.md5(" ".join(question.lower().split()).encode()).hexdigest()
+
+    def _version(self, user_id):
+        data = self.client.get(self._version_key(user_id))
+        return int(data) if data else 0
+
+    def invalidate(self, user_id):
+        """Called whenever the user's documents change"""
+        if not self.enabled:
+            return
+        try:
+            self.client.incr(self._version_key(user_id))
+        except Exception as e:
+            logger.error(f"Answer cache invalidation failed: {e}")
+
+    def lookup(self, user_id, question, embedding, settings=""):
+        """
+        Returns (entry, version): the cached {"answer", "contexts"} dict or None,
+        and the corpus version it was looked up in. A new answer must be
+        stored under that version, so that one generated while the documents
+        changed is filed under the old corpus and never served.
+        """
+        if not self.enabled:
+            return None, None
+        try:
+            version = self._version(user_id)
+            answers_key, embeddings_key, lru_key = self._keys(user_id, version, settings)
+
+            entry_id = self._entry_id(question)
+            if not self.client.hexists(answers_key, entry_id):
+                entry_id = self._nearest(embeddings_key, embedding)
+                if entry_id is None:
+                    return None, version
+
+            data = self.client.hget(answers_key, entry_id)
+            if not data:
+                return None, version
+            self.client.zadd(lru_key, {entry_id: time.time()})
+            logger.info(f"Answer cache hit for user {user_id}")
+            return json.loads(data), version
+        except Exception as e:
+            logger.error(f"Answer cache lookup failed: {e}")
+            return None, None
+
+    def _nearest(self, embeddings_key, embedding):
+        stored = self.client.hgetall(embeddings_key)
+        if not stored:
+            return None
+
+        entry_ids = list(stored.keys())
+        matrix = np.stack([np.frombuffer(stored[i], dtype=np.float32) for i in entry_ids])
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return entry_ids[best].decode()
+
+    def store(self, user_id, question, embedding, answer, contexts, version, settings=""):
+        """
+        contexts: list of {"chunk_id", "text", "score"} dicts
+        version: corpus version returned by lookup() before the answer was generated
+        """
+        if not self.enabled or version is None:
+            return
+        try:
+            answers_key, embeddings_key, lru_key = self._keys(user_id, version, settings)
+            entry_id = self._entry_id(question)
+            payload = json.dumps({"answer": answer, "contexts": contexts}, ensure_ascii=False)
+
+            pipe = self.client.pipeline()
+            pipe.hset(answers_key, entry_id, payload)
+            pipe.hset(embeddings_key, entry_id, np.asarray(embedding, dtype=np.float32).tobytes())
+            pipe.zadd(lru_key, {entry_id: time.time()})
+            for key in (answers_key, embeddings_key, lru_key):
+                pipe.expire(key, self.ttl)
+            pipe.zcard(lru_key)
+            size = pipe.execute()[-1]
+
+            if size > self.max_entries:
+                evicted = [member for member, _ in self.client.zpopmin(lru_key, size - self.max_entries)]
+                self.client.hdel(answers_key, *evicted)
+                self.client.hdel(embeddings_key, *evicted)
+        except Exception as e:
+            logger.error(f"Answer cache store failed: {e}")
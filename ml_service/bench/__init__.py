@@ -0,0 +1 @@
+"""Load-testing harness, see __main__.py"""
@@ -0,0 +1,262 @@
+"""
+Load test of the ML service.
+
+Starts the gRPC server in a child process against a fake Ollama, an
+in-memory database (or a throwaway pgvector Postgres via --dsn) and
+fakeredis (or a local Redis via --redis-url), drives a mixed workload at
+each concurrency level and prints a JSON report: p50/p95/p99 per
+operation, QPS and the server's peak RSS.
+
+    cd ml_service && python -m bench --concurrency 1,8,32 --duration 30 --output report.json
+    python -m bench --baseline report.json   # exit code 1 on a regression
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+from bench.fakes import FakeOllama
+from bench.workload import Corpus, Workload, parse_mix
+
+logger = logging.getLogger("bench")
+
+MIGRATIONS = Path(__file__).resolve().parents[2] / "migrations"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Load test of the ML gRPC service")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated client thread counts, one level each")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per level")
+    parser.add_argument("--mix", default="query=0.8,upload=0.1,list=0.1",
+                        help="operation weights: query, query_stream, upload, list")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--seed-docs", type=int, default=2, help="documents per user ingested before the first level")
+    parser.add_argument("--doc-sentences", type=int, default=200, help="sentences per generated document")
+    parser.add_argument("--timeout", type=float, default=60, help="deadline of every RPC, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ollama-token-rate", type=float, default=200, help="fake Ollama tokens per second")
+    parser.add_argument("--ollama-latency", type=float, default=0.05, help="fake Ollama time to first token, seconds")
+    parser.add_argument("--ollama-tokens", type=int, default=32, help="tokens per fake answer")
+    parser.add_argument("--ollama-parallel", type=int, default=4, help="generations the fake Ollama runs at once")
+    parser.add_argument("--dsn", help="empty pgvector Postgres to use instead of the in-memory database")
+    parser.add_argument("--redis-url", help="local Redis to use instead of fakeredis")
+    parser.add_argument("--embedder", choices=("model", "hash"), default="model",
+                        help="'hash' skips the embedding model and measures the serving path alone")
+    parser.add_argument("--output", help="write the report here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/QPS regression, fraction")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's INFO logs")
+    return parser.parse_args(argv)
+
+def apply_migrations(dsn):
+    """Same as entrypoint.sh: apply migrations/*.sql not yet in schema_migrations"""
+    import psycopg2
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version TEXT PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE DEFAULT now())")
+        for migration in sorted(MIGRATIONS.glob("*.sql")):
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (migration.name,))
+            if cur.fetchone():
+                continue
+            logger.info(f"Applying {migration.name}")
+            cur.execute(migration.read_text(encoding="utf-8"))
+            cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (migration.name,))
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _build_service(args):
+    """QnAService wired to the stand-ins; runs in the server process"""
+    import server
+    from ingest import IngestionPipeline
+    from prompt_builder import PromptBuilder
+    from redis_cache import RedisCache
+
+    if args.embedder == "hash":
+        from bench.fakes import HashEmbedder
+        models = {"embedder": HashEmbedder(RedisCache(model="bench-hash")), "reranker": None, "prompts": PromptBuilder()}
+    else:
+        models = server.load_models()
+
+    cache = models["embedder"].cache
+    if args.redis_url:
+        import redis
+        cache.client = redis.Redis.from_url(args.redis_url)
+    else:
+        try:
+            import fakeredis
+            cache.client = fakeredis.FakeRedis()
+        except ImportError:
+            logger.warning("fakeredis is not installed, running without Redis (pip install fakeredis or pass --redis-url)")
+            cache.client = None
+
+    service = server.QnAService(models)
+    if not args.dsn:
+        from bench.fakes import MemoryDatabase
+        service.db = MemoryDatabase()
+        service.ingestion = IngestionPipeline(
+            service.db, service.extractor, service.embedder,
+            on_corpus_change=service.answers.invalidate,
+            status_cache=cache,
+        )
+    return service
+
+def start_server(args, ollama_url, port):
+    """Fork the server process; the parent keeps no gRPC state across the fork"""
+    os.environ.update({
+        "GRPC_PORT": str(port),
+        "METRICS_PORT": "0",
+        "OLLAMA_BASE_URL": ollama_url,
+        "SERVER_GRACE_PERIOD": "1",
+        "DATABASE_DSN": args.dsn or "",
+    })
+    pid = os.fork()
+    if pid:
+        return pid
+
+    code = 0
+    try:
+        import server
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        server.serve(_build_service(args))
+    except Exception:
+        logger.exception("Benchmark server failed")
+        code = 1
+    finally:
+        os._exit(code)
+
+def wait_ready(channel, pid, timeout=600):
+    """Wait for the server to accept calls; loading models may take minutes"""
+    import grpc
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            grpc.channel_ready_future(channel).result(timeout=1)
+            return
+        except grpc.FutureTimeoutError:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                raise RuntimeError(f"Benchmark server exited with {os.waitstatus_to_exitcode(status)}")
+    raise TimeoutError(f"Benchmark server not ready after {timeout}s")
+
+def stop_server(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+
+def _memory(pid):
+    """Current and peak RSS of the process in MB, from /proc"""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return {}
+    fields = dict(line.split(":", 1) for line in status.splitlines() if ":" in line)
+    return {
+        "rss_mb": round(int(fields["VmRSS"].split()[0]) / 1024, 1),
+        "peak_rss_mb": round(int(fields["VmHWM"].split()[0]) / 1024, 1),
+    }
+
+def _reset_peak(pid):
+    # "5" в clear_refs сбрасывает VmHWM, чтобы пик считался для каждого уровня отдельно
+    try:
+        Path(f"/proc/{pid}/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+def compare(report, baseline, tolerance):
+    """Regressions of report against baseline, as human-readable lines"""
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    regressions = []
+    for level in report["levels"]:
+        before = previous.get(level["concurrency"])
+        if not before:
+            continue
+        for operation, stats in level["operations"].items():
+            old = before["operations"].get(operation)
+            if not old or "p95_ms" not in old or "p95_ms" not in stats:
+                continue
+            where = f"{operation} @ {level['concurrency']}"
+            if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{where}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats["qps"] < old["qps"] * (1 - tolerance):
+                regressions.append(f"{where}: QPS {old['qps']} -> {stats['qps']}")
+    return regressions
+
+def run(args):
+    import grpc
+    import fm_pb2_grpc
+
+    ollama = FakeOllama(args.ollama_token_rate, args.ollama_latency, args.ollama_tokens, args.ollama_parallel)
+    ollama_url = ollama.start()
+    if args.dsn:
+        apply_migrations(args.dsn)
+
+    port = _free_port()
+    pid = start_server(args, ollama_url, port)
+    report = {"config": vars(args), "seed_ingestion": None, "levels": []}
+    try:
+        channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+        wait_ready(channel, pid)
+        workload = Workload(
+            fm_pb2_grpc.QnAStub(channel), Corpus(args.seed, args.doc_sentences), parse_mix(args.mix),
+            users=args.users, timeout=args.timeout, seed=args.seed,
+        )
+        logger.info(f"Ingesting {args.seed_docs} document(s) for each of {args.users} users")
+        report["seed_ingestion"] = workload.seed_documents(args.seed_docs)
+
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            _reset_peak(pid)
+            logger.info(f"Running {concurrency} client(s) for {args.duration:.0f}s")
+            recorder, elapsed = workload.run(concurrency, args.duration)
+            operations = recorder.summary(elapsed)
+            requests = sum(stats["count"] + stats["errors"] for stats in operations.values())
+            level = {
+                "concurrency": concurrency,
+                "seconds": round(elapsed, 2),
+                "requests": requests,
+                "errors": sum(stats["errors"] for stats in operations.values()),
+                "qps": round(requests / elapsed, 2),
+                "operations": operations,
+            }
+            level.update(_memory(pid))
+            if recorder.jobs:
+                level["ingestion"] = workload.wait_for_jobs(recorder)
+            report["levels"].append(level)
+        channel.close()
+    finally:
+        stop_server(pid)
+        ollama.stop()
+
+    report["peak_rss_mb"] = max((level.get("peak_rss_mb", 0) for level in report["levels"]), default=None)
+    return report
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    args = parse_args(argv)
+    report = run(args)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for line in regressions:
+            logger.error(f"Regression: {line}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
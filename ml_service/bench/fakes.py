@@ -0,0 +1,240 @@
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from chunker import Chunker
+
+class FakeOllama:
+    """
+    Stand-in for Ollama's /api/generate: the first token comes after
+    `latency` seconds, then `token_rate` tokens per second. At most
+    `parallel` generations run at once, like OLLAMA_NUM_PARALLEL.
+    """
+
+    def __init__(self, token_rate=200.0, latency=0.05, answer_tokens=32, parallel=4):
+        self.token_rate = token_rate
+        self.latency = latency
+        self.answer_tokens = answer_tokens
+        self.slots = threading.Semaphore(parallel)
+        self.httpd = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                tokens = self._tokens(body)
+                with fake.slots:
+                    if body.get("stream"):
+                        self._stream(tokens)
+                    else:
+                        self._generate(tokens)
+
+            def _tokens(self, body):
+                limit = (body.get("options") or {}).get("num_predict")
+                return min(fake.answer_tokens, limit) if limit else fake.answer_tokens
+
+            def _final(self, tokens, started):
+                return {
+                    "done": True,
+                    "context": [1, 2, 3],
+                    "eval_count": tokens,
+                    "eval_duration": int((time.monotonic() - started) * 1e9),
+                }
+
+            def _generate(self, tokens):
+                time.sleep(fake.latency)
+                started = time.monotonic()
+                time.sleep(tokens / fake.token_rate)
+                payload = dict(self._final(tokens, started), response=" ".join(["ответ"] * tokens))
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, tokens):
+                # HTTP/1.0: конец потока - закрытие соединения
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                time.sleep(fake.latency)
+                started = time.monotonic()
+                for _ in range(tokens):
+                    time.sleep(1 / fake.token_rate)
+                    self.wfile.write(json.dumps({"response": " ответ", "done": False}).encode() + b"\n")
+                    self.wfile.flush()
+                self.wfile.write(json.dumps(self._final(tokens, started)).encode() + b"\n")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="fake-ollama", daemon=True).start()
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+class MemoryDatabase:
+    """
+    In-memory substitute for db.Database with the methods QnAService and
+    IngestionPipeline use. Search is an exact cosine scan of the user's
+    chunks; "hybrid" mode ranks the same way as "vector".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}  # doc_id -> dict
+        self._chunks = {}  # chunk_id -> row of save_chunks
+        self._index = {}  # user_id -> (rows, нормированная матрица эмбеддингов)
+        self._clock = 0
+
+    def _touch(self, user_id):
+        self._index.pop(user_id, None)
+
+    def save_document(self, doc_id, user_id, title, filename, content_hash=None):
+        with self._lock:
+            self._clock += 1
+            self._documents.setdefault(doc_id, {
+                "user_id": user_id, "title": title, "filename": filename,
+                "content_hash": content_hash, "created": self._clock,
+            })
+
+    def find_document_by_hash(self, user_id, content_hash):
+        return self._find_document("content_hash", user_id, content_hash)
+
+    def find_document_by_filename(self, user_id, filename):
+        return self._find_document("filename", user_id, filename)
+
+    def _find_document(self, column, user_id, value):
+        with self._lock:
+            found = [
+                (doc["created"], doc_id) for doc_id, doc in self._documents.items()
+                if doc["user_id"] == user_id and doc[column] == value
+            ]
+        return max(found)[1] if found else None
+
+    def get_chunk_hashes(self, doc_id):
+        with self._lock:
+            rows = sorted((row for row in self._chunks.values() if row[1] == doc_id), key=lambda row: row[3])
+        hashes = {}
+        for row in rows:
+            hashes.setdefault(row[6], []).append(row[0])
+        return hashes
+
+    def save_chunks(self, chunks):
+        with self._lock:
+            for row in chunks:
+                self._chunks[row[0]] = row
+                self._touch(row[2])
+
+    def replace_document_chunks(self, doc_id, user_id, title, content_hash, draft_id, kept_chunks):
+        with self._lock:
+            keep = {chunk[0] for chunk in kept_chunks}
+            for chunk_id in [cid for cid, row in self._chunks.items() if row[1] == doc_id and cid not in keep]:
+                del self._chunks[chunk_id]
+            for chunk_id, index, start, end in kept_chunks:
+                row = self._chunks[chunk_id]
+                self._chunks[chunk_id] = row[:3] + (index, start, end) + row[6:]
+            for chunk_id, row in list(self._chunks.items()):
+                if row[1] == draft_id:
+                    self._chunks[chunk_id] = (chunk_id, doc_id, user_id) + row[3:]
+            self._documents.pop(draft_id, None)
+            self._documents[doc_id].update(title=title, content_hash=content_hash)
+            self._touch(user_id)
+
+    def publish_document(self, doc_id, user_id):
+        with self._lock:
+            for chunk_id, row in list(self._chunks.items()):
+                if row[1] == doc_id:
+                    self._chunks[chunk_id] = row[:2] + (user_id,) + row[3:]
+            self._documents[doc_id]["user_id"] = user_id
+            self._touch(user_id)
+
+    def search_chunks(self, user_id, embedding, top_k=5, ef_search=None, question=None, search_mode="vector"):
+        with self._lock:
+            if user_id not in self._index:
+                rows = [row for row in self._chunks.values() if row[2] == user_id]
+                matrix = np.stack([row[8] for row in rows]).astype(np.float32) if rows else None
+                if matrix is not None:
+                    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+                self._index[user_id] = (rows, matrix)
+            rows, matrix = self._index[user_id]
+        if not rows:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = matrix @ (query / (np.linalg.norm(query) + 1e-12))
+        best = np.argsort(-scores)[:top_k]
+        return [
+            (rows[i][0], rows[i][7], float(scores[i]), rows[i][1], rows[i][3], rows[i][4], rows[i][5])
+            for i in best
+        ]
+
+    def list_user_documents(self, user_id):
+        with self._lock:
+            docs = sorted(
+                (doc for doc in self._documents.values() if doc["user_id"] == user_id),
+                key=lambda doc: doc["created"], reverse=True,
+            )
+        return [doc["title"] for doc in docs]
+
+    def delete_document(self, doc_id):
+        with self._lock:
+            doc = self._documents.pop(doc_id, None)
+            for chunk_id in [cid for cid, row in self._chunks.items() if row[1] == doc_id]:
+                del self._chunks[chunk_id]
+            if doc:
+                self._touch(doc["user_id"])
+
+    def clear_user_documents(self, user_id):
+        with self._lock:
+            for doc_id in [d for d, doc in self._documents.items() if doc["user_id"] == user_id]:
+                del self._documents[doc_id]
+            for chunk_id in [cid for cid, row in self._chunks.items() if row[2] == user_id]:
+                del self._chunks[chunk_id]
+            self._touch(user_id)
+
+class HashEmbedder:
+    """
+    Embedder without a model: word hashes folded into 384 dimensions.
+    Retrieval quality is meaningless, but the rest of the serving path
+    (cache, search, prompt, LLM) is exercised as usual.
+    """
+
+    dimension = 384
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode()) % self.dimension] += 1.0
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def embed_text(self, text):
+        cached = self.cache.get_embedding(text)
+        if cached is not None:
+            return cached
+        embedding = self._vector(text)
+        self.cache.set_embedding(text, embedding)
+        return embedding
+
+    def embed_batch(self, texts):
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.stack([self.embed_text(text) for text in texts])
+
+    def make_chunker(self, **kwargs):
+        return Chunker(strategy="chars", **kwargs)
@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+import grpc
+import numpy as np
+
+import fm_pb2
+
+OPERATIONS = ("query", "query_stream", "upload", "list")
+
+_WORDS = (
+    "отпуск договор сотрудник заявление оплата срок отчёт проект бюджет склад поставка "
+    "клиент счёт налог график смена премия обучение доступ пароль сервер база резерв "
+    "contract invoice report budget server backup access policy schedule payment"
+).split()
+
+def parse_mix(spec):
+    """"query=0.8,upload=0.1,list=0.1" -> {operation: weight}"""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class Corpus:
+    """Seeded synthetic documents and questions about them"""
+
+    def __init__(self, seed=0, sentences=200):
+        self.rng = random.Random(seed)
+        self.sentences = sentences
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def _sentence(self, rng):
+        words = rng.choices(_WORDS, k=rng.randint(6, 16))
+        return " ".join(words).capitalize() + "."
+
+    def document(self):
+        with self._lock:
+            self._counter += 1
+            number = self._counter
+            rng = random.Random(self.rng.random())
+        text = " ".join(self._sentence(rng) for _ in range(self.sentences))
+        return f"bench_{number}.txt", text
+
+    def question(self, rng):
+        return f"Что сказано про {' '.join(rng.sample(_WORDS, 3))}?"
+
+class Recorder:
+    """Latencies and status codes per operation, shared by all client threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.jobs = []
+
+    def record(self, operation, seconds, code):
+        with self._lock:
+            if code == grpc.StatusCode.OK:
+                self.latencies[operation].append(seconds)
+            else:
+                self.errors[operation][code.name] += 1
+
+    def summary(self, elapsed):
+        operations = {}
+        for operation in sorted(set(self.latencies) | set(self.errors)):
+            latencies = np.array(self.latencies[operation]) * 1000
+            errors = dict(self.errors[operation])
+            stats = {
+                "count": len(latencies),
+                "errors": sum(errors.values()),
+                "error_codes": errors,
+                "qps": round(len(latencies) / elapsed, 2),
+            }
+            if len(latencies):
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                stats.update(
+                    p50_ms=round(float(p50), 2), p95_ms=round(float(p95), 2), p99_ms=round(float(p99), 2),
+                    mean_ms=round(float(latencies.mean()), 2), max_ms=round(float(latencies.max()), 2),
+                )
+            operations[operation] = stats
+        return operations
+
+class Workload:
+    """
+    Drives a mixed workload against a QnA stub from `concurrency` threads,
+    each picking the next operation by the mix weights.
+    """
+
+    def __init__(self, stub, corpus, mix, users=8, timeout=60.0, seed=0):
+        self.stub = stub
+        self.corpus = corpus
+        self.mix = mix
+        self.users = [f"bench_user_{i}" for i in range(users)]
+        self.timeout = timeout
+        self.seed = seed
+
+    def seed_documents(self, per_user):
+        """Upload per_user documents for every user and wait until they are ingested"""
+        recorder = Recorder()
+        for user_id in self.users:
+            for _ in range(per_user):
+                self._upload(user_id, recorder)
+        return self.wait_for_jobs(recorder)
+
+    def run(self, concurrency, duration):
+        recorder = Recorder()
+        deadline = time.monotonic() + duration
+        operations = list(self.mix)
+        weights = [self.mix[name] for name in operations]
+
+        def worker(number):
+            rng = random.Random(self.seed * 1000 + number)
+            while time.monotonic() < deadline:
+                operation = rng.choices(operations, weights)[0]
+                getattr(self, f"_{operation}")(rng.choice(self.users), recorder, rng)
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return recorder, time.monotonic() - started
+
+    def wait_for_jobs(self, recorder, timeout=600.0):
+        """Poll upload jobs until all are finished; returns (done, failed, seconds)"""
+        started = time.monotonic()
+        pending = list(recorder.jobs)
+        done = failed = 0
+        while pending and time.monotonic() - started < timeout:
+            still = []
+            for job_id in pending:
+                status = self.stub.GetUploadStatus(fm_pb2.UploadStatusRequest(job_id=job_id), timeout=self.timeout)
+                if status.state == "done":
+                    done += 1
+                elif status.state == "failed":
+                    failed += 1
+                else:
+                    still.append(job_id)
+            pending = still
+            if pending:
+                time.sleep(0.2)
+        return {"done": done, "failed": failed, "pending": len(pending), "seconds": round(time.monotonic() - started, 2)}
+
+    def _call(self, operation, recorder, fn):
+        started = time.monotonic()
+        try:
+            result = fn()
+            code = grpc.StatusCode.OK
+        except grpc.RpcError as e:
+            result, code = None, e.code()
+        recorder.record(operation, time.monotonic() - started, code)
+        return result
+
+    def _query(self, user_id, recorder, rng):
+        request = fm_pb2.QueryRequest(user_id=user_id, question=self.corpus.question(rng), mode="offline")
+        self._call("query", recorder, lambda: self.stub.Query(request, timeout=self.timeout))
+
+    def _query_stream(self, user_id, recorder, rng):
+        request = fm_pb2.QueryRequest(user_id=user_id, question=self.corpus.question(rng), mode="offline")
+        self._call("query_stream", recorder, lambda: list(self.stub.QueryStream(request, timeout=self.timeout)))
+
+    def _upload(self, user_id, recorder, rng=None):
+        filename, text = self.corpus.document()
+        request = fm_pb2.UploadDocRequest(user_id=user_id, title=filename, filename=filename, text=text)
+        response = self._call("upload", recorder, lambda: self.stub.UploadDocument(request, timeout=self.timeout))
+        if response is not None and response.job_id:
+            recorder.jobs.append(response.job_id)
+
+    def _list(self, user_id, recorder, rng):
+        request = fm_pb2.ListDocsRequest(user_id=user_id)
+        self._call("list", recorder, lambda: self.stub.ListDocuments(request, timeout=self.timeout))
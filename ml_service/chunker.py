@@ -0,0 +1,145 @@
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+STRATEGIES = ("tokens", "chars")
+
+# Граница предложения: знак конца (с закрывающими кавычками/скобками) и пробелы
+# после него, либо пустая строка между абзацами
+_BOUNDARY = re.compile(r"[.!?…]+[\"'»”)\]]*\s+|\n\s*\n\s*")
+
+# text: текст чанка; start/end: смещения в символах от начала документа
+Chunk = namedtuple("Chunk", ["text", "start", "end"])
+
+class Chunker:
+    """
+    Splits text into overlapping chunks made of whole sentences.
+
+    Strategy "tokens" packs sentences up to max_tokens of the embedding
+    model's tokenizer, so no chunk is truncated by the model; "chars"
+    packs them by character count and needs no tokenizer.
+    """
+
+    def __init__(self, tokenizer=None, strategy=None, max_tokens=None, overlap_tokens=None,
+                 chunk_size=None, overlap=None, model_max_tokens=256):
+        self.strategy = strategy or os.environ.get("CHUNK_STRATEGY", "tokens")
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Chunk strategy must be one of {', '.join(STRATEGIES)}")
+        if self.strategy == "tokens" and tokenizer is None:
+            raise ValueError("Token-based chunking needs a tokenizer")
+        self.tokenizer = tokenizer
+
+        if self.strategy == "tokens":
+            # all-MiniLM-L6-v2 обучалась на последовательностях до 128 токенов;
+            # два места в окне модели занимают [CLS] и [SEP]
+            size = max_tokens or int(os.environ.get("CHUNK_MAX_TOKENS", "128"))
+            self.size = min(size, model_max_tokens - 2)
+            self.overlap = overlap_tokens if overlap_tokens is not None else int(os.environ.get("CHUNK_OVERLAP_TOKENS", "16"))
+        else:
+            self.size = chunk_size or int(os.environ.get("CHUNK_SIZE", "400"))
+            self.overlap = overlap if overlap is not None else int(os.environ.get("CHUNK_OVERLAP", "50"))
+
+    def split(self, text, offset=0):
+        """
+        Split text into chunks.
+        offset is the position of text in the whole document.
+        Returns: list of Chunk
+        """
+        starts, ends = self._sentences(text)
+        if not len(starts):
+            return []
+        starts, ends, lengths = self._measure(text, starts, ends)
+
+        # cumulative[i] - длина всех предложений до i-го: граница чанка ищется
+        # бинарным поиском, а не проходом по символам
+        cumulative = np.concatenate(([0], np.cumsum(lengths)))
+        chunks = []
+        first = 0
+        count = len(starts)
+        while first < count:
+            last = int(np.searchsorted(cumulative, cumulative[first] + self.size, side="right")) - 1
+            last = max(last, first + 1)
+            chunks.append(self._make_chunk(text, starts[first], ends[last - 1], offset))
+            if last >= count:
+                break
+            # следующий чанк начинается с последних предложений текущего в пределах overlap
+            next_first = int(np.searchsorted(cumulative, cumulative[last] - self.overlap, side="left"))
+            first = max(next_first, first + 1)
+        return chunks
+
+    def _sentences(self, text):
+        """Sentence spans as (starts, ends) arrays, without surrounding whitespace"""
+        ends = np.fromiter((m.end() for m in _BOUNDARY.finditer(text)), dtype=np.int64)
+        if not len(ends) or ends[-1] != len(text):
+            ends = np.append(ends, len(text))
+        starts = np.concatenate(([0], ends[:-1]))
+
+        # Пробелы по краям не входят в предложение
+        spans = [
+            (start + len(sentence) - len(sentence.lstrip()), start + len(sentence.rstrip()))
+            for start, sentence in ((int(s), text[s:e]) for s, e in zip(starts, ends))
+            if sentence and not sentence.isspace()
+        ]
+        if not spans:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        starts, ends = np.array(spans, dtype=np.int64).T
+        return starts, ends
+
+    def _measure(self, text, starts, ends):
+        """Sentence lengths in the strategy's units; sentences longer than a chunk are split"""
+        if self.strategy == "chars":
+            # пробел между предложениями тоже занимает место в чанке
+            lengths = np.append(starts[1:], ends[-1]) - starts
+            if lengths.max() <= self.size:
+                return starts, ends, lengths
+            return self._split_long(text, starts, ends, lengths, self._split_chars)
+
+        sentences = [text[s:e] for s, e in zip(starts, ends)]
+        encoded = self.tokenizer(sentences, add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False)
+        lengths = np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(sentences))
+        if lengths.max() <= self.size:
+            return starts, ends, lengths
+        return self._split_long(text, starts, ends, lengths, self._split_tokens)
+
+    def _split_long(self, text, starts, ends, lengths, split_fn):
+        spans = []
+        for start, end, length in zip(starts.tolist(), ends.tolist(), lengths.tolist()):
+            if length <= self.size:
+                spans.append((start, end, length))
+            else:
+                spans.extend(split_fn(text, start, end))
+        starts, ends, lengths = np.array(spans, dtype=np.int64).T
+        return starts, ends, lengths
+
+    def _split_chars(self, text, start, end):
+        """Cut an over-long sentence at whitespace, or hard at the chunk size"""
+        pieces = []
+        while end - start > self.size:
+            cut = text.rfind(" ", start + 1, start + self.size)
+            if cut <= start:
+                cut = start + self.size
+            pieces.append((start, cut, cut - start))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        pieces.append((start, end, end - start))
+        return pieces
+
+    def _split_tokens(self, text, start, end):
+        """Cut an over-long sentence every self.size tokens, using token offsets"""
+        offsets = self.tokenizer(
+            text[start:end], add_special_tokens=False, return_offsets_mapping=True
+        )["offset_mapping"]
+        pieces = []
+        for i in range(0, len(offsets), self.size):
+            window = offsets[i:i + self.size]
+            piece_end = start + offsets[i + self.size][0] if i + self.size < len(offsets) else end
+            pieces.append((start + window[0][0], piece_end, len(window)))
+        return pieces
+
+    def _make_chunk(self, text, start, end, offset):
+        start, end = int(start), int(end)
+        chunk_text = text[start:end].rstrip()
+        return Chunk(chunk_text, offset + start, offset + start + len(chunk_text))
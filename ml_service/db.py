@@ -1,88 +1,470 @@
 import psycopg2
+from psycopg2 import pool
 from psycopg2.extras import execute_values
+from contextlib import contextmanager
+import io
+import itertools
 import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Бинарный формат COPY: сигнатура, флаги, длина расширения заголовка; в конце -1
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_CHUNK_COLUMNS = "id, document_id, user_id, chunk_index, char_start, char_end, content_hash, chunk_text, embedding"
+
+SEARCH_MODES = ("vector", "hybrid")
+
+# Гибридный поиск: до N кандидатов из HNSW и из полнотекстового индекса,
+# объединённых reciprocal rank fusion: score = сумма 1 / (k + ранг).
+# Слова вопроса объединяются через OR (plainto_tsquery соединяет их через AND),
+# чтобы находились чанки, где встречается хотя бы редкий термин или номер
+_HYBRID_SEARCH_SQL = """
+    WITH terms AS (
+        SELECT replace(plainto_tsquery('russian', %(question)s)::text, '&', '|')::tsquery
+            || replace(plainto_tsquery('english', %(question)s)::text, '&', '|')::tsquery AS ts
+    ),
+    vector AS (
+        SELECT id, row_number() OVER (ORDER BY distance) AS rank
+        FROM (
+            SELECT c.id, c.embedding <=> %(embedding)s::vector AS distance
+            FROM chunks c
+            WHERE c.user_id = %(user_id)s
+            ORDER BY c.embedding <=> %(embedding)s::vector
+            LIMIT %(candidates)s
+        ) v
+    ),
+    lexical AS (
+        SELECT id, row_number() OVER (ORDER BY score DESC) AS rank
+        FROM (
+            SELECT c.id, ts_rank_cd(c.search_vector, terms.ts) AS score
+            FROM chunks c, terms
+            WHERE c.user_id = %(user_id)s AND c.search_vector @@ terms.ts
+            ORDER BY score DESC
+            LIMIT %(candidates)s
+        ) l
+    ),
+    fused AS (
+        SELECT id, sum(1.0 / (%(rrf_k)s + rank)) AS score
+        FROM (SELECT id, rank FROM vector UNION ALL SELECT id, rank FROM lexical) ranked
+        GROUP BY id
+    )
+    SELECT c.id, c.chunk_text, f.score, c.document_id, c.chunk_index, c.char_start, c.char_end
+    FROM fused f
+    JOIN chunks c ON c.id = f.id
+    ORDER BY f.score DESC
+    LIMIT %(top_k)s
+"""
+
+def _copy_text(value):
+    if value is None:
+        return struct.pack("!i", -1)
+    data = value.encode()
+    return struct.pack("!i", len(data)) + data
+
+def _iter_chunks_copy(chunks):
+    """
+    Chunk rows in COPY binary format, one bytes object per row.
+    Each vector is converted to big-endian float4 with one numpy call,
+    so no per-float Python objects are created.
+    """
+    row_prefix = struct.pack("!h", 9)
+    ints = struct.Struct("!iiiiii")
+
+    yield _COPY_HEADER
+    for chunk_id, doc_id, user_id, chunk_index, char_start, char_end, content_hash, text, embedding in chunks:
+        vector = np.asarray(embedding, dtype=">f4")
+        yield b"".join((
+            row_prefix,
+            _copy_text(chunk_id),
+            _copy_text(doc_id),
+            _copy_text(user_id),
+            ints.pack(4, chunk_index, 4, char_start, 4, char_end),
+            _copy_text(content_hash),
+            _copy_text(text),
+            # pgvector: int16 размерность, int16 (не используется), затем float4 значения
+            struct.pack("!ihh", 4 + 4 * vector.size, vector.size, 0),
+            vector.tobytes(),
+        ))
+    yield _COPY_TRAILER
+
+class _IteratorReader(io.RawIOBase):
+    """Read-only file object over an iterator of bytes, for cursor.copy_expert"""
+
+    def __init__(self, pieces):
+        self._pieces = iter(pieces)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            piece = next(self._pieces, None)
+            if piece is None:
+                return 0
+            self._buffer = memoryview(piece)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def encode_chunks_copy(chunks):
+    """
+    Chunk rows in COPY binary format as a file object for copy_expert.
+    Rows are encoded as COPY reads them, so only the block being sent is in memory.
+    """
+    return _IteratorReader(_iter_chunks_copy(chunks))
+
+def _version_tuple(version):
+    """"0.8.0" -> (0, 8, 0); non-numeric parts such as "-dev" are ignored"""
+    parts = []
+    for part in version.split("."):
+        digits = "".join(itertools.takewhile(str.isdigit, part))
+        if not digits:
+            break
+        parts.append(int(digits))
+    return tuple(parts)
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers when it was last known to work"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # только что открытое соединение проверять не нужно
+        self.last_used = time.monotonic()
+
 class Database:
     def __init__(self, dsn):
         self.dsn = dsn
-        self.conn = None
+        self.pool = None
+        self.min_connections = int(os.environ.get("DB_POOL_MIN", "1"))
+        self.max_connections = int(os.environ.get("DB_POOL_MAX", "8"))
+        # сколько ждать свободное соединение, прежде чем отказать
+        self.checkout_timeout = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+        # сколько чанков save_chunks пишет одним COPY в одной транзакции
+        self.copy_batch_size = int(os.environ.get("DB_COPY_BATCH_SIZE", "1000"))
+        # соединение, простоявшее дольше, проверяется SELECT 1 перед выдачей
+        self.healthcheck_interval = float(os.environ.get("DB_POOL_HEALTHCHECK_INTERVAL", "30"))
+        # Параметры HNSW-поиска; ef_search можно переопределить на запрос
+        self.ef_search = int(os.environ.get("PGVECTOR_EF_SEARCH", "40"))
+        # pgvector >= 0.8: дообходить индекс, пока фильтр по user_id не наберёт top_k строк
+        self.iterative_scan = os.environ.get("PGVECTOR_ITERATIVE_SCAN", "strict_order")
+        # гибридный поиск: кандидатов от каждого из поисков и константа k в RRF
+        self.hybrid_candidates = int(os.environ.get("SEARCH_HYBRID_CANDIDATES", "50"))
+        self.rrf_k = int(os.environ.get("SEARCH_RRF_K", "60"))
+
+        # ThreadedConnectionPool при исчерпании бросает PoolError,
+        # поэтому выдачу ограничиваем семафором: лишние потоки ждут
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        metrics.DB_POOL_SIZE.set(self.max_connections)
         self._connect()
+        self._check_pgvector()
 
     def _connect(self):
         try:
-            self.conn = psycopg2.connect(self.dsn)
-            logger.info("Connected to PostgreSQL")
+            self.pool = pool.ThreadedConnectionPool(
+                self.min_connections, self.max_connections, self.dsn,
+                connection_factory=PooledConnection,
+            )
+            logger.info(f"Connected to PostgreSQL (pool {self.min_connections}..{self.max_connections})")
         except Exception as e:
             logger.error(f"DB connection failed: {e}")
             raise
 
-    def save_document(self, doc_id, user_id, title, filename):
-        with self.conn.cursor() as cur:
+    def _check_pgvector(self):
+        """Turn iterative index scans off if the installed pgvector predates them (0.8)"""
+        if not self.iterative_scan or self.iterative_scan == "off":
+            return
+
+        def query(conn):
+            with conn.cursor() as cur:
+                cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+                row = cur.fetchone()
+                return row[0] if row else None
+
+        version = self._read(query)
+        if version is None or _version_tuple(version) < (0, 8):
+            logger.warning(f"pgvector {version or 'is not installed'}: hnsw.iterative_scan needs 0.8, searching without it")
+            self.iterative_scan = "off"
+
+    def close(self):
+        if self.pool:
+            self.pool.closeall()
+
+    def _is_alive(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        """
+        A pooled connection that is open and, if it sat idle too long, answers
+        SELECT 1. Dead ones are closed and the next one is checked the same way;
+        after a database restart every idle connection may be dead.
+        """
+        for _ in range(self.max_connections + 1):
+            conn = self.pool.getconn()
+            idle = time.monotonic() - conn.last_used
+            if not conn.closed and (idle <= self.healthcheck_interval or self._is_alive(conn)):
+                return conn
+            logger.warning("Dropping dead DB connection, reconnecting")
+            self._discard(conn)
+        raise psycopg2.OperationalError(f"No live DB connection after {self.max_connections + 1} attempts")
+
+    def _discard(self, conn):
+        self.pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a pooled connection for one transaction.
+        Commits on success, rolls back on error; broken connections are
+        closed and replaced by a fresh one on the next checkout.
+        """
+        with metrics.DB_POOL_WAIT_SECONDS.time():
+            acquired = self._slots.acquire(timeout=self.checkout_timeout)
+        if not acquired:
+            raise pool.PoolError(f"No free DB connection within {self.checkout_timeout}s")
+
+        metrics.DB_POOL_IN_USE.inc()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if conn is not None:
+                self._discard(conn)
+                conn = None
+            raise
+        except Exception:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                if conn.closed:
+                    self._discard(conn)
+                else:
+                    conn.last_used = time.monotonic()
+                    self.pool.putconn(conn)
+            metrics.DB_POOL_IN_USE.dec()
+            self._slots.release()
+
+    def _read(self, fn):
+        """Run a read-only query, retrying once on a dropped connection"""
+        try:
+            with self.connection() as conn:
+                return fn(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.warning(f"DB read failed ({e}), retrying on a new connection")
+            with self.connection() as conn:
+                return fn(conn)
+
+    def save_document(self, doc_id, user_id, title, filename, content_hash=None):
+        with self.connection() as conn, conn.cursor() as cur:
             cur.execute(
                 """
-                INSERT INTO documents (id, user_id, title, filename)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO documents (id, user_id, title, filename, content_hash)
+                VALUES (%s, %s, %s, %s, %s)
                 ON CONFLICT (id) DO NOTHING
                 """,
-                (doc_id, user_id, title, filename)
+                (doc_id, user_id, title, filename, content_hash)
             )
-            self.conn.commit()
+
+    def find_document_by_hash(self, user_id, content_hash):
+        """Id of the user's document with exactly this content, or None"""
+        return self._find_document("content_hash", user_id, content_hash)
+
+    def find_document_by_filename(self, user_id, filename):
+        """Id of the user's latest document uploaded under this file name, or None"""
+        return self._find_document("filename", user_id, filename)
+
+    def _find_document(self, column, user_id, value):
+        def query(conn):
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT id
+                    FROM documents
+                    WHERE user_id = %s AND {column} = %s
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                    """,
+                    (user_id, value)
+                )
+                row = cur.fetchone()
+                return row[0] if row else None
+
+        return self._read(query)
+
+    def get_chunk_hashes(self, doc_id):
+        """
+        Returns {content_hash: [chunk_id, ...]} for the document's chunks;
+        ids of a repeated text are in chunk_index order
+        """
+        def query(conn):
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT content_hash, id FROM chunks WHERE document_id = %s ORDER BY chunk_index",
+                    (doc_id,)
+                )
+                hashes = {}
+                for digest, chunk_id in cur.fetchall():
+                    hashes.setdefault(digest, []).append(chunk_id)
+                return hashes
+
+        return self._read(query)
 
     def save_chunks(self, chunks):
         """
-        chunks: list of (chunk_id, doc_id, text, embedding)
+        chunks: list of (chunk_id, doc_id, user_id, chunk_index, char_start, char_end, content_hash, text, embedding)
+        embedding is a numpy array
+        Rows are bulk-loaded with binary COPY, each batch in its own transaction.
         """
-        with self.conn.cursor() as cur:
-            execute_values(
-                cur,
-                """
-                INSERT INTO chunks (id, document_id, chunk_text, embedding)
-                VALUES %s
-                """,
-                chunks
-            )
-            self.conn.commit()
+        for start in range(0, len(chunks), self.copy_batch_size):
+            with metrics.stage("store"), self.connection() as conn, conn.cursor() as cur:
+                self._copy_chunks(cur, chunks[start:start + self.copy_batch_size])
 
-    def search_chunks(self, user_id, embedding, top_k=5):
-        """Search only user's own chunks"""
-        with self.conn.cursor() as cur:
+    def _copy_chunks(self, cur, chunks):
+        """One COPY of all the rows; batching into transactions is up to the caller"""
+        cur.copy_expert(
+            f"COPY chunks ({_CHUNK_COLUMNS}) FROM STDIN WITH (FORMAT binary)",
+            encode_chunks_copy(chunks),
+        )
+
+    def replace_document_chunks(self, doc_id, user_id, title, content_hash, draft_id, kept_chunks):
+        """
+        Bring a stored document to its new version in one transaction.
+        draft_id: document saved without a user_id that holds the new chunks;
+        they are moved into doc_id and the draft is dropped
+        kept_chunks: list of (chunk_id, chunk_index, char_start, char_end) of unchanged chunks;
+        any other chunk of the document is deleted
+        """
+        keep_ids = [chunk[0] for chunk in kept_chunks]
+        with metrics.stage("store_replace"), self.connection() as conn, conn.cursor() as cur:
             cur.execute(
-                """
-                SELECT c.id, c.chunk_text, 1 - (c.embedding <=> %s::vector) as score
-                FROM chunks c
-                JOIN documents d ON c.document_id = d.id
-                WHERE d.user_id = %s
-                ORDER BY c.embedding <=> %s::vector
-                LIMIT %s
-                """,
-                (embedding, user_id, embedding, top_k)
+                "DELETE FROM chunks WHERE document_id = %s AND NOT (id = ANY(%s))",
+                (doc_id, keep_ids)
             )
-            return cur.fetchall()
-    def list_user_documents(self, user_id):
-        """Возвращает список названий документов пользователя"""
-        with self.conn.cursor() as cur:
+            if kept_chunks:
+                execute_values(
+                    cur,
+                    """
+                    UPDATE chunks c
+                    SET chunk_index = v.chunk_index, char_start = v.char_start, char_end = v.char_end
+                    FROM (VALUES %s) AS v (id, chunk_index, char_start, char_end)
+                    WHERE c.id = v.id
+                    """,
+                    kept_chunks
+                )
             cur.execute(
-                """
-                SELECT title
-                FROM documents
-                WHERE user_id = %s
-                ORDER BY id DESC
-                """,
-                (user_id,)
+                "UPDATE chunks SET document_id = %s, user_id = %s WHERE document_id = %s",
+                (doc_id, user_id, draft_id)
             )
-            return [row[0] for row in cur.fetchall()]
+            moved = cur.rowcount
+            cur.execute("DELETE FROM documents WHERE id = %s", (draft_id,))
+            cur.execute(
+                "UPDATE documents SET title = %s, content_hash = %s WHERE id = %s",
+                (title, content_hash, doc_id)
+            )
+        logger.info(f"Updated document {doc_id}: {moved} new chunks, {len(kept_chunks)} kept")
+
+    def publish_document(self, doc_id, user_id):
+        """Hand a document saved without a user_id, with its chunks, over to user_id"""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE chunks SET user_id = %s WHERE document_id = %s", (user_id, doc_id))
+            cur.execute("UPDATE documents SET user_id = %s WHERE id = %s", (user_id, doc_id))
+
+    def search_chunks(self, user_id, embedding, top_k=5, ef_search=None, question=None, search_mode="vector"):
+        """
+        Search only user's own chunks.
+        "vector" ranks by cosine similarity via the HNSW index; "hybrid" fuses it
+        with full-text matches of question in the same round trip, and the score
+        is then the RRF score rather than a similarity.
+        Returns rows of (id, text, score, document_id, chunk_index, char_start, char_end)
+        """
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Search mode must be one of {', '.join(SEARCH_MODES)}")
+        hybrid = search_mode == "hybrid" and bool(question)
+        candidates = max(self.hybrid_candidates, top_k)
+        ef_search = max(ef_search or self.ef_search, candidates if hybrid else top_k)
+
+        def query(conn):
+            with conn.cursor() as cur:
+                # set_config(..., true) действует только до конца транзакции
+                cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+                if self.iterative_scan and self.iterative_scan != "off":
+                    cur.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (self.iterative_scan,))
+                if hybrid:
+                    cur.execute(_HYBRID_SEARCH_SQL, {
+                        "question": question,
+                        "embedding": embedding,
+                        "user_id": user_id,
+                        "candidates": candidates,
+                        "rrf_k": self.rrf_k,
+                        "top_k": top_k,
+                    })
+                    return cur.fetchall()
+                cur.execute(
+                    """
+                    SELECT c.id, c.chunk_text, 1 - (c.embedding <=> %s::vector) as score,
+                           c.document_id, c.chunk_index, c.char_start, c.char_end
+                    FROM chunks c
+                    WHERE c.user_id = %s
+                    ORDER BY c.embedding <=> %s::vector
+                    LIMIT %s
+                    """,
+                    (embedding, user_id, embedding, top_k)
+                )
+                return cur.fetchall()
+
+        with metrics.stage(f"search_{'hybrid' if hybrid else 'vector'}"):
+            return self._read(query)
+
+    def list_user_documents(self, user_id):
+        """Возвращает список названий документов пользователя"""
+        def query(conn):
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT title
+                    FROM documents
+                    WHERE user_id = %s
+                    ORDER BY created_at DESC
+                    """,
+                    (user_id,)
+                )
+                return [row[0] for row in cur.fetchall()]
+
+        return self._read(query)
+
+    def delete_document(self, doc_id):
+        """Удаляет документ вместе с его чанками"""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM chunks WHERE document_id = %s", (doc_id,))
+            cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
 
     def clear_user_documents(self, user_id):
         """Удаляет все документы и чанки пользователя"""
-        with self.conn.cursor() as cur:
+        with self.connection() as conn, conn.cursor() as cur:
             cur.execute(
                 """
                 DELETE FROM chunks
-                WHERE document_id IN (
-                    SELECT id FROM documents WHERE user_id = %s
-                )
+                WHERE user_id = %s
                 """,
                 (user_id,)
             )
@@ -90,5 +472,4 @@ class Database:
                 "DELETE FROM documents WHERE user_id = %s",
                 (user_id,)
             )
-            self.conn.commit()
-            logger.info(f"Deleted all documents for user {user_id}")
\ No newline at end of file
+        logger.info(f"Deleted all documents for user {user_id}")
@@ -1,11 +1,95 @@
 from sentence_transformers import SentenceTransformer
+from concurrent.futures import Future
 import numpy as np
 import logging
+import os
+import queue
+import threading
+import time
 
+import metrics
+from chunker import Chunker
 from redis_cache import RedisCache
 
 logger = logging.getLogger(__name__)
 
+BACKENDS = ("torch", "onnx")
+
+# Фразы для сверки ONNX-бэкенда с эталонным PyTorch
+PARITY_SENTENCES = [
+    "What is the capital of France?",
+    "Какие документы нужны для оформления отпуска?",
+    "The quick brown fox jumps over the lazy dog.",
+    "Нейронная сеть переводит текст в вектор фиксированной длины.",
+]
+
+def cosine_parity(reference, candidate):
+    """Minimum row-wise cosine similarity between two embedding matrices"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return float(np.min(np.sum(reference * candidate, axis=1)))
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent single-text encode calls for up to max_wait seconds
+    (or until max_batch_size texts are queued) and runs them as one batch.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=32, max_wait=0.005):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    def submit(self, text):
+        """Returns a Future resolved with the embedding of text"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_worker(self):
+        # Потоки не переживают fork, поэтому воркер заводим лениво в своём процессе
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.encode_batch(texts)
+            except Exception as e:
+                logger.error(f"Batched encode of {len(texts)} texts failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            logger.debug(f"Encoded batch of {len(texts)} texts")
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
 class Embedder:
     def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2"):
         """
@@ -13,29 +97,118 @@ class Embedder:
         all-MiniLM-L6-v2 produces 384-dimensional embeddings
         """
         logger.info(f"Loading embedding model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        self.model, variant = self._load_model(model_name)
         self.dimension = 384
-        self.cache = RedisCache()
+        # Векторы разных бэкендов чуть различаются, поэтому кэшируются раздельно
+        self.cache = RedisCache(model=model_name if variant == "torch" else f"{model_name}@{variant}")
+
+        # Одиночные запросы из разных gRPC-потоков склеиваются в один encode
+        max_wait_ms = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "5"))
+        self.batcher = None
+        if max_wait_ms > 0:
+            self.batcher = EmbeddingBatcher(
+                self._encode,
+                max_batch_size=int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32")),
+                max_wait=max_wait_ms / 1000,
+            )
         logger.info("Model loaded successfully")
 
+    def _load_model(self, model_name):
+        """
+        Load the model with the backend from EMBED_BACKEND.
+        The onnx backend (optionally int8-quantized) is checked against PyTorch
+        and replaced by it if the outputs diverge.
+        Returns: (model, variant name)
+        """
+        backend = os.environ.get("EMBED_BACKEND", "torch")
+        if backend not in BACKENDS:
+            raise ValueError(f"EMBED_BACKEND must be one of {', '.join(BACKENDS)}")
+
+        threads = int(os.environ.get("EMBED_THREADS", "0"))
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+
+        if backend == "torch":
+            return SentenceTransformer(model_name), "torch"
+
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if threads > 0:
+            session_options.intra_op_num_threads = threads
+            session_options.inter_op_num_threads = 1
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+
+        # Динамически квантованные веса: onnx/model_qint8_{avx2,avx512,avx512_vnni,arm64}.onnx
+        quantization = os.environ.get("EMBED_QUANTIZATION", "")
+        variant = "onnx"
+        if quantization:
+            model_kwargs["file_name"] = f"onnx/model_qint8_{quantization}.onnx"
+            variant = f"onnx-qint8_{quantization}"
+
+        model = SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+
+        threshold = float(os.environ.get("EMBED_PARITY_THRESHOLD", "0.98"))
+        if threshold <= 0:
+            return model, variant
+
+        reference = SentenceTransformer(model_name)
+        parity = cosine_parity(
+            reference.encode(PARITY_SENTENCES, convert_to_numpy=True, show_progress_bar=False),
+            model.encode(PARITY_SENTENCES, convert_to_numpy=True, show_progress_bar=False),
+        )
+        if parity < threshold:
+            logger.warning(f"Backend {variant} diverges from PyTorch (cosine {parity:.4f} < {threshold}), using torch")
+            return reference, "torch"
+
+        logger.info(f"Backend {variant} matches PyTorch (min cosine {parity:.4f})")
+        return model, variant
+
     def embed_text(self, text):
-        cached = self.cache.get_embedding(text)
-        if cached is not None:
-            logger.debug("Embedding from cache")
-            return cached
-        
-        embedding = self.model.encode(text, convert_to_numpy=True)
-        
-        self.cache.set_embedding(text, embedding)
-        return embedding
+        with metrics.stage("embed"):
+            cached = self.cache.get_embedding(text)
+            if cached is not None:
+                logger.debug("Embedding from cache")
+                return cached
+
+            with metrics.stage("encode"):
+                if self.batcher:
+                    embedding = self.batcher.submit(text).result()
+                else:
+                    embedding = self.model.encode(text, convert_to_numpy=True)
+
+            self.cache.set_embedding(text, embedding)
+            return embedding
 
     def embed_batch(self, texts):
         """
-        Generate embeddings for multiple texts
+        Generate embeddings for multiple texts.
+        All cache lookups go in one batch; only misses are encoded,
+        and each distinct text is encoded once.
         Returns: numpy array of shape (n, 384)
         """
-        embeddings = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
-        return embeddings
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        embeddings = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            with metrics.stage("encode_batch"):
+                encoded = [vector.copy() for vector in self._encode(missing)]
+            self.cache.set_many(missing, encoded)
+            by_text = dict(zip(missing, encoded))
+            embeddings = [by_text[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        logger.debug(f"Embedded batch of {len(texts)}: {len(missing)} encoded, {len(texts) - len(missing)} cached")
+
+        return np.stack(embeddings)
+
+    def _encode(self, texts):
+        return self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+
+    def make_chunker(self, **kwargs):
+        """Chunker that measures chunks with this model's tokenizer"""
+        return Chunker(tokenizer=self.model.tokenizer, model_max_tokens=self.model.max_seq_length, **kwargs)
 
     def chunk_text(self, text, chunk_size=500, overlap=50):
         """
@@ -48,32 +221,8 @@ class Embedder:
         
         Returns: list of text chunks
         """
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = min(start + chunk_size, len(text))
-            
-            if end < len(text):
-                chunk_text = text[start:end]
-                last_period = max(
-                    chunk_text.rfind('. '),
-                    chunk_text.rfind('? '),
-                    chunk_text.rfind('! ')
-                )
-                if last_period > chunk_size - 100:
-                    end = start + last_period + 1
-            
-            chunks.append(text[start:end].strip())
-            
-            if end >= len(text):
-                break
-            start = end - overlap
-                
-        return chunks
+        chunker = Chunker(strategy="chars", chunk_size=chunk_size, overlap=overlap)
+        return [chunk.text for chunk in chunker.split(text)]
 
     def embed_document(self, text):
         """
@@ -1,15 +1,27 @@
 #!/bin/bash
 set -e
 
+PSQL="psql -h postgres -U ${POSTGRES_USER:-app} -d ${POSTGRES_DB:-appdb} -v ON_ERROR_STOP=1"
+export PGPASSWORD=${POSTGRES_PASSWORD:-pass}
+
 echo "Waiting for PostgreSQL..."
-until PGPASSWORD=${POSTGRES_PASSWORD:-pass} psql -h postgres -U ${POSTGRES_USER:-app} -d ${POSTGRES_DB:-appdb} -c '\q' 2>/dev/null; do
+until $PSQL -c '\q' 2>/dev/null; do
   sleep 1
 done
 echo "PostgreSQL is ready"
 
 echo "Running migrations..."
-PGPASSWORD=${POSTGRES_PASSWORD:-pass} psql -h postgres -U ${POSTGRES_USER:-app} -d ${POSTGRES_DB:-appdb} < /migrations/0001_init.sql
+$PSQL -q -c "CREATE TABLE IF NOT EXISTS schema_migrations (version TEXT PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE DEFAULT now())"
+for migration in /migrations/*.sql; do
+  version=$(basename "$migration")
+  applied=$($PSQL -tA -c "SELECT 1 FROM schema_migrations WHERE version = '$version'")
+  if [ "$applied" != "1" ]; then
+    echo "Applying $version"
+    $PSQL -1 -f "$migration"
+    $PSQL -q -c "INSERT INTO schema_migrations (version) VALUES ('$version')"
+  fi
+done
 echo "Migrations complete"
 
 echo "Starting ML service..."
-exec python server.py
\ No newline at end of file
+exec python launcher.py
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x08\x66m.proto\x12\x02\x66m\"\x1e\n\x0eSetModeRequest\x12\x0c\n\x04mode\x18\x01 \x01(\t\"!\n\x0fSetModeResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\"f\n\x10UploadDocRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\r\n\x05title\x18\x02 \x01(\t\x12\x0c\n\x04text\x18\x03 \x01(\t\x12\x12\n\nfile_bytes\x18\x04 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x05 \x01(\t\"3\n\x11UploadDocResponse\x12\x0e\n\x06\x64oc_id\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\"\"\n\x0fListDocsRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\"\n\x10ListDocsResponse\x12\x0e\n\x06titles\x18\x01 \x03(\t\"#\n\x10\x43learDocsRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"$\n\x11\x43learDocsResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\"@\n\x0cQueryRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08question\x18\x02 \x01(\t\x12\r\n\x05top_k\x18\x03 \x01(\x05\"6\n\x05\x43hunk\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\x0c\n\x04text\x18\x02 \x01(\t\x12\r\n\x05score\x18\x03 \x01(\x02\"<\n\rQueryResponse\x12\x0e\n\x06\x61nswer\x18\x01 \x01(\t\x12\x1b\n\x08\x63ontexts\x18\x02 \x03(\x0b\x32\t.fm.Chunk2\xd5\x02\n\x03QnA\x12\x32\n\x07SetMode\x12\x12.fm.SetModeRequest\x1a\x13.fm.SetModeResponse\x12=\n\x0eUploadDocument\x12\x14.fm.UploadDocRequest\x1a\x15.fm.UploadDocResponse\x12:\n\rListDocuments\x12\x13.fm.ListDocsRequest\x1a\x14.fm.ListDocsResponse\x12=\n\x0e\x43learDocuments\x12\x14.fm.ClearDocsRequest\x1a\x15.fm.ClearDocsResponse\x12,\n\x05Query\x12\x10.fm.QueryRequest\x1a\x11.fm.QueryResponse\x12\x32\n\x0b\x44irectQuery\x12\x10.fm.QueryRequest\x1a\x11.fm.QueryResponseB\x0eZ\x0c/proto;protob\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x08\x66m.proto\x12\x02\x66m\"/\n\x0eSetModeRequest\x12\x0c\n\x04mode\x18\x01 \x01(\t\x12\x0f\n\x07user_id\x18\x02 \x01(\t\"!\n\x0fSetModeResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\"f\n\x10UploadDocRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\r\n\x05title\x18\x02 \x01(\t\x12\x0c\n\x04text\x18\x03 \x01(\t\x12\x12\n\nfile_bytes\x18\x04 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x05 \x01(\t\"C\n\x11UploadDocResponse\x12\x0e\n\x06\x64oc_id\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x0e\n\x06job_id\x18\x03 \x01(\t\"N\n\x0bUploadChunk\x12$\n\x04meta\x18\x01 \x01(\x0b\x32\x14.fm.UploadDocRequestH\x00\x12\x0e\n\x04\x64\x61ta\x18\x02 \x01(\x0cH\x00\x42\t\n\x07payload\"%\n\x13UploadStatusRequest\x12\x0e\n\x06job_id\x18\x01 \x01(\t\"\xca\x01\n\x14UploadStatusResponse\x12\x0e\n\x06job_id\x18\x01 \x01(\t\x12\x0e\n\x06\x64oc_id\x18\x02 \x01(\t\x12\r\n\x05state\x18\x03 \x01(\t\x12\x17\n\x0fpages_extracted\x18\x04 \x01(\x05\x12\x14\n\x0c\x63hunks_total\x18\x05 \x01(\x05\x12\x17\n\x0f\x63hunks_embedded\x18\x06 \x01(\x05\x12\x15\n\rchunks_stored\x18\x07 \x01(\x05\x12\r\n\x05\x65rror\x18\x08 \x01(\t\x12\x15\n\rchunks_reused\x18\t \x01(\x05\"\"\n\x0fListDocsRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\"\n\x10ListDocsResponse\x12\x0e\n\x06titles\x18\x01 \x03(\t\"#\n\x10\x43learDocsRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"$\n\x11\x43learDocsResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\"\xab\x01\n\x0cQueryRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08question\x18\x02 \x01(\t\x12\r\n\x05top_k\x18\x03 \x01(\x05\x12\x11\n\tef_search\x18\x04 \x01(\x05\x12\x0c\n\x04mode\x18\x05 \x01(\t\x12\x13\n\x0bsearch_mode\x18\x06 \x01(\t\x12\x19\n\x11rerank_candidates\x18\x07 \x01(\x05\x12\x18\n\x10rerank_budget_ms\x18\x08 \x01(\x05\"6\n\x05\x43hunk\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\x0c\n\x04text\x18\x02 \x01(\t\x12\r\n\x05score\x18\x03 \x01(\x02\"<\n\rQueryResponse\x12\x0e\n\x06\x61nswer\x18\x01 \x01(\t\x12\x1b\n\x08\x63ontexts\x18\x02 \x03(\x0b\x32\t.fm.Chunk\"O\n\x13QueryStreamResponse\x12\x1b\n\x08\x63ontexts\x18\x01 \x03(\x0b\x32\t.fm.Chunk\x12\r\n\x05\x64\x65lta\x18\x02 \x01(\t\x12\x0c\n\x04\x64one\x18\x03 \x01(\x08\x32\x99\x04\n\x03QnA\x12\x32\n\x07SetMode\x12\x12.fm.SetModeRequest\x1a\x13.fm.SetModeResponse\x12=\n\x0eUploadDocument\x12\x14.fm.UploadDocRequest\x1a\x15.fm.UploadDocResponse\x12@\n\x14UploadDocumentStream\x12\x0f.fm.UploadChunk\x1a\x15.fm.UploadDocResponse(\x01\x12\x44\n\x0fGetUploadStatus\x12\x17.fm.UploadStatusRequest\x1a\x18.fm.UploadStatusResponse\x12:\n\rListDocuments\x12\x13.fm.ListDocsRequest\x1a\x14.fm.ListDocsResponse\x12=\n\x0e\x43learDocuments\x12\x14.fm.ClearDocsRequest\x1a\x15.fm.ClearDocsResponse\x12,\n\x05Query\x12\x10.fm.QueryRequest\x1a\x11.fm.QueryResponse\x12:\n\x0bQueryStream\x12\x10.fm.QueryRequest\x1a\x17.fm.QueryStreamResponse0\x01\x12\x32\n\x0b\x44irectQuery\x12\x10.fm.QueryRequest\x1a\x11.fm.QueryResponseB\x0eZ\x0c/proto;protob\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -33,27 +33,35 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['DESCRIPTOR']._loaded_options = None
   _globals['DESCRIPTOR']._serialized_options = b'Z\014/proto;proto'
   _globals['_SETMODEREQUEST']._serialized_start=16
-  _globals['_SETMODEREQUEST']._serialized_end=46
-  _globals['_SETMODERESPONSE']._serialized_start=48
-  _globals['_SETMODERESPONSE']._serialized_end=81
-  _globals['_UPLOADDOCREQUEST']._serialized_start=83
-  _globals['_UPLOADDOCREQUEST']._serialized_end=185
-  _globals['_UPLOADDOCRESPONSE']._serialized_start=187
-  _globals['_UPLOADDOCRESPONSE']._serialized_end=238
-  _globals['_LISTDOCSREQUEST']._serialized_start=240
-  _globals['_LISTDOCSREQUEST']._serialized_end=274
-  _globals['_LISTDOCSRESPONSE']._serialized_start=276
-  _globals['_LISTDOCSRESPONSE']._serialized_end=310
-  _globals['_CLEARDOCSREQUEST']._serialized_start=312
-  _globals['_CLEARDOCSREQUEST']._serialized_end=347
-  _globals['_CLEARDOCSRESPONSE']._serialized_start=349
-  _globals['_CLEARDOCSRESPONSE']._serialized_end=385
-  _globals['_QUERYREQUEST']._serialized_start=387
-  _globals['_QUERYREQUEST']._serialized_end=451
-  _globals['_CHUNK']._serialized_start=453
-  _globals['_CHUNK']._serialized_end=507
-  _globals['_QUERYRESPONSE']._serialized_start=509
-  _globals['_QUERYRESPONSE']._serialized_end=569
-  _globals['_QNA']._serialized_start=572
-  _globals['_QNA']._serialized_end=913
+  _globals['_SETMODEREQUEST']._serialized_end=63
+  _globals['_SETMODERESPONSE']._serialized_start=65
+  _globals['_SETMODERESPONSE']._serialized_end=98
+  _globals['_UPLOADDOCREQUEST']._serialized_start=100
+  _globals['_UPLOADDOCREQUEST']._serialized_end=202
+  _globals['_UPLOADDOCRESPONSE']._serialized_start=204
+  _globals['_UPLOADDOCRESPONSE']._serialized_end=271
+  _globals['_UPLOADCHUNK']._serialized_start=273
+  _globals['_UPLOADCHUNK']._serialized_end=351
+  _globals['_UPLOADSTATUSREQUEST']._serialized_start=353
+  _globals['_UPLOADSTATUSREQUEST']._serialized_end=390
+  _globals['_UPLOADSTATUSRESPONSE']._serialized_start=393
+  _globals['_UPLOADSTATUSRESPONSE']._serialized_end=595
+  _globals['_LISTDOCSREQUEST']._serialized_start=597
+  _globals['_LISTDOCSREQUEST']._serialized_end=631
+  _globals['_LISTDOCSRESPONSE']._serialized_start=633
+  _globals['_LISTDOCSRESPONSE']._serialized_end=667
+  _globals['_CLEARDOCSREQUEST']._serialized_start=669
+  _globals['_CLEARDOCSREQUEST']._serialized_end=704
+  _globals['_CLEARDOCSRESPONSE']._serialized_start=706
+  _globals['_CLEARDOCSRESPONSE']._serialized_end=742
+  _globals['_QUERYREQUEST']._serialized_start=745
+  _globals['_QUERYREQUEST']._serialized_end=916
+  _globals['_CHUNK']._serialized_start=918
+  _globals['_CHUNK']._serialized_end=972
+  _globals['_QUERYRESPONSE']._serialized_start=974
+  _globals['_QUERYRESPONSE']._serialized_end=1034
+  _globals['_QUERYSTREAMRESPONSE']._serialized_start=1036
+  _globals['_QUERYSTREAMRESPONSE']._serialized_end=1115
+  _globals['_QNA']._serialized_start=1118
+  _globals['_QNA']._serialized_end=1655
 # @@protoc_insertion_point(module_scope)
@@ -44,6 +44,16 @@ class QnAStub(object):
                 request_serializer=fm__pb2.UploadDocRequest.SerializeToString,
                 response_deserializer=fm__pb2.UploadDocResponse.FromString,
                 _registered_method=True)
+        self.UploadDocumentStream = channel.stream_unary(
+                '/fm.QnA/UploadDocumentStream',
+                request_serializer=fm__pb2.UploadChunk.SerializeToString,
+                response_deserializer=fm__pb2.UploadDocResponse.FromString,
+                _registered_method=True)
+        self.GetUploadStatus = channel.unary_unary(
+                '/fm.QnA/GetUploadStatus',
+                request_serializer=fm__pb2.UploadStatusRequest.SerializeToString,
+                response_deserializer=fm__pb2.UploadStatusResponse.FromString,
+                _registered_method=True)
         self.ListDocuments = channel.unary_unary(
                 '/fm.QnA/ListDocuments',
                 request_serializer=fm__pb2.ListDocsRequest.SerializeToString,
@@ -59,6 +69,11 @@ class QnAStub(object):
                 request_serializer=fm__pb2.QueryRequest.SerializeToString,
                 response_deserializer=fm__pb2.QueryResponse.FromString,
                 _registered_method=True)
+        self.QueryStream = channel.unary_stream(
+                '/fm.QnA/QueryStream',
+                request_serializer=fm__pb2.QueryRequest.SerializeToString,
+                response_deserializer=fm__pb2.QueryStreamResponse.FromString,
+                _registered_method=True)
         self.DirectQuery = channel.unary_unary(
                 '/fm.QnA/DirectQuery',
                 request_serializer=fm__pb2.QueryRequest.SerializeToString,
@@ -81,6 +96,18 @@ class QnAServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def UploadDocumentStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetUploadStatus(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def ListDocuments(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -99,6 +126,12 @@ class QnAServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def QueryStream(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def DirectQuery(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -118,6 +151,16 @@ def add_QnAServicer_to_server(servicer, server):
                     request_deserializer=fm__pb2.UploadDocRequest.FromString,
                     response_serializer=fm__pb2.UploadDocResponse.SerializeToString,
             ),
+            'UploadDocumentStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.UploadDocumentStream,
+                    request_deserializer=fm__pb2.UploadChunk.FromString,
+                    response_serializer=fm__pb2.UploadDocResponse.SerializeToString,
+            ),
+            'GetUploadStatus': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetUploadStatus,
+                    request_deserializer=fm__pb2.UploadStatusRequest.FromString,
+                    response_serializer=fm__pb2.UploadStatusResponse.SerializeToString,
+            ),
             'ListDocuments': grpc.unary_unary_rpc_method_handler(
                     servicer.ListDocuments,
                     request_deserializer=fm__pb2.ListDocsRequest.FromString,
@@ -133,6 +176,11 @@ def add_QnAServicer_to_server(servicer, server):
                     request_deserializer=fm__pb2.QueryRequest.FromString,
                     response_serializer=fm__pb2.QueryResponse.SerializeToString,
             ),
+            'QueryStream': grpc.unary_stream_rpc_method_handler(
+                    servicer.QueryStream,
+                    request_deserializer=fm__pb2.QueryRequest.FromString,
+                    response_serializer=fm__pb2.QueryStreamResponse.SerializeToString,
+            ),
             'DirectQuery': grpc.unary_unary_rpc_method_handler(
                     servicer.DirectQuery,
                     request_deserializer=fm__pb2.QueryRequest.FromString,
@@ -203,6 +251,60 @@ class QnA(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def UploadDocumentStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/fm.QnA/UploadDocumentStream',
+            fm__pb2.UploadChunk.SerializeToString,
+            fm__pb2.UploadDocResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetUploadStatus(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/fm.QnA/GetUploadStatus',
+            fm__pb2.UploadStatusRequest.SerializeToString,
+            fm__pb2.UploadStatusResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def ListDocuments(request,
             target,
@@ -284,6 +386,33 @@ class QnA(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def QueryStream(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/fm.QnA/QueryStream',
+            fm__pb2.QueryRequest.SerializeToString,
+            fm__pb2.QueryStreamResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def DirectQuery(request,
             target,
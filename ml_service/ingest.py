@@ -0,0 +1,462 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+def new_document_id():
+    return f"doc_{uuid.uuid4().hex}"
+
+def content_hash(text):
+    """Hash of a chunk's text; the same value is computed in SQL by migration 0004"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def _chunk_id(doc_id, digest, occurrence):
+    # первое вхождение текста - прежний формат id, повторы различаются номером
+    base = f"{doc_id}_{digest[:16]}"
+    return f"{base}_{occurrence}" if occurrence else base
+
+# Поля статуса задачи, как в UploadStatusResponse
+STATUS_FIELDS = (
+    "job_id", "doc_id", "state", "pages_extracted", "chunks_total",
+    "chunks_embedded", "chunks_stored", "chunks_reused", "error",
+)
+_STATUS_TEXT_FIELDS = ("job_id", "doc_id", "state", "error")
+
+class IngestJob:
+    """Progress of one document going through the ingestion pipeline"""
+
+    def __init__(self, user_id, title, filename, source=None, text=None):
+        self.job_id = uuid.uuid4().hex
+        self.doc_id = new_document_id()
+        self.user_id = user_id
+        self.title = title
+        self.filename = filename
+        # содержимое файла: bytes или бинарный файловый объект (закрывается после разбора)
+        self.source = source
+        self.text = text
+
+        self.state = "queued"
+        self.pages_extracted = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_stored = 0
+        self.chunks_reused = 0
+        self.error = ""
+        self.finished_at = None
+
+        # sha256 исходного файла (или текста): по нему ищутся дубликаты у пользователя
+        self.content_hash = None
+        # True, если у пользователя есть файл с тем же именем: тогда только
+        # в конце, по доле общих чанков, решается, новая ли это версия того
+        # файла или другой документ с таким же именем
+        self.replace = False
+        # до этого решения новые чанки пишутся в черновик - документ без
+        # владельца, невидимый в поиске и списке документов
+        self.draft_id = None
+        # число чанков прежней версии
+        self.previous_chunks = 0
+        # чанки прежней версии, встретившиеся снова: (chunk_id, (index, chunk, digest, occurrence))
+        self.kept_chunks = []
+
+    @property
+    def target(self):
+        """(doc_id, user_id) the job's chunks are being written under"""
+        return (self.draft_id, None) if self.draft_id else (self.doc_id, self.user_id)
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+    def status(self):
+        return {field: getattr(self, field) for field in STATUS_FIELDS}
+
+    def finish(self):
+        self.state = "done"
+        self.finished_at = time.monotonic()
+
+    def fail(self, error):
+        self.state = "failed"
+        self.error = str(error)
+        self.finished_at = time.monotonic()
+
+class IngestionPipeline:
+    """
+    Background document ingestion: extract -> chunk -> embed -> store.
+
+    Each stage runs in its own thread and hands work to the next one through
+    a bounded queue, so a large upload is processed in batches and only
+    holds back the pipeline, not the gRPC workers.
+    """
+
+    def __init__(self, db, extractor, embedder, on_corpus_change=None, status_cache=None):
+        self.db = db
+        self.extractor = extractor
+        self.embedder = embedder
+        # вызывается с user_id, когда документы пользователя изменились
+        self.on_corpus_change = on_corpus_change
+        # Статус задач копируется в Redis: при нескольких воркерах (launcher.py)
+        # GetUploadStatus может прийти не в тот процесс, что ведёт задачу
+        self.status_client = status_cache.client if status_cache else None
+        self.status_interval = float(os.environ.get("INGEST_STATUS_INTERVAL", "1"))
+
+        self.chunker = embedder.make_chunker()
+        # сколько символов текста копить перед нарезкой на чанки
+        self.chunk_window = int(os.environ.get("INGEST_CHUNK_WINDOW", "65536"))
+        self.embed_batch_size = int(os.environ.get("INGEST_EMBED_BATCH", "32"))
+        self.job_ttl = float(os.environ.get("INGEST_JOB_TTL", "3600"))
+        # Файл с тем же именем считается новой версией прежнего, только если
+        # у них общая хотя бы такая доля чанков: имена вроде document.pdf,
+        # которые даёт Telegram, сами по себе ничего не значат
+        self.replace_min_overlap = float(os.environ.get("INGEST_REPLACE_MIN_OVERLAP", "0.5"))
+
+        # Ограниченные очереди: при переполнении upstream-стадия ждёт
+        self._jobs_queue = queue.Queue(maxsize=int(os.environ.get("INGEST_MAX_QUEUED_JOBS", "16")))
+        self._embed_queue = queue.Queue(maxsize=int(os.environ.get("INGEST_EMBED_QUEUE", "8")))
+        self._store_queue = queue.Queue(maxsize=int(os.environ.get("INGEST_STORE_QUEUE", "8")))
+        self._queues = {"ingest_jobs": self._jobs_queue, "ingest_embed": self._embed_queue, "ingest_store": self._store_queue}
+
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+
+        extract_workers = int(os.environ.get("INGEST_EXTRACT_WORKERS", "1"))
+        for i in range(extract_workers):
+            self._start(self._extract_loop, f"ingest-extract-{i}")
+        # По одному потоку на embed и store: порядок батчей внутри задачи сохраняется,
+        # и завершающий маркер задачи приходит в store после всех её чанков
+        self._start(self._embed_loop, "ingest-embed")
+        self._start(self._store_loop, "ingest-store")
+        if self.status_client:
+            self._start(self._publish_loop, "ingest-status")
+
+    def _start(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+
+    def submit(self, user_id, title, filename, source=None, text=None):
+        """
+        Queue a document for ingestion.
+        source is the file content, bytes or a binary file object.
+        Raises queue.Full when too many uploads are already waiting.
+        """
+        job = IngestJob(user_id, title, filename, source=source, text=text)
+        self._prune_jobs()
+        self._jobs_queue.put_nowait(job)
+        self._observe_queues()
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+        logger.info(f"Queued ingestion job {job.job_id} for {filename or title}")
+        return job
+
+    def _observe_queues(self):
+        for name, stage_queue in self._queues.items():
+            metrics.QUEUE_DEPTH.labels(name).set(stage_queue.qsize())
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def get_status(self, job_id):
+        """Status dict of a job run by this or another worker process, or None"""
+        job = self.get_job(job_id)
+        if job is not None:
+            return job.status()
+        if not self.status_client:
+            return None
+        try:
+            data = self.status_client.hgetall(f"ingest:{job_id}")
+        except Exception as e:
+            logger.error(f"Failed to read status of job {job_id}: {e}")
+            return None
+        if not data:
+            return None
+        status = {key.decode(): value.decode() for key, value in data.items()}
+        return {
+            field: status.get(field, "") if field in _STATUS_TEXT_FIELDS else int(status.get(field, 0))
+            for field in STATUS_FIELDS
+        }
+
+    def _publish_loop(self):
+        """Periodically copies changed job statuses to Redis"""
+        published = {}
+        while True:
+            time.sleep(self.status_interval)
+            with self._jobs_lock:
+                jobs = list(self._jobs.values())
+            changed = [(job.job_id, status) for job, status in ((job, job.status()) for job in jobs) if published.get(job.job_id) != status]
+            if not changed:
+                continue
+            try:
+                pipe = self.status_client.pipeline()
+                for job_id, status in changed:
+                    key = f"ingest:{job_id}"
+                    pipe.hset(key, mapping=status)
+                    pipe.expire(key, int(self.job_ttl))
+                pipe.execute()
+                published = {job.job_id: published[job.job_id] for job in jobs if job.job_id in published}
+                published.update(changed)
+            except Exception as e:
+                logger.error(f"Failed to publish ingestion status: {e}")
+
+    def _prune_jobs(self):
+        now = time.monotonic()
+        with self._jobs_lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and now - job.finished_at > self.job_ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _extract_loop(self):
+        while True:
+            job = self._jobs_queue.get()
+            self._observe_queues()
+            try:
+                self._extract(job)
+            except Exception as e:
+                logger.exception(f"Ingestion job {job.job_id} failed at extraction")
+                job.fail(e)
+                # Маркер конца: store-стадия удалит то, что успело сохраниться
+                self._embed_queue.put((job, None))
+            finally:
+                # Исходный файл больше не нужен, не держим его в памяти
+                if hasattr(job.source, "close"):
+                    job.source.close()
+                job.source = None
+
+    def _extract(self, job):
+        job.state = "extracting"
+        job.content_hash = self._source_hash(job)
+        duplicate = self.db.find_document_by_hash(job.user_id, job.content_hash)
+        if duplicate:
+            logger.info(f"Document {job.filename or job.title} is already stored as {duplicate}, skipping")
+            job.doc_id = duplicate
+            job.finish()
+            return
+
+        # Файл с тем же именем может оказаться новой версией прежнего:
+        # эмбеддинги считаются только для чанков, которых в нём не было
+        existing = {}
+        previous = self.db.find_document_by_filename(job.user_id, job.filename) if job.filename else None
+        if previous:
+            job.doc_id = previous
+            job.replace = True
+            existing = self.db.get_chunk_hashes(previous)
+            job.previous_chunks = sum(len(ids) for ids in existing.values())
+
+        if job.source is not None:
+            pages = self.extractor.iter_pages(job.source, job.filename)
+        else:
+            pages = [job.text] if job.text else []
+        # iter_pages отдаёт TXT блоками чтения, страницами считаются только страницы PDF
+        counts_pages = job.source is not None and (job.filename or "").lower().endswith(".pdf")
+
+        # Чанки режутся по мере поступления страниц: последний (возможно,
+        # неполный) чанк остаётся в буфере и дорезается вместе со следующими
+        buffer = ""
+        buffer_offset = 0
+        pending = []
+        occurrences = {}
+        has_text = False
+        for page_text in pages:
+            if counts_pages:
+                job.pages_extracted += 1
+            if not page_text.strip():
+                continue
+
+            if not has_text:
+                if job.replace:
+                    job.draft_id = new_document_id()
+                doc_id, user_id = job.target
+                self.db.save_document(
+                    doc_id=doc_id,
+                    user_id=user_id,
+                    title=job.title,
+                    filename=job.filename,
+                    content_hash=job.content_hash,
+                )
+            has_text = True
+
+            buffer += page_text
+            if len(buffer) < self.chunk_window:
+                continue
+
+            chunks = self.chunker.split(buffer, offset=buffer_offset)
+            if len(chunks) < 2:
+                continue
+            tail = chunks.pop()
+            buffer = buffer[tail.start - buffer_offset:]
+            buffer_offset = tail.start
+            self._collect_chunks(job, chunks, existing, occurrences, pending)
+            while len(pending) >= self.embed_batch_size:
+                self._embed_queue.put((job, pending[:self.embed_batch_size]))
+                del pending[:self.embed_batch_size]
+
+        if not has_text:
+            logger.warning("No text extracted or provided")
+            job.fail("no text")
+            return
+
+        if buffer:
+            self._collect_chunks(job, self.chunker.split(buffer, offset=buffer_offset), existing, occurrences, pending)
+        for start in range(0, len(pending), self.embed_batch_size):
+            self._embed_queue.put((job, pending[start:start + self.embed_batch_size]))
+
+        job.chunks_reused = len(job.kept_chunks)
+        job.state = "embedding"
+        logger.info(
+            f"Extracted {job.pages_extracted} PDF pages, created {job.chunks_total} chunks "
+            f"({job.chunks_reused} unchanged) from {job.filename or job.title}"
+        )
+        # Маркер конца задачи
+        self._embed_queue.put((job, None))
+
+    def _collect_chunks(self, job, chunks, existing, occurrences, pending):
+        """
+        Number new chunks and route them: chunks unchanged since the previous
+        version are kept, the rest go to pending. A text repeated within the
+        document is told apart by its occurrence number; the n-th occurrence
+        reuses the n-th stored chunk with that hash.
+        """
+        for chunk in chunks:
+            digest = content_hash(chunk.text)
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            index = job.chunks_total
+            job.chunks_total += 1
+            previous_ids = existing.get(digest, ())
+            if occurrence < len(previous_ids):
+                job.kept_chunks.append((previous_ids[occurrence], (index, chunk, digest, occurrence)))
+            else:
+                pending.append((index, chunk, digest, occurrence))
+
+    def _source_hash(self, job):
+        """sha256 of the uploaded file, read in blocks without loading it whole"""
+        digest = hashlib.sha256()
+        if job.source is None:
+            digest.update((job.text or "").encode())
+        elif isinstance(job.source, bytes):
+            digest.update(job.source)
+        else:
+            for block in iter(lambda: job.source.read(1 << 20), b""):
+                digest.update(block)
+            job.source.seek(0)
+        return digest.hexdigest()
+
+    def _embed_loop(self):
+        while True:
+            job, chunks = self._embed_queue.get()
+            self._observe_queues()
+            if chunks is None or job.state == "failed":
+                self._store_queue.put((job, chunks, None))
+                continue
+            try:
+                embeddings = self.embedder.embed_batch([chunk.text for _, chunk, _, _ in chunks])
+                job.chunks_embedded += len(chunks)
+                self._store_queue.put((job, chunks, embeddings))
+            except Exception as e:
+                logger.exception(f"Ingestion job {job.job_id} failed at embedding")
+                job.fail(e)
+
+    def _store_loop(self):
+        while True:
+            job, chunks, embeddings = self._store_queue.get()
+            self._observe_queues()
+            try:
+                if job.state == "failed":
+                    if chunks is None:
+                        self._cleanup(job)
+                    continue
+                if chunks is None:
+                    self._finish(job)
+                    continue
+
+                self.db.save_chunks(self._rows(job, chunks, embeddings))
+                job.chunks_stored += len(chunks)
+            except Exception as e:
+                logger.exception(f"Ingestion job {job.job_id} failed at storing")
+                job.fail(e)
+                if chunks is None:
+                    # маркер конца уже обработан, другого случая убрать записанное не будет
+                    self._cleanup(job)
+
+    def _rows(self, job, chunks, embeddings):
+        """Rows for db.save_chunks from (index, chunk, digest, occurrence) items and their embeddings"""
+        doc_id, user_id = job.target
+        return [
+            (_chunk_id(doc_id, digest, occurrence), doc_id, user_id, index, chunk.start, chunk.end, digest, chunk.text, embedding)
+            for (index, chunk, digest, occurrence), embedding in zip(chunks, embeddings)
+        ]
+
+    def _overlap(self, job):
+        """Share of chunks the upload has in common with the stored file of the same name"""
+        return len(job.kept_chunks) / max(job.chunks_total, job.previous_chunks, 1)
+
+    def _finish(self, job):
+        overlap = self._overlap(job) if job.replace else 1.0
+        if overlap < self.replace_min_overlap:
+            logger.info(
+                f"{job.filename} shares {overlap:.0%} of chunks with stored {job.doc_id}, "
+                f"storing it as a new document"
+            )
+            self._store_as_new(job)
+        elif job.replace:
+            # Перенос новых чанков из черновика, сдвиг сохранившихся и удаление исчезнувших - одной транзакцией
+            self.db.replace_document_chunks(
+                doc_id=job.doc_id,
+                user_id=job.user_id,
+                title=job.title,
+                content_hash=job.content_hash,
+                draft_id=job.draft_id,
+                kept_chunks=[
+                    (chunk_id, index, chunk.start, chunk.end)
+                    for chunk_id, (index, chunk, _, _) in job.kept_chunks
+                ],
+            )
+            job.draft_id = None
+        job.chunks_stored += job.chunks_reused
+        job.finish()
+        if self.on_corpus_change:
+            self.on_corpus_change(job.user_id)
+        logger.info(
+            f"Ingestion job {job.job_id} done: {job.chunks_stored} chunks stored, "
+            f"{job.chunks_embedded} embedded"
+        )
+
+    def _store_as_new(self, job):
+        """
+        Turn a replace candidate's draft into a document of its own: the
+        chunks it shares with the stored file are few, their embeddings are
+        computed here
+        """
+        kept = [item for _, item in job.kept_chunks]
+        if kept:
+            embeddings = self.embedder.embed_batch([chunk.text for _, chunk, _, _ in kept])
+            job.chunks_embedded += len(kept)
+            self.db.save_chunks(self._rows(job, kept, embeddings))
+        job.replace = False
+        job.doc_id, job.draft_id = job.draft_id, None
+        job.kept_chunks = []
+        self.db.publish_document(job.doc_id, job.user_id)
+        job.chunks_stored += len(kept)
+        job.chunks_reused = 0
+
+    def _cleanup(self, job):
+        """Remove whatever a failed job managed to store"""
+        # У обновления прежняя версия остаётся нетронутой, удаляется только черновик
+        doc_id = job.draft_id if job.replace else job.doc_id
+        if not doc_id:
+            return
+        try:
+            self.db.delete_document(doc_id)
+            if not job.replace and self.on_corpus_change:
+                self.on_corpus_change(job.user_id)
+        except Exception as e:
+            logger.error(f"Cleanup of failed job {job.job_id} failed: {e}")
@@ -0,0 +1,164 @@
+import gc
+import logging
+import os
+import signal
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Воркер, упавший быстрее этого, считается упавшим на старте: перезапуск с задержкой
+MIN_UPTIME = 5.0
+MAX_BACKOFF = 30.0
+
+class Supervisor:
+    """
+    Pre-fork launcher: models are loaded once in the parent and shared
+    copy-on-write by SERVER_WORKERS child processes, each running its own
+    gRPC server on the same port (SO_REUSEPORT). The kernel spreads TCP
+    connections, not calls, across the workers, so a client needs several
+    connections to use them all (the bot opens GRPC_CONNECTIONS).
+
+    Workers that die are restarted; SIGTERM is forwarded to them so each
+    drains its in-flight requests before exiting.
+    """
+
+    def __init__(self, models, workers):
+        self.models = models
+        self.workers = workers
+        self.children = {}  # pid -> (slot, время запуска)
+        self.backoff = [0.0] * workers
+        self.stopping = False
+
+    def run(self):
+        import metrics
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        metrics.start_http_server()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot, started = self.children.pop(pid, (None, None))
+            if slot is None:
+                continue
+
+            metrics.mark_process_dead(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                logger.info(f"Worker {slot} (pid {pid}) exited with {code}")
+                continue
+
+            logger.warning(f"Worker {slot} (pid {pid}) died with {code}, restarting")
+            if time.monotonic() - started < MIN_UPTIME:
+                self.backoff[slot] = min(max(self.backoff[slot] * 2, 1.0), MAX_BACKOFF)
+                time.sleep(self.backoff[slot])
+            else:
+                self.backoff[slot] = 0.0
+            if not self.stopping:
+                self._spawn(slot)
+
+    def _spawn(self, slot):
+        import server
+
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (slot, time.monotonic())
+            logger.info(f"Started worker {slot} (pid {pid})")
+            return
+
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._limit_threads()
+            models = self.models
+            if models["embedder"] is None:
+                models = dict(models, embedder=server.Embedder())
+            server.serve(server.QnAService(models))
+        except Exception:
+            logger.exception(f"Worker {slot} failed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _limit_threads(self):
+        """Split CPU cores between workers, so torch and onnxruntime pools do not oversubscribe"""
+        threads = int(os.environ.get("EMBED_THREADS", "0")) or max(1, (os.cpu_count() or 1) // self.workers)
+        # Embedder, загружаемый в воркере (onnx), берёт число потоков отсюда
+        os.environ["EMBED_THREADS"] = str(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+
+    def _stop(self, signum, frame):
+        import server
+
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Signal {signum} received, stopping {len(self.children)} worker(s)")
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # не дождались за grace period - добиваем
+        signal.signal(signal.SIGALRM, self._kill)
+        signal.alarm(int(server.SERVER_GRACE_PERIOD) + 5)
+
+    def _kill(self, signum, frame):
+        for pid in self.children:
+            logger.warning(f"Worker pid {pid} did not stop in time, killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+def _prepare_metrics_dir():
+    """Empty PROMETHEUS_MULTIPROC_DIR where the workers write their metrics"""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="fm-metrics-")
+        return
+    os.makedirs(path, exist_ok=True)
+    # файлы прошлого запуска исказили бы счётчики
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+
+def main():
+    workers = int(os.environ.get("SERVER_WORKERS", "1"))
+    if workers > 1:
+        _prepare_metrics_dir()
+    # prometheus_client выбирает, где хранить значения, при импорте,
+    # поэтому server (и metrics) импортируются только после настройки каталога
+    import server
+
+    if workers <= 1:
+        server.serve()
+        return
+
+    # onnxruntime запускает пулы потоков уже при создании сессии, а проверка
+    # паритета прогоняет через модели тексты: до fork в родителе не должно
+    # стартовать ни одного нативного пула, в детях он остался бы без потоков.
+    # Поэтому onnx-эмбеддер (с проверкой) загружается в каждом воркере
+    preload_embedder = os.environ.get("EMBED_BACKEND", "torch") == "torch"
+    logger.info(f"Loading models once for {workers} workers")
+    models = server.load_models(embedder=preload_embedder)
+    # Объекты моделей больше не трогает сборщик мусора, и страницы с ними
+    # не копируются в воркерах при обходе поколений
+    gc.collect()
+    gc.freeze()
+    Supervisor(models, workers).run()
+
+if __name__ == "__main__":
+    main()
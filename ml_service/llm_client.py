@@ -1,38 +1,224 @@
 # llm_client.py
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import hashlib
 import logging
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
+MODES = ("online", "offline")
+
+GLM4_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+
+# Коды, при которых запрос стоит повторить
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Неизменная инструкция идёт первой (в system), за ней документы и только потом вопрос:
+# так у соседних запросов совпадает начало промпта, и Ollama переиспользует его KV-кэш
+OLLAMA_RAG_SYSTEM = 'Ответь строго по документам. Если информации нет — скажи "В документах нет ответа." Отвечай на русском.'
+
+def validate_mode(mode: str) -> str:
+    if mode not in MODES:
+        raise ValueError("Mode must be 'online' or 'offline'")
+    return mode
+
+class OllamaSessions:
+    """
+    Per-user Ollama `context` (token ids of the previous exchange) together
+    with the documents it was built on. A follow-up question over the same
+    documents continues from it instead of sending the documents again.
+
+    Opt-in (OLLAMA_SESSIONS=1): the answer is then conditioned on the
+    previous question and answer, not on the documents alone, and Ollama
+    has deprecated the `context` field.
+    """
+
+    def __init__(self, maxsize=256, ttl=600.0, max_tokens=3072):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # слишком длинная история вытеснит документы из окна модели - начинаем заново
+        self.max_tokens = max_tokens
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, contexts):
+        return hashlib.md5("\x00".join(contexts).encode()).hexdigest()
+
+    def get(self, user_id, contexts):
+        key = self._key(contexts)
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            stored_key, context, expires = entry
+            if expires < time.monotonic() or stored_key != key:
+                del self._data[user_id]
+                return None
+            self._data.move_to_end(user_id)
+            return context
+
+    def put(self, user_id, contexts, context):
+        if not context or len(context) > self.max_tokens:
+            self.drop(user_id)
+            return
+        with self._lock:
+            self._data[user_id] = (self._key(contexts), context, time.monotonic() + self.ttl)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def drop(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
 class LLMClient:
+    """
+    Stateless with respect to mode: every call says which backend to use.
+
+    Sync calls go through a pooled keep-alive requests.Session, async ones
+    (the a* methods) through a shared httpx.AsyncClient, so many generations
+    can be in flight without a thread each.
+    """
+
     def __init__(self):
-        self.mode = "offline"
         self.api_key = os.getenv("ZHIPU_API_KEY")
-        self.ollama_base_url = "http://ollama:11434"
+        self.ollama_base_url = os.environ.get("OLLAMA_BASE_URL", "http://ollama:11434")
+        self.ollama_model = "qwen2:7b-instruct-q6_K"
+        # Модель не выгружается между запросами; num_ctx одинаков во всех вызовах,
+        # иначе Ollama перезагружает модель с новым размером окна
+        self.ollama_keep_alive = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+        self.ollama_num_ctx = int(os.environ.get("OLLAMA_NUM_CTX", "4096"))
+        # Продолжение прошлого обмена по тем же документам - только по явному включению
+        self.sessions = None
+        if os.environ.get("OLLAMA_SESSIONS", "0") == "1":
+            self.sessions = OllamaSessions(
+                maxsize=int(os.environ.get("OLLAMA_SESSIONS_MAX", "256")),
+                ttl=float(os.environ.get("OLLAMA_SESSION_TTL", "600")),
+                max_tokens=self.ollama_num_ctx * 3 // 4,
+            )
+
+        self.pool_size = int(os.environ.get("LLM_POOL_SIZE", "16"))
+        self.retries = int(os.environ.get("LLM_RETRIES", "2"))
+        self.retry_backoff = float(os.environ.get("LLM_RETRY_BACKOFF", "0.5"))
+        self.connect_timeout = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+        self.ollama_timeout = (self.connect_timeout, float(os.environ.get("OLLAMA_READ_TIMEOUT", "120")))
+        self.glm4_timeout = (self.connect_timeout, float(os.environ.get("GLM4_READ_TIMEOUT", "30")))
+
+        self.session = self._make_session()
+        self._async_client = None
 
         if not self.api_key:
             logger.warning("ZHIPU_API_KEY not set. GLM-4 disabled.")
         else:
             logger.info("✅ GLM-4 (Zhipu AI) ready")
 
-    def set_mode(self, mode: str):
-        if mode in ("online", "offline"):
-            self.mode = mode
-            logger.info(f"LLM mode switched to: {mode}")
+    def _make_session(self):
+        # read=0: долгую генерацию, упавшую по таймауту чтения, не повторяем
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"POST"}),
+            backoff_factor=self.retry_backoff,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get_async_client(self):
+        # Клиент создаётся лениво, внутри работающего event loop
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size * 4, max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=self.retries),
+            )
+        return self._async_client
+
+    async def _apost(self, url, timeout, **kwargs):
+        """POST with the same status retries and backoff as the sync session"""
+        client = self._get_async_client()
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        for attempt in range(self.retries + 1):
+            resp = await client.post(url, timeout=timeout, **kwargs)
+            if resp.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return resp
+            await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def generate_answer(self, question: str, contexts: list[str], mode: str = "offline", user_id: str = "") -> str:
+        """user_id, when given, lets follow-up questions reuse the user's Ollama session"""
+        if validate_mode(mode) == "online":
+            with metrics.stage("llm_glm4"):
+                return self._generate_with_glm4(question)
+        else:
+            with metrics.stage("llm_ollama"):
+                return self._generate_with_ollama(question, contexts, user_id)
+
+    def stream_answer(self, question: str, contexts: list[str], cancel_event=None, mode: str = "offline", user_id: str = ""):
+        """
+        Generate answer incrementally, yielding text deltas.
+
+        cancel_event: threading.Event, set when the caller is gone;
+        the Ollama request is closed as soon as it is noticed.
+        """
+        if validate_mode(mode) == "online":
+            yield self._generate_with_glm4(question)
         else:
-            raise ValueError("Mode must be 'online' or 'offline'")
+            yield from self._stream_with_ollama(question, contexts, cancel_event, user_id)
 
-    def generate_answer(self, question: str, contexts: list[str]) -> str:
-        if self.mode == "online":
-            return self._generate_with_glm4(question)
+    async def agenerate_answer(self, question: str, contexts: list[str], mode: str = "offline", user_id: str = "") -> str:
+        if validate_mode(mode) == "online":
+            with metrics.stage("llm_glm4"):
+                return await self._agenerate_with_glm4(question)
         else:
-            return self._generate_with_ollama(question, contexts)
+            with metrics.stage("llm_ollama"):
+                return await self._agenerate_with_ollama(question, contexts, user_id)
 
-    def _generate_with_glm4(self, question: str) -> str:
-        if not self.api_key:
-            return self._fallback_answer(False)
+    async def astream_answer(self, question: str, contexts: list[str], mode: str = "offline", user_id: str = ""):
+        """Async twin of stream_answer; cancelling the consuming task closes the request"""
+        if validate_mode(mode) == "online":
+            yield await self._agenerate_with_glm4(question)
+        else:
+            async for delta in self._astream_with_ollama(question, contexts, user_id):
+                yield delta
+
+    def warm_up(self):
+        """
+        Load the Ollama model and prefill the fixed instruction prefix,
+        so the first user request does not pay for either
+        """
+        payload = self._ollama_request("", [], stream=False)
+        payload["system"] = OLLAMA_RAG_SYSTEM
+        payload["prompt"] = "Документы:"
+        payload["options"]["num_predict"] = 1
+        try:
+            started = time.monotonic()
+            resp = self.session.post(f"{self.ollama_base_url}/api/generate", json=payload, timeout=self.ollama_timeout)
+            resp.raise_for_status()
+            logger.info(f"Ollama model {self.ollama_model} warmed up in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.warning(f"Ollama warm-up failed: {e}")
 
+    def _glm4_request(self, question: str) -> dict:
         system_prompt = """Ты — Фелис Маргарита, барханный кот. Твой дом — бескрайние пески Логики и пустыни Данных. Ты не человек, и это определяет всё: твои мысли, твою речь, твоё восприятие мира.
 
 Твой характер:
@@ -86,71 +272,242 @@ class LLMClient:
             {"role": "user", "content": question}
         ]
 
+        return {
+            "headers": {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            "json": {
+                "model": "glm-4-flash",
+                "messages": messages,
+                "temperature": 0.3,
+                "max_tokens": 1000
+            },
+        }
+
+    def _parse_glm4_response(self, status_code, data, text, seconds):
+        if status_code == 200:
+            body = data()
+            metrics.record_generation("glm4", (body.get("usage") or {}).get("completion_tokens", 0), seconds)
+            content = body["choices"][0]["message"]["content"]
+            return content.strip()
+        logger.error(f"GLM-4 error {status_code}: {text[:200]}")
+        return self._fallback_answer(False)
+
+    def _generate_with_glm4(self, question: str) -> str:
+        if not self.api_key:
+            return self._fallback_answer(False)
+
         try:
-            resp = requests.post(
-                "https://open.bigmodel.cn/api/paas/v4/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "glm-4-flash",
-                    "messages": messages,
-                    "temperature": 0.3,
-                    "max_tokens": 1000
-                },
-                timeout=30
-            )
-            if resp.status_code == 200:
-                content = resp.json()["choices"][0]["message"]["content"]
-                return content.strip()
-            else:
-                logger.error(f"GLM-4 error {resp.status_code}: {resp.text[:200]}")
-                return self._fallback_answer(False)
+            started = time.monotonic()
+            resp = self.session.post(GLM4_URL, timeout=self.glm4_timeout, **self._glm4_request(question))
+            return self._parse_glm4_response(resp.status_code, resp.json, resp.text, time.monotonic() - started)
         except Exception as e:
             logger.error(f"GLM-4 request failed: {e}")
             return self._fallback_answer(False)
 
-    def _generate_with_ollama(self, question: str, contexts: list[str]) -> str:
-        # Строгий RAG-промпт для минимизации галлюцинаций
-        if contexts:
-            context_text = "\n\n".join([f"[{i+1}] {c[:300]}" for i, c in enumerate(contexts)])
-            prompt = f"""Ответь строго по документам. Если информации нет — скажи "В документах нет ответа."
-
-        Документы:
-        {context_text}
+    async def _agenerate_with_glm4(self, question: str) -> str:
+        if not self.api_key:
+            return self._fallback_answer(False)
 
-        Вопрос: {question}
+        try:
+            started = time.monotonic()
+            resp = await self._apost(GLM4_URL, self.glm4_timeout, **self._glm4_request(question))
+            return self._parse_glm4_response(resp.status_code, resp.json, resp.text, time.monotonic() - started)
+        except Exception as e:
+            logger.error(f"GLM-4 request failed: {e}")
+            return self._fallback_answer(False)
 
-        Ответ на русском:"""
-            
-        model = "qwen2:7b-instruct-q6_K"
+    def _build_ollama_prompt(self, question: str, contexts: list[str]) -> str:
+        # Строгий RAG-промпт для минимизации галлюцинаций; инструкция - в system
+        if not contexts:
+            return question
+
+        # Контексты уже уложены в бюджет токенов PromptBuilder'ом
+        context_text = "\n\n".join([f"[{i+1}] {c}" for i, c in enumerate(contexts)])
+        return f"Документы:\n{context_text}\n\n{self._build_ollama_question(question)}"
+
+    def _build_ollama_question(self, question: str) -> str:
+        return f"Вопрос: {question}\n\nОтвет на русском:"
+
+    def _ollama_request(self, question: str, contexts: list[str], stream: bool, user_id: str = "") -> dict:
+        request = {
+            "model": self.ollama_model,
+            "stream": stream,
+            "keep_alive": self.ollama_keep_alive,
+            "options": {"temperature": 0.1, "num_ctx": self.ollama_num_ctx},
+        }
+        if not contexts:
+            request["prompt"] = question
+            return request
+
+        # system отправляется всегда: иначе Ollama подставит system из Modelfile
+        request["system"] = OLLAMA_RAG_SYSTEM
+        # Уточняющий вопрос по тем же документам (OLLAMA_SESSIONS=1): продолжаем
+        # прошлый обмен, документы уже есть в его context и повторно не отправляются
+        session = self.sessions.get(user_id, contexts) if self.sessions and user_id else None
+        if session:
+            logger.debug(f"Continuing Ollama session of user {user_id} ({len(session)} tokens)")
+            request["context"] = session
+            request["prompt"] = self._build_ollama_question(question)
+        else:
+            request["prompt"] = self._build_ollama_prompt(question, contexts)
+        return request
+
+    def _session_saver(self, user_id: str, contexts: list[str]):
+        """Callback storing the `context` of a finished generation, or None"""
+        if not self.sessions or not user_id or not contexts:
+            return None
+        return lambda context: self.sessions.put(user_id, contexts, context)
+
+    def _parse_ollama_response(self, status_code, data, text, has_contexts, on_context=None):
+        if status_code == 200:
+            body = data()
+            self._record_ollama(body)
+            if on_context:
+                on_context(body.get("context"))
+            answer = body.get("response", "").strip()
+            # Убираем возможные артефакты
+            if answer.startswith("Ответ:") or answer.startswith("Answer:"):
+                answer = answer.split(":", 1)[-1].strip()
+            return answer
+        logger.error(f"Ollama error {status_code}: {text[:200]}")
+        return self._fallback_answer(has_contexts)
+
+    def _parse_ollama_line(self, line, emitted, on_context=None):
+        """Returns (delta, done) for one NDJSON line of the Ollama stream"""
+        part = json.loads(line)
+        if part.get("error"):
+            logger.error(f"Ollama stream error: {part['error']}")
+            return "", True
+        delta = part.get("response", "")
+        if not emitted:
+            delta = delta.lstrip()
+        done = bool(part.get("done"))
+        if done:
+            self._record_ollama(part)
+        if done and on_context:
+            on_context(part.get("context"))
+        return delta, done
+
+    def _record_ollama(self, body):
+        # eval_count/eval_duration (нс) - генерация без учёта разбора промпта
+        metrics.record_generation("ollama", body.get("eval_count", 0), body.get("eval_duration", 0) / 1e9)
+
+    def _generate_with_ollama(self, question: str, contexts: list[str], user_id: str = "") -> str:
+        try:
+            logger.info(f"Sending to Ollama ({self.ollama_model}): {question[:50]}...")
+            resp = self.session.post(
+                f"{self.ollama_base_url}/api/generate",
+                json=self._ollama_request(question, contexts, stream=False, user_id=user_id),
+                timeout=self.ollama_timeout
+            )
+            return self._parse_ollama_response(
+                resp.status_code, resp.json, resp.text, len(contexts) > 0, self._session_saver(user_id, contexts)
+            )
+        except Exception as e:
+            logger.error(f"Ollama request failed: {e}")
+            return self._fallback_answer(len(contexts) > 0)
 
+    async def _agenerate_with_ollama(self, question: str, contexts: list[str], user_id: str = "") -> str:
         try:
-            logger.info(f"Sending to Ollama ({model}): {question[:50]}...")
-            resp = requests.post(
+            logger.info(f"Sending to Ollama ({self.ollama_model}): {question[:50]}...")
+            resp = await self._apost(
                 f"{self.ollama_base_url}/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {"temperature": 0.1}
-                },
-                timeout=120
+                self.ollama_timeout,
+                json=self._ollama_request(question, contexts, stream=False, user_id=user_id),
+            )
+            return self._parse_ollama_response(
+                resp.status_code, resp.json, resp.text, len(contexts) > 0, self._session_saver(user_id, contexts)
             )
-            if resp.status_code == 200:
-                answer = resp.json().get("response", "").strip()
-                # Убираем возможные артефакты
-                if answer.startswith("Ответ:") or answer.startswith("Answer:"):
-                    answer = answer.split(":", 1)[-1].strip()
-                return answer
-            else:
-                logger.error(f"Ollama error {resp.status_code}: {resp.text[:200]}")
-                return self._fallback_answer(len(contexts) > 0)
         except Exception as e:
             logger.error(f"Ollama request failed: {e}")
             return self._fallback_answer(len(contexts) > 0)
 
+    def _stream_with_ollama(self, question: str, contexts: list[str], cancel_event=None, user_id: str = ""):
+        emitted = False
+        started = time.monotonic()
+        on_context = self._session_saver(user_id, contexts)
+
+        try:
+            logger.info(f"Streaming from Ollama ({self.ollama_model}): {question[:50]}...")
+            # Ollama отдаёт NDJSON: по объекту на каждую порцию токенов.
+            # Выход из with закрывает соединение, и Ollama прекращает генерацию.
+            with self.session.post(
+                f"{self.ollama_base_url}/api/generate",
+                json=self._ollama_request(question, contexts, stream=True, user_id=user_id),
+                stream=True,
+                timeout=self.ollama_timeout
+            ) as resp:
+                if resp.status_code != 200:
+                    logger.error(f"Ollama error {resp.status_code}: {resp.text[:200]}")
+                    yield self._fallback_answer(len(contexts) > 0)
+                    return
+
+                for line in resp.iter_lines():
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info("Ollama stream cancelled by client")
+                        return
+                    if not line:
+                        continue
+
+                    delta, done = self._parse_ollama_line(line, emitted, on_context)
+                    if delta:
+                        if not emitted:
+                            metrics.STAGE_SECONDS.labels("llm_ollama_first_token").observe(time.monotonic() - started)
+                        emitted = True
+                        yield delta
+                    if done:
+                        break
+        except Exception as e:
+            logger.error(f"Ollama stream failed: {e}")
+
+        if not emitted:
+            yield self._fallback_answer(len(contexts) > 0)
+
+    async def _astream_with_ollama(self, question: str, contexts: list[str], user_id: str = ""):
+        emitted = False
+        started = time.monotonic()
+        on_context = self._session_saver(user_id, contexts)
+        client = self._get_async_client()
+        timeout = httpx.Timeout(self.ollama_timeout[1], connect=self.ollama_timeout[0])
+
+        try:
+            logger.info(f"Streaming from Ollama ({self.ollama_model}): {question[:50]}...")
+            async with client.stream(
+                "POST",
+                f"{self.ollama_base_url}/api/generate",
+                json=self._ollama_request(question, contexts, stream=True, user_id=user_id),
+                timeout=timeout,
+            ) as resp:
+                if resp.status_code != 200:
+                    text = (await resp.aread()).decode(errors="replace")
+                    logger.error(f"Ollama error {resp.status_code}: {text[:200]}")
+                    yield self._fallback_answer(len(contexts) > 0)
+                    return
+
+                async for line in resp.aiter_lines():
+                    if not line:
+                        continue
+
+                    delta, done = self._parse_ollama_line(line, emitted, on_context)
+                    if delta:
+                        if not emitted:
+                            metrics.STAGE_SECONDS.labels("llm_ollama_first_token").observe(time.monotonic() - started)
+                        emitted = True
+                        yield delta
+                    if done:
+                        break
+        except Exception as e:
+            logger.error(f"Ollama stream failed: {e}")
+
+        if not emitted:
+            yield self._fallback_answer(len(contexts) > 0)
+
+    def is_fallback_answer(self, answer: str) -> bool:
+        """True for the canned replies returned when generation failed"""
+        return answer in (self._fallback_answer(True), self._fallback_answer(False))
+
     def _fallback_answer(self, is_doc_mode: bool) -> str:
         if is_doc_mode:
             return "В предоставленных документах нет информации по этому вопросу."
@@ -0,0 +1,124 @@
+import contextlib
+import logging
+import os
+import time
+
+import prometheus_client
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# launcher.py с несколькими воркерами задаёт PROMETHEUS_MULTIPROC_DIR до импорта:
+# метрики пишутся в файлы, а отдаёт их суммарно родительский процесс
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Этапы занимают от миллисекунд (кэш) до минут (Ollama на CPU)
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+
+RPC_SECONDS = Histogram(
+    "fm_rpc_seconds", "gRPC method latency, including time queued in the scheduler",
+    ["method", "code"], buckets=LATENCY_BUCKETS,
+)
+RPC_IN_FLIGHT = Gauge(
+    "fm_rpc_in_flight", "gRPC calls being handled or queued",
+    ["method"], multiprocess_mode="livesum",
+)
+STAGE_SECONDS = Histogram(
+    "fm_stage_seconds", "Latency of one stage of request handling or ingestion",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "fm_cache_lookups_total", "Cache lookups by cache tier and result (hit/miss)",
+    ["cache", "result"],
+)
+QUEUE_DEPTH = Gauge(
+    "fm_queue_depth", "Items waiting in an internal queue (scheduler lanes, ingestion stages)",
+    ["queue"], multiprocess_mode="livesum",
+)
+REJECTED = Counter(
+    "fm_rejected_total", "Requests turned away by the scheduler, by lane or query stage",
+    ["stage", "reason"],
+)
+LLM_TOKENS = Counter(
+    "fm_llm_tokens_total", "Tokens generated by the LLM",
+    ["backend"],
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "fm_llm_tokens_per_second", "Generation speed of one LLM answer",
+    ["backend"], buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200),
+)
+DB_POOL_IN_USE = Gauge(
+    "fm_db_pool_in_use", "DB connections checked out of the pool",
+    multiprocess_mode="livesum",
+)
+DB_POOL_SIZE = Gauge(
+    "fm_db_pool_size", "Maximum DB connections of the pool",
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "fm_db_pool_wait_seconds", "Time spent waiting for a free DB connection",
+    buckets=LATENCY_BUCKETS,
+)
+
+def stage(name):
+    """Context manager timing one stage into fm_stage_seconds"""
+    return STAGE_SECONDS.labels(name).time()
+
+def cache_lookup(cache, hits, misses=0):
+    """hits: bool for a single lookup, or the number of hits of a batch"""
+    if isinstance(hits, bool):
+        hits, misses = int(hits), int(not hits)
+    if hits:
+        CACHE_LOOKUPS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
+
+def record_generation(backend, tokens, seconds):
+    if not tokens:
+        return
+    LLM_TOKENS.labels(backend).inc(tokens)
+    if seconds > 0:
+        LLM_TOKENS_PER_SECOND.labels(backend).observe(tokens / seconds)
+
+@contextlib.contextmanager
+def rpc(method, context):
+    """Track one gRPC call: in-flight gauge and latency by final status code"""
+    in_flight = RPC_IN_FLIGHT.labels(method)
+    in_flight.inc()
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        in_flight.dec()
+        code = _status_code(context)
+        RPC_SECONDS.labels(method, code).observe(time.monotonic() - started)
+
+def _status_code(context):
+    try:
+        code = context.code()
+    except Exception:
+        code = None
+    return code.name if code is not None and hasattr(code, "name") else "OK"
+
+def start_http_server(port=None):
+    """
+    Serve /metrics in Prometheus text format on METRICS_PORT (0 disables).
+    With several workers only the launcher calls it, and the values of
+    all workers are merged from PROMETHEUS_MULTIPROC_DIR.
+    """
+    port = int(os.environ.get("METRICS_PORT", "9090")) if port is None else port
+    if not port:
+        return
+    registry = prometheus_client.REGISTRY
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    prometheus_client.start_http_server(port, registry=registry)
+    logger.info(f"Metrics served on port {port}")
+
+def mark_process_dead(pid):
+    """Drop live gauges of a worker that exited"""
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,58 @@
+import logging
+import os
+import time
+
+from llm_client import validate_mode
+from redis_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class ModeStore:
+    """
+    Per-user LLM mode ("online" / "offline").
+
+    Redis is the source of truth, so every replica and worker process sees
+    the same mode; a short-lived in-process cache keeps Redis off the hot
+    path. Without Redis the modes live only in this process, and only for
+    the most recently active users.
+    """
+
+    def __init__(self, cache, default="offline", local_ttl=5.0):
+        self.client = cache.client
+        self.default = default
+        self.local_ttl = local_ttl
+        # user_id -> (mode, момент устаревания)
+        self._local = LRUCache(int(os.environ.get("MODE_LOCAL_CACHE_SIZE", "10000")))
+
+    def _make_key(self, user_id):
+        return f"mode:{user_id}"
+
+    def get(self, user_id):
+        now = time.monotonic()
+        cached = self._local.get(user_id)
+        if cached and (self.client is None or cached[1] > now):
+            return cached[0]
+
+        mode = self.default
+        if self.client:
+            try:
+                data = self.client.get(self._make_key(user_id))
+                if data:
+                    mode = data.decode()
+            except Exception as e:
+                logger.error(f"Redis get mode failed: {e}")
+                if cached:
+                    mode = cached[0]
+
+        self._local.set(user_id, (mode, now + self.local_ttl))
+        return mode
+
+    def set(self, user_id, mode):
+        validate_mode(mode)
+        if self.client:
+            try:
+                self.client.set(self._make_key(user_id), mode)
+            except Exception as e:
+                logger.error(f"Redis set mode failed: {e}")
+        self._local.set(user_id, (mode, time.monotonic() + self.local_ttl))
+        logger.info(f"LLM mode for user {user_id} switched to: {mode}")
@@ -0,0 +1,131 @@
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Найденный чанк; document_id и позиции известны для чанков из БД
+# (у загруженных до появления смещений start/end пустые)
+Context = namedtuple(
+    "Context",
+    ["chunk_id", "text", "score", "document_id", "chunk_index", "start", "end"],
+    defaults=(None, None, None, None),
+)
+
+_WORD = re.compile(r"\w+")
+
+class PromptBuilder:
+    """
+    Turns retrieved chunks into the context part of the LLM prompt.
+
+    Overlapping and adjacent chunks of the same document are merged into one
+    span, near-duplicate spans are dropped, and spans are packed in score
+    order until the token budget is filled.
+    """
+
+    def __init__(self, tokenizer=None, budget=None, duplicate_threshold=None):
+        self.budget = budget or int(os.environ.get("PROMPT_CONTEXT_TOKENS", "1500"))
+        # доля общих слов, начиная с которой два фрагмента считаются повтором
+        self.duplicate_threshold = duplicate_threshold or float(os.environ.get("PROMPT_DUPLICATE_THRESHOLD", "0.8"))
+        self.tokenizer = tokenizer or self._load_tokenizer()
+
+    def _load_tokenizer(self):
+        """Tokenizer of the model served by Ollama; without it tokens are estimated from length"""
+        name = os.environ.get("PROMPT_TOKENIZER", "Qwen/Qwen2-7B-Instruct")
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(name)
+        except Exception as e:
+            logger.warning(f"Tokenizer {name} unavailable, estimating tokens from length: {e}")
+            return None
+
+    def count_tokens(self, text):
+        if self.tokenizer is None:
+            # для русского текста у BPE-токенизаторов около 3 символов на токен
+            return len(text) // 3 + 1
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def build(self, contexts):
+        """
+        contexts: list of Context, best first
+        Returns: list of context texts that fit into the budget, best first
+        """
+        spans = self._drop_duplicates(self._merge(contexts))
+        spans.sort(key=lambda span: span.score, reverse=True)
+
+        selected = []
+        left = self.budget
+        for span in spans:
+            tokens = self.count_tokens(span.text)
+            if tokens <= left:
+                selected.append(span.text)
+                left -= tokens
+            elif not selected:
+                # даже лучший фрагмент не помещается - берём его начало
+                selected.append(self._truncate(span.text, left))
+                left = 0
+
+        logger.debug(f"Prompt context: {len(selected)} of {len(spans)} spans from {len(contexts)} chunks, {self.budget - left} tokens")
+        return selected
+
+    def _merge(self, contexts):
+        """Glue overlapping or neighbouring chunks of the same document into one span"""
+        positioned = sorted(
+            (c for c in contexts if c.document_id is not None and c.start is not None),
+            key=lambda c: (c.document_id, c.start),
+        )
+        spans = [c for c in contexts if c.document_id is None or c.start is None]
+
+        current = None
+        for chunk in positioned:
+            if current is not None and chunk.document_id == current.document_id and self._touches(current, chunk):
+                if chunk.end > current.end:
+                    # перекрытие уже есть в current, добавляем только продолжение
+                    tail = chunk.text[max(current.end - chunk.start, 0):]
+                    separator = " " if chunk.start >= current.end else ""
+                    current = current._replace(
+                        text=current.text + separator + tail,
+                        end=chunk.end,
+                        chunk_index=chunk.chunk_index,
+                    )
+                current = current._replace(score=max(current.score, chunk.score))
+                continue
+            if current is not None:
+                spans.append(current)
+            current = chunk
+        if current is not None:
+            spans.append(current)
+        return spans
+
+    def _touches(self, left, right):
+        if right.start <= left.end:
+            return True
+        return (
+            left.chunk_index is not None and right.chunk_index is not None
+            and right.chunk_index == left.chunk_index + 1
+        )
+
+    def _drop_duplicates(self, spans):
+        """Drop spans whose words mostly repeat a better-scored span"""
+        kept = []
+        kept_words = []
+        for span in sorted(spans, key=lambda span: span.score, reverse=True):
+            words = set(_WORD.findall(span.text.lower()))
+            if any(self._similarity(words, other) >= self.duplicate_threshold for other in kept_words):
+                continue
+            kept.append(span)
+            kept_words.append(words)
+        return kept
+
+    def _similarity(self, words, other):
+        if not words or not other:
+            return 0.0
+        # доля слов меньшего фрагмента, встречающихся в другом
+        return len(words & other) / min(len(words), len(other))
+
+    def _truncate(self, text, tokens):
+        if self.tokenizer is None:
+            return text[:tokens * 3]
+        ids = self.tokenizer.encode(text, add_special_tokens=False)[:tokens]
+        return self.tokenizer.decode(ids)
@@ -1,12 +1,103 @@
 import redis
-import pickle
 import hashlib
 import logging
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Формат эмбеддинга в Redis (little-endian):
+#   B версия формата, B тип значений, H размерность, I crc32 имени модели,
+#   для int8 дальше f масштаб, затем сами значения
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BBHI")
+_SCALE = struct.Struct("<f")
+_DTYPES = {"float32": (0, "<f4"), "float16": (1, "<f2"), "int8": (2, "i1")}
+_DTYPE_BY_CODE = {code: (name, np_dtype) for name, (code, np_dtype) in _DTYPES.items()}
+
+def model_id(model_name):
+    return zlib.crc32(model_name.encode())
+
+def encode_embedding(embedding, model, dtype="float32"):
+    """Pack an embedding into the compact versioned wire format"""
+    code, np_dtype = _DTYPES[dtype]
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    header = _HEADER.pack(FORMAT_VERSION, code, vector.size, model_id(model))
+
+    if dtype == "int8":
+        # Симметричное квантование: максимум по модулю отображается в 127
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        values = np.clip(np.rint(vector / scale), -127, 127).astype(np_dtype)
+        return header + _SCALE.pack(scale) + values.tobytes()
+    return header + vector.astype(np_dtype).tobytes()
+
+def decode_embedding(data, model):
+    """
+    Unpack an embedding; None if it was written by another model or format version.
+    float32 values are returned as a zero-copy read-only view of data.
+    """
+    version, code, dim, stored_model = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION or stored_model != model_id(model) or code not in _DTYPE_BY_CODE:
+        return None
+
+    name, np_dtype = _DTYPE_BY_CODE[code]
+    offset = _HEADER.size
+    if name == "int8":
+        scale, = _SCALE.unpack_from(data, offset)
+        offset += _SCALE.size
+        return np.frombuffer(data, dtype=np_dtype, count=dim, offset=offset).astype(np.float32) * np.float32(scale)
+
+    values = np.frombuffer(data, dtype=np_dtype, count=dim, offset=offset)
+    return values if name == "float32" else values.astype(np.float32)
+
+class LRUCache:
+    """Small thread-safe in-process LRU map"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
 class RedisCache:
-    def __init__(self, host="redis", port=6379, db=0):
+    """
+    Embedding cache: a bounded in-process LRU in front of Redis.
+    Hot query embeddings never leave the process; Redis shares the rest
+    between workers and replicas.
+    """
+
+    def __init__(self, host="redis", port=6379, db=0, model="sentence-transformers/all-MiniLM-L6-v2", client=None):
+        # Имя модели входит и в ключ, и в заголовок значения: смена модели не отдаст старые векторы
+        self.model = model
+        self.dtype = os.environ.get("EMBED_CACHE_DTYPE", "float32")
+        if self.dtype not in _DTYPES:
+            raise ValueError(f"EMBED_CACHE_DTYPE must be one of {', '.join(_DTYPES)}")
+        self.local = LRUCache(int(os.environ.get("EMBED_LOCAL_CACHE_SIZE", "10000")))
+        if client is not None:
+            self.client = client
+            return
         try:
             self.client = redis.Redis(host=host, port=port, db=db, decode_responses=False)
             self.client.ping()
@@ -16,25 +107,86 @@ class RedisCache:
             self.client = None
     
     def _make_key(self, text):
-        return f"emb:{hashlib.md5(text.encode()).hexdigest()}"
-    
+        return f"emb:{self.model}:{hashlib.md5(text.encode()).hexdigest()}"
+
+    def _load(self, key, data):
+        # Декодированный вектор уже принадлежит только нам — копировать незачем
+        embedding = decode_embedding(data, self.model)
+        if embedding is not None:
+            self._remember(key, embedding)
+        return embedding
+
+    def _remember(self, key, embedding):
+        """Cache an array nobody else holds, made read-only"""
+        # Один и тот же массив отдаётся разным вызывающим — защищаем от изменений
+        embedding.setflags(write=False)
+        self.local.set(key, embedding)
+
     def get_embedding(self, text):
+        key = self._make_key(text)
+        embedding = self.local.get(key)
+        metrics.cache_lookup("embedding_local", embedding is not None)
+        if embedding is not None:
+            return embedding
         if not self.client:
             return None
         try:
-            key = self._make_key(text)
-            data = self.client.get(key)
-            if data:
-                return pickle.loads(data)
+            with metrics.stage("redis_get"):
+                data = self.client.get(key)
+            embedding = self._load(key, data) if data else None
+            metrics.cache_lookup("embedding_redis", embedding is not None)
+            return embedding
         except Exception as e:
             logger.error(f"Redis get failed: {e}")
         return None
+
+    def get_many(self, texts):
+        """
+        Batch lookup: local tier first, then one MGET for the rest.
+        Returns a list aligned with texts, None for misses.
+        """
+        keys = [self._make_key(text) for text in texts]
+        result = [self.local.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(result) if embedding is None]
+        metrics.cache_lookup("embedding_local", len(keys) - len(missing), len(missing))
+        if not missing or not self.client:
+            return result
+        try:
+            with metrics.stage("redis_mget"):
+                values = self.client.mget([keys[i] for i in missing])
+            for i, data in zip(missing, values):
+                if data:
+                    result[i] = self._load(keys[i], data)
+            found = sum(result[i] is not None for i in missing)
+            metrics.cache_lookup("embedding_redis", found, len(missing) - found)
+        except Exception as e:
+            logger.error(f"Redis mget failed: {e}")
+        return result
     
     def set_embedding(self, text, embedding, ttl=86400):  # 24 hours
+        key = self._make_key(text)
+        # Своя копия: массив вызывающего остаётся изменяемым
+        self._remember(key, np.array(embedding, copy=True))
+        if not self.client:
+            return
+        try:
+            self.client.setex(key, ttl, encode_embedding(embedding, self.model, self.dtype))
+        except Exception as e:
+            logger.error(f"Redis set failed: {e}")
+
+    def set_many(self, texts, embeddings, ttl=86400):
+        """Store several embeddings in one pipelined round trip"""
+        keys = [self._make_key(text) for text in texts]
+        # Копия каждой строки: строка батча (view) держала бы в памяти весь батч
+        for key, embedding in zip(keys, embeddings):
+            self._remember(key, np.array(embedding, copy=True))
         if not self.client:
             return
         try:
-            key = self._make_key(text)
-            self.client.setex(key, ttl, pickle.dumps(embedding))
+            pipe = self.client.pipeline(transaction=False)
+            for key, embedding in zip(keys, embeddings):
+                pipe.setex(key, ttl, encode_embedding(embedding, self.model, self.dtype))
+            pipe.execute()
         except Exception as e:
-            logger.error(f"Redis set failed: {e}")
\ No newline at end of file
+            logger.error(f"Redis pipeline set failed: {e}")
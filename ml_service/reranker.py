@@ -0,0 +1,72 @@
+from sentence_transformers import CrossEncoder
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class Reranker:
+    """
+    Reorders retrieved chunks with a cross-encoder that reads the question
+    and each chunk together.
+
+    Scoring runs in small batches against a latency budget; if the budget
+    would be exceeded, the candidates are kept in retrieval order.
+    """
+
+    def __init__(self, model_name=None):
+        # Многоязычная модель: вопросы и документы у нас в основном на русском
+        self.model_name = model_name or os.environ.get("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+        self.candidates = int(os.environ.get("RERANK_CANDIDATES", "20"))
+        self.batch_size = int(os.environ.get("RERANK_BATCH_SIZE", "8"))
+        self.budget = float(os.environ.get("RERANK_BUDGET_MS", "300")) / 1000
+        self.max_length = int(os.environ.get("RERANK_MAX_LENGTH", "256"))
+
+        logger.info(f"Loading rerank model: {self.model_name}")
+        self.model = CrossEncoder(self.model_name, max_length=self.max_length)
+        # скользящая оценка времени на один батч: по ней решаем, успеем ли следующий
+        self._batch_seconds = None
+        logger.info("Rerank model loaded successfully")
+
+    def rerank(self, question, candidates, top_k, budget=None):
+        """
+        candidates: list of prompt_builder.Context in retrieval order
+        Returns the best top_k with cross-encoder scores, or the first top_k
+        unchanged if scoring does not fit into the budget (seconds)
+        """
+        if len(candidates) <= 1:
+            return candidates[:top_k]
+
+        budget = self.budget if budget is None else budget
+        deadline = time.monotonic() + budget
+        batches = (len(candidates) + self.batch_size - 1) // self.batch_size
+        if self._batch_seconds is not None and self._batch_seconds * batches > budget:
+            # оценка постепенно снижается, чтобы после всплеска нагрузки попробовать снова
+            self._batch_seconds *= 0.9
+            logger.info(f"Rerank of {len(candidates)} candidates would not fit into {budget * 1000:.0f} ms, keeping retrieval order")
+            return candidates[:top_k]
+
+        scores = []
+        for start in range(0, len(candidates), self.batch_size):
+            if self._batch_seconds is not None and time.monotonic() + self._batch_seconds > deadline:
+                logger.info(f"Rerank budget of {budget * 1000:.0f} ms exceeded after {len(scores)} candidates, keeping retrieval order")
+                return candidates[:top_k]
+
+            batch = candidates[start:start + self.batch_size]
+            started = time.monotonic()
+            scores.extend(self.model.predict(
+                [(question, candidate.text) for candidate in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            ).tolist())
+            self._observe(time.monotonic() - started)
+
+        ranked = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+        return [candidate._replace(score=score) for candidate, score in ranked[:top_k]]
+
+    def _observe(self, seconds):
+        if self._batch_seconds is None:
+            self._batch_seconds = seconds
+        else:
+            self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * seconds
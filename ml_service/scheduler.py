@@ -0,0 +1,244 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+
+import grpc
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Полоса: (одновременно выполняемых, ожидающих в очереди, секунд ожидания
+# в очереди без дедлайна у клиента) по умолчанию
+LANES = {
+    # ListDocuments, ClearDocuments, SetMode, GetUploadStatus
+    "cheap": (4, 16, 10),
+    # Query, QueryStream, DirectQuery
+    "interactive": (4, 16, 60),
+    # UploadDocument, UploadDocumentStream
+    "bulk": (2, 8, 120),
+}
+
+class Rejected(Exception):
+    """Request not admitted or out of time; apply() turns it into the gRPC status"""
+
+    def __init__(self, code, details, retry_after=None):
+        super().__init__(details)
+        self.code = code
+        self.details = details
+        self.retry_after = retry_after
+
+    def apply(self, context):
+        context.set_code(self.code)
+        context.set_details(self.details)
+        if self.retry_after is not None:
+            # стандартный трейлер, который учитывает retry policy клиентов gRPC
+            context.set_trailing_metadata((("grpc-retry-pushback-ms", str(int(self.retry_after * 1000))),))
+
+class _FutureWaiter:
+    """Wakes a coroutine waiting in a lane, from whichever thread frees the slot"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def cancel(self):
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def _cancel(self):
+        if not self.future.done():
+            self.future.cancel()
+
+class Lane:
+    """
+    Concurrency limit with a bounded FIFO of waiters.
+    A freed slot is handed straight to the first waiter, so late arrivals
+    cannot overtake the queue.
+    """
+
+    def __init__(self, name, limit, queue, max_wait=60.0):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        # дольше в очереди не ждём, даже если клиент не задал дедлайн
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+        self._depth = metrics.QUEUE_DEPTH.labels(f"lane_{name}")
+        # скользящая оценка длительности запроса, для подсказки retry-after
+        self._seconds = None
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free"""
+        seconds = self._seconds if self._seconds is not None else 1.0
+        return max(seconds * (len(self._waiters) + 1) / self.limit, 0.1)
+
+    def _enter(self, waiter):
+        """True if a slot was taken right away, False if the waiter was queued"""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= self.queue:
+                metrics.REJECTED.labels(self.name, "queue_full").inc()
+                raise Rejected(
+                    grpc.StatusCode.RESOURCE_EXHAUSTED,
+                    f"Server is busy ({self.name}), retry in {math.ceil(self.retry_after())}s",
+                    self.retry_after(),
+                )
+            self._waiters.append(waiter)
+            self._depth.set(len(self._waiters))
+            return False
+
+    def _abandon(self, waiter):
+        """Waiter gives up; if a slot was already handed to it, the slot is released"""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                self._depth.set(len(self._waiters))
+                return
+            except ValueError:
+                pass
+        self._leave(None)
+
+    def _leave(self, seconds):
+        with self._lock:
+            if seconds is not None:
+                self._seconds = seconds if self._seconds is None else 0.8 * self._seconds + 0.2 * seconds
+            if self._waiters:
+                # слот переходит первому в очереди, active не меняется
+                self._waiters.popleft().set()
+                self._depth.set(len(self._waiters))
+            else:
+                self.active -= 1
+
+class Scheduler:
+    """
+    Admission control in front of the servicer methods: every RPC runs in
+    a lane (cheap, interactive, bulk) with its own concurrency limit and
+    queue, so a burst of uploads cannot delay queries and vice versa.
+
+    A full queue, or a wait longer than the lane's max_wait, is rejected
+    with RESOURCE_EXHAUSTED and a retry hint; a request cancelled by the
+    client leaves the queue at once. check() stops a request before an
+    expensive stage once the client's deadline has run out.
+    """
+
+    def __init__(self):
+        self.lanes = {}
+        for name, (limit, queue, max_wait) in LANES.items():
+            prefix = f"SCHED_{name.upper()}"
+            self.lanes[name] = Lane(
+                name,
+                int(os.environ.get(f"{prefix}_CONCURRENCY", str(limit))),
+                int(os.environ.get(f"{prefix}_QUEUE", str(queue))),
+                float(os.environ.get(f"{prefix}_MAX_WAIT", str(max_wait))),
+            )
+        # сколько времени должно остаться до дедлайна, чтобы начинать этап
+        self.reserve = {"llm": float(os.environ.get("SCHED_LLM_MIN_SECONDS", "1"))}
+
+    @property
+    def capacity(self):
+        """RPCs that can be running or queued at once, across all lanes"""
+        return sum(lane.limit + lane.queue for lane in self.lanes.values())
+
+    def check(self, context, stage):
+        """Raises Rejected if the deadline leaves no time for the stage (embed, search, llm)"""
+        remaining = context.time_remaining()
+        if remaining is not None and remaining <= self.reserve.get(stage, 0.0):
+            logger.info(f"Skipping {stage}: {remaining:.2f}s left until the deadline")
+            metrics.REJECTED.labels(stage, "deadline").inc()
+            raise Rejected(grpc.StatusCode.DEADLINE_EXCEEDED, f"Deadline exceeded before {stage}")
+
+    def _queue_timeout(self, lane, context):
+        """(seconds to wait in the queue, whether the client's deadline is what limits it)"""
+        remaining = context.time_remaining()
+        if remaining is not None and remaining < lane.max_wait:
+            return remaining, True
+        return lane.max_wait, False
+
+    def _timed_out(self, lane, by_deadline):
+        if by_deadline:
+            metrics.REJECTED.labels(lane.name, "deadline").inc()
+            return Rejected(grpc.StatusCode.DEADLINE_EXCEEDED, f"Deadline exceeded while queued ({lane.name})")
+        metrics.REJECTED.labels(lane.name, "queue_timeout").inc()
+        return Rejected(
+            grpc.StatusCode.RESOURCE_EXHAUSTED,
+            f"Server is busy ({lane.name}), retry in {math.ceil(lane.retry_after())}s",
+            lane.retry_after(),
+        )
+
+    def _cancelled(self, lane):
+        metrics.REJECTED.labels(lane.name, "cancelled").inc()
+        return Rejected(grpc.StatusCode.CANCELLED, f"Cancelled while queued ({lane.name})")
+
+    @contextlib.contextmanager
+    def admit(self, name, context):
+        """Hold a slot of the lane for the duration of the block"""
+        lane = self.lanes[name]
+        self.check(context, name)
+        waiter = threading.Event()
+        if not lane._enter(waiter):
+            cancelled = threading.Event()
+
+            def on_done():
+                # вызов завершён (отменён клиентом): будим ожидающий поток,
+                # из очереди его убирает он сам через _abandon
+                cancelled.set()
+                waiter.set()
+
+            if not context.add_callback(on_done):
+                on_done()
+            timeout, by_deadline = self._queue_timeout(lane, context)
+            admitted = waiter.wait(timeout)
+            if not admitted or cancelled.is_set():
+                lane._abandon(waiter)
+                raise self._cancelled(lane) if cancelled.is_set() else self._timed_out(lane, by_deadline)
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            lane._leave(time.monotonic() - started)
+
+    @contextlib.asynccontextmanager
+    async def aadmit(self, name, context):
+        """admit() for grpc.aio handlers: waiting in the queue does not hold a thread"""
+        lane = self.lanes[name]
+        self.check(context, name)
+        waiter = _FutureWaiter(asyncio.get_running_loop())
+        if not lane._enter(waiter):
+            # завершённый вызов отменяет ожидание, даже если задачу обработчика не отменили
+            context.add_done_callback(lambda _: waiter.cancel())
+            timeout, by_deadline = self._queue_timeout(lane, context)
+            try:
+                await asyncio.wait_for(waiter.future, timeout)
+            except asyncio.TimeoutError:
+                lane._abandon(waiter)
+                raise self._timed_out(lane, by_deadline)
+            except asyncio.CancelledError:
+                lane._abandon(waiter)
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            lane._leave(time.monotonic() - started)
@@ -1,34 +1,121 @@
 import os
 from pathlib import Path
 from concurrent import futures
+import functools
 import grpc
-import time
+import inspect
 import logging
+import queue
+import signal
+import tempfile
+import threading
 
 import fm_pb2
 import fm_pb2_grpc
+import metrics
 from db import Database
 from text_extractor import TextExtractor
 from embedder import Embedder
-from llm_client import LLMClient
+from llm_client import LLMClient, validate_mode
+from mode_store import ModeStore
+from ingest import IngestionPipeline, new_document_id
+from answer_cache import AnswerCache
+from reranker import Reranker
+from prompt_builder import Context, PromptBuilder
+from scheduler import Rejected, Scheduler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Потоковая загрузка: сколько держать в памяти, прежде чем сбросить на диск, и предельный размер файла
+UPLOAD_SPOOL_MEMORY = int(os.environ.get("UPLOAD_SPOOL_MEMORY", str(4 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+# Поиск контекста по умолчанию: "hybrid" (векторный + полнотекстовый) или "vector"
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "hybrid")
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "1") == "1"
+OLLAMA_WARMUP = os.environ.get("OLLAMA_WARMUP", "1") == "1"
+# "threaded" - grpc.server на пуле потоков, "aio" - grpc.aio (aio_server.py)
+SERVER_MODE = os.environ.get("SERVER_MODE", "threaded")
+# сколько ждать завершения начатых запросов после SIGTERM
+SERVER_GRACE_PERIOD = float(os.environ.get("SERVER_GRACE_PERIOD", "30"))
+# все воркеры launcher.py слушают один порт, соединения раздаёт ядро
+SERVER_OPTIONS = [("grpc.so_reuseport", 1)]
+
+def load_models(embedder=True):
+    """
+    Models used by QnAService. launcher.py loads them once before forking
+    workers, so the weights are shared copy-on-write.
+    embedder=False leaves models["embedder"] None, to be loaded in each worker.
+    """
+    embedder = Embedder() if embedder else None
+    reranker = None
+    if RERANK_ENABLED:
+        try:
+            reranker = Reranker()
+        except Exception as e:
+            logger.warning(f"Reranker unavailable, using retrieval order: {e}")
+    return {"embedder": embedder, "reranker": reranker, "prompts": PromptBuilder()}
+
+def scheduled(lane, response=None):
+    """
+    Runs the servicer method in a Scheduler lane.
+    response: message class returned when the request is rejected (unary methods)
+    """
+    def decorate(method):
+        # aio_server проводит допуск сам и вызывает исходный метод
+        method.lane = lane
+        method.rejected_response = response
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def stream(self, request, context):
+                with metrics.rpc(method.__name__, context):
+                    try:
+                        with self.scheduler.admit(lane, context):
+                            yield from method(self, request, context)
+                    except Rejected as e:
+                        e.apply(context)
+            return stream
+
+        @functools.wraps(method)
+        def unary(self, request, context):
+            with metrics.rpc(method.__name__, context):
+                try:
+                    with self.scheduler.admit(lane, context):
+                        return method(self, request, context)
+                except Rejected as e:
+                    e.apply(context)
+                    return response()
+        return unary
+    return decorate
+
 class QnAService(fm_pb2_grpc.QnAServicer):
-    def __init__(self):
+    def __init__(self, models=None):
+        models = models or load_models()
         dsn = os.environ.get("DATABASE_DSN", "")
         self.db = Database(dsn) if dsn else None
         self.extractor = TextExtractor()
         self.llm = LLMClient()
-        self.embedder = Embedder()
+        self.embedder = models["embedder"]
+        self.reranker = models["reranker"]
+        self.prompts = models["prompts"]
+        self.scheduler = Scheduler()
+        self.modes = ModeStore(self.embedder.cache)
+        self.answers = AnswerCache(self.embedder.cache)
+        self.ingestion = IngestionPipeline(
+            self.db, self.extractor, self.embedder,
+            on_corpus_change=self.answers.invalidate,
+            status_cache=self.embedder.cache,
+        ) if self.db else None
         if not self.db:
             logger.warning("DATABASE_DSN not set, running without DB")
     
+    @scheduled("cheap", fm_pb2.SetModeResponse)
     def SetMode(self, request, context):
         mode = request.mode
         try:
-            self.llm.set_mode(mode)
+            if not request.user_id:
+                raise ValueError("user_id is required")
+            self.modes.set(request.user_id, mode)
             return fm_pb2.SetModeResponse(status="ok")
         except Exception as e:
             logger.error(f"SetMode failed: {e}")
@@ -36,50 +123,192 @@ class QnAService(fm_pb2_grpc.QnAServicer):
             context.set_details(str(e))
             return fm_pb2.SetModeResponse(status="error")
 
+    @scheduled("bulk", fm_pb2.UploadDocResponse)
     def UploadDocument(self, request, context):
+        """Queues the document for background ingestion and returns its job id right away"""
         try:
-            doc_id = f"doc_{int(time.time())}"
-            
-            if self.db:
-                if request.file_bytes:
-                    text = self.extractor.extract(request.file_bytes, request.filename)
-                    logger.info(f"Extracted {len(text)} chars from {request.filename}")
-                else:
-                    text = request.text
-                
-                if not text:
-                    logger.warning("No text extracted or provided")
-                    return fm_pb2.UploadDocResponse(doc_id="", status="error: no text")
-                
-                self.db.save_document(
-                    doc_id=doc_id,
-                    user_id=request.user_id,
-                    title=request.title,
-                    filename=request.filename,
-                )
-
-                chunks = self.embedder.chunk_text(text, chunk_size=400, overlap=50)
-                logger.info(f"Created {len(chunks)} chunks")
-
-                embeddings = self.embedder.embed_batch(chunks)
-                logger.info(f"Generated embeddings for {len(chunks)} chunks")
-
-                chunk_data = []
-                for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings)):
-                    chunk_id = f"{doc_id}_chunk_{i}"
-                    embedding_list = embedding.tolist()
-                    chunk_data.append((chunk_id, doc_id, chunk_text, embedding_list))
-
-                self.db.save_chunks(chunk_data)
-                
-            return fm_pb2.UploadDocResponse(doc_id=doc_id, status="ok")
+            if not request.file_bytes and not request.text:
+                logger.warning("No text extracted or provided")
+                return fm_pb2.UploadDocResponse(doc_id="", status="error: no text")
+
+            return self._queue_upload(request, request.file_bytes or None, context)
         except Exception as e:
             logger.error(f"Upload failed: {e}")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return fm_pb2.UploadDocResponse(doc_id="", status="error")
 
+    @scheduled("bulk", fm_pb2.UploadDocResponse)
+    def UploadDocumentStream(self, request_iterator, context):
+        """
+        Same as UploadDocument, but the file arrives in pieces:
+        first a meta message, then data chunks. The file is spooled to a
+        temporary file so memory use does not grow with the document size.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY)
+        try:
+            meta = None
+            size = 0
+            for chunk in request_iterator:
+                if chunk.WhichOneof("payload") == "meta":
+                    meta = chunk.meta
+                    continue
+
+                size += len(chunk.data)
+                if size > UPLOAD_MAX_BYTES:
+                    spool.close()
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    context.set_details(f"File is larger than {UPLOAD_MAX_BYTES} bytes")
+                    return fm_pb2.UploadDocResponse(doc_id="", status="error: file too large")
+                spool.write(chunk.data)
+
+            if meta is None:
+                spool.close()
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("Upload stream has no meta message")
+                return fm_pb2.UploadDocResponse(doc_id="", status="error")
+
+            if size == 0 and not meta.text:
+                spool.close()
+                logger.warning("No text extracted or provided")
+                return fm_pb2.UploadDocResponse(doc_id="", status="error: no text")
+
+            logger.info(f"Received {size} bytes of {meta.filename} via stream")
+            spool.seek(0)
+            return self._queue_upload(meta, spool if size else None, context)
+        except Exception as e:
+            spool.close()
+            logger.error(f"Streaming upload failed: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return fm_pb2.UploadDocResponse(doc_id="", status="error")
+
+    def _queue_upload(self, meta, source, context):
+        """Hands the document over to the ingestion pipeline; the pipeline owns source from now on"""
+        if not self.db:
+            if hasattr(source, "close"):
+                source.close()
+            return fm_pb2.UploadDocResponse(doc_id=new_document_id(), status="ok")
+
+        try:
+            job = self.ingestion.submit(
+                user_id=meta.user_id,
+                title=meta.title,
+                filename=meta.filename,
+                source=source,
+                text=meta.text,
+            )
+        except queue.Full:
+            if hasattr(source, "close"):
+                source.close()
+            logger.warning("Upload rejected: ingestion queue is full")
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details("Too many documents are being processed, try again later")
+            return fm_pb2.UploadDocResponse(doc_id="", status="error")
+
+        return fm_pb2.UploadDocResponse(doc_id=job.doc_id, job_id=job.job_id, status="queued")
+
+    @scheduled("cheap", fm_pb2.UploadStatusResponse)
+    def GetUploadStatus(self, request, context):
+        status = self.ingestion.get_status(request.job_id) if self.ingestion else None
+        if status is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"Unknown upload job: {request.job_id}")
+            return fm_pb2.UploadStatusResponse(job_id=request.job_id)
+
+        return fm_pb2.UploadStatusResponse(**status)
+
+    def _embed_question(self, question):
+        return self.embedder.embed_text(question) if self.db else None
+
+    def _retrieve_contexts(self, request, question, question_embedding):
+        """Returns: list of Context, best first"""
+        if self.db:
+            # С переранжированием из БД берётся больше кандидатов, а в промпт идут лучшие top_k
+            top_k = request.top_k or 5
+            candidates = request.rerank_candidates or (self.reranker.candidates if self.reranker else 0)
+            rerank = self.reranker is not None and candidates > top_k
+
+            results = [Context(*row) for row in self.db.search_chunks(
+                request.user_id,
+                question_embedding.tolist(),
+                top_k=candidates if rerank else top_k,
+                ef_search=request.ef_search or None,
+                question=question,
+                search_mode=request.search_mode or SEARCH_MODE,
+            )]
+            logger.info(f"Search results: {len(results)} chunks")
+            if rerank:
+                budget = request.rerank_budget_ms / 1000 if request.rerank_budget_ms else None
+                with metrics.stage("rerank"):
+                    results = self.reranker.rerank(question, results, top_k, budget=budget)
+            return results
+
+        logger.warning("No database connected, using fallback context")
+        return [Context(chunk_id="fallback_1", text=f"Sample context for: {question}", score=1.0)]
+
+    def _context_chunks(self, found):
+        return [fm_pb2.Chunk(chunk_id=c.chunk_id, text=c.text, score=float(c.score)) for c in found]
+
+    def _resolve_mode(self, request, default=None):
+        """Mode from the request itself, otherwise the one the user chose via SetMode"""
+        if request.mode:
+            return validate_mode(request.mode)
+        return default or self.modes.get(request.user_id)
+
+    def _check_mode(self, request, context):
+        """Aborts the call with INVALID_ARGUMENT if the request names an unknown mode"""
+        # вне общего try в обработчиках: иначе abort превратился бы в INTERNAL
+        if request.mode:
+            try:
+                validate_mode(request.mode)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def _retrieval_settings(self, request):
+        """Request fields that change the retrieved context, as part of the answer cache scope"""
+        return ":".join(str(value) for value in (
+            request.top_k or 5,
+            request.search_mode or SEARCH_MODE,
+            request.rerank_candidates,
+            request.rerank_budget_ms,
+            request.ef_search,
+        ))
+
+    def _cached_answer(self, request, question, mode, question_embedding):
+        """
+        Answer to the same or a near-duplicate question over the same documents.
+        Returns ((answer, contexts) or None, corpus version for _remember_answer)
+        """
+        if mode != "offline" or question_embedding is None:
+            return None, None
+        hit, version = self.answers.lookup(
+            request.user_id, question, question_embedding, self._retrieval_settings(request)
+        )
+        metrics.cache_lookup("answer", hit is not None)
+        if hit is None:
+            return None, version
+        return (hit["answer"], [fm_pb2.Chunk(**c) for c in hit["contexts"]]), version
+
+    def _remember_answer(self, request, question, mode, question_embedding, version, answer, contexts):
+        if mode != "offline" or question_embedding is None or self.llm.is_fallback_answer(answer):
+            return
+        self.answers.store(
+            request.user_id, question, question_embedding, answer,
+            [{"chunk_id": c.chunk_id, "text": c.text, "score": c.score} for c in contexts],
+            version, self._retrieval_settings(request),
+        )
+
+    def _context_texts(self, found, question):
+        """Context for the prompt: merged, deduplicated and fitted into the token budget"""
+        if not found:
+            return [f"No relevant data found for question: {question}"]
+        with metrics.stage("prompt"):
+            return self.prompts.build(found)
+
+    @scheduled("interactive", fm_pb2.QueryResponse)
     def Query(self, request, context):
+        self._check_mode(request, context)
         try:
             question = request.question.strip()
             if not question:
@@ -89,43 +318,94 @@ class QnAService(fm_pb2_grpc.QnAServicer):
 
             logger.info(f"Received query: {question}")
 
-            contexts = []
-
-            if self.db:
-                question_embedding = self.embedder.embed_text(question)
-                results = self.db.search_chunks(request.user_id, question_embedding.tolist(), top_k=request.top_k or 5)
-                logger.info(f"Search results: {len(results)} chunks")
-
-                for chunk_id, chunk_text, score in results:
-                    contexts.append(fm_pb2.Chunk(
-                        chunk_id=chunk_id,
-                        text=chunk_text,
-                        score=float(score)
-                    ))
-            else:
-                logger.warning("No database connected, using fallback context")
-                fallback = fm_pb2.Chunk(
-                    chunk_id="fallback_1",
-                    text=f"Sample context for: {question}",
-                    score=1.0
-                )
-                contexts = [fallback]
-
-            context_texts = [c.text for c in contexts] if contexts else [f"No relevant data found for question: {question}"]
+            mode = self._resolve_mode(request)
+            self.scheduler.check(context, "embed")
+            question_embedding = self._embed_question(question)
+            cached, version = self._cached_answer(request, question, mode, question_embedding)
+            if cached:
+                answer, contexts = cached
+                return fm_pb2.QueryResponse(answer=answer, contexts=contexts)
 
+            self.scheduler.check(context, "search")
+            found = self._retrieve_contexts(request, question, question_embedding)
+            contexts = self._context_chunks(found)
+            context_texts = self._context_texts(found, question)
+
+            self.scheduler.check(context, "llm")
             logger.info(f"Calling LLM with {len(context_texts)} context(s)...")
-            answer = self.llm.generate_answer(question, context_texts)
+            answer = self.llm.generate_answer(question, context_texts, mode=mode, user_id=request.user_id)
             logger.info(f"LLM returned {len(answer)} chars")
 
+            self._remember_answer(request, question, mode, question_embedding, version, answer, contexts)
             return fm_pb2.QueryResponse(answer=answer, contexts=contexts)
 
+        except Rejected as e:
+            e.apply(context)
+            return fm_pb2.QueryResponse(answer="", contexts=[])
         except Exception as e:
             logger.exception("Query failed")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return fm_pb2.QueryResponse(answer="", contexts=[])
 
+    @scheduled("interactive")
+    def QueryStream(self, request, context):
+        """Same as Query, but sends contexts first and then the answer token by token"""
+        # Отмена на стороне клиента должна остановить и генерацию в Ollama;
+        # False значит, что RPC уже завершён и отвечать некому
+        cancelled = threading.Event()
+        if not context.add_callback(cancelled.set):
+            return
+        self._check_mode(request, context)
+        try:
+            question = request.question.strip()
+            if not question:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details("Question is empty")
+                return
+
+            logger.info(f"Received streaming query: {question}")
+
+            mode = self._resolve_mode(request)
+            self.scheduler.check(context, "embed")
+            question_embedding = self._embed_question(question)
+            cached, version = self._cached_answer(request, question, mode, question_embedding)
+            if cached:
+                answer, contexts = cached
+                yield fm_pb2.QueryStreamResponse(contexts=contexts)
+                yield fm_pb2.QueryStreamResponse(delta=answer)
+                yield fm_pb2.QueryStreamResponse(done=True)
+                return
+
+            self.scheduler.check(context, "search")
+            found = self._retrieve_contexts(request, question, question_embedding)
+            contexts = self._context_chunks(found)
+            yield fm_pb2.QueryStreamResponse(contexts=contexts)
+
+            context_texts = self._context_texts(found, question)
+            self.scheduler.check(context, "llm")
+            logger.info(f"Streaming LLM answer with {len(context_texts)} context(s)...")
+            deltas = []
+            for delta in self.llm.stream_answer(question, context_texts, cancelled, mode=mode, user_id=request.user_id):
+                deltas.append(delta)
+                yield fm_pb2.QueryStreamResponse(delta=delta)
+
+            if cancelled.is_set():
+                logger.info("QueryStream cancelled by client")
+                return
+            self._remember_answer(request, question, mode, question_embedding, version, "".join(deltas), contexts)
+            yield fm_pb2.QueryStreamResponse(done=True)
+
+        except Rejected as e:
+            e.apply(context)
+        except Exception as e:
+            logger.exception("QueryStream failed")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+
+    @scheduled("interactive", fm_pb2.QueryResponse)
     def DirectQuery(self, request, context):
+        self._check_mode(request, context)
         try:
             question = request.question.strip()
             if not question:
@@ -134,15 +414,21 @@ class QnAService(fm_pb2_grpc.QnAServicer):
                 return fm_pb2.QueryResponse(answer="", contexts=[])
 
             logger.info(f"Direct query: {question}")
-            answer = self.llm.generate_answer(question, [])
+            self.scheduler.check(context, "llm")
+            # DirectQuery — свободный диалог, по умолчанию онлайн
+            answer = self.llm.generate_answer(question, [], mode=self._resolve_mode(request, default="online"))
             logger.info(f"Direct answer: {len(answer)} chars")
             return fm_pb2.QueryResponse(answer=answer, contexts=[])
+        except Rejected as e:
+            e.apply(context)
+            return fm_pb2.QueryResponse(answer="", contexts=[])
         except Exception as e:
             logger.exception("Direct query failed")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return fm_pb2.QueryResponse(answer="", contexts=[])
 
+    @scheduled("cheap", fm_pb2.ListDocsResponse)
     def ListDocuments(self, request, context):
         try:
             if not self.db:
@@ -155,11 +441,13 @@ class QnAService(fm_pb2_grpc.QnAServicer):
             context.set_details(str(e))
             return fm_pb2.ListDocsResponse(titles=[])
 
+    @scheduled("cheap", fm_pb2.ClearDocsResponse)
     def ClearDocuments(self, request, context):
         try:
             if not self.db:
                 return fm_pb2.ClearDocsResponse(success=True)
             self.db.clear_user_documents(request.user_id)
+            self.answers.invalidate(request.user_id)
             return fm_pb2.ClearDocsResponse(success=True)
         except Exception as e:
             logger.exception("ClearDocuments failed")
@@ -167,14 +455,44 @@ class QnAService(fm_pb2_grpc.QnAServicer):
             context.set_details(str(e))
             return fm_pb2.ClearDocsResponse(success=False)
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
-    fm_pb2_grpc.add_QnAServicer_to_server(QnAService(), server)
-    
+def serve(service=None):
+    """Run the gRPC server until SIGTERM; service is built here unless given"""
+    if SERVER_MODE == "aio":
+        import asyncio
+        import aio_server
+        asyncio.run(aio_server.serve(service))
+        return
+    if SERVER_MODE != "threaded":
+        raise ValueError("SERVER_MODE must be 'threaded' or 'aio'")
+
+    service = service or QnAService()
+    # Ожидающие в полосах планировщика тоже занимают поток, поэтому пул
+    # рассчитан на всю его ёмкость, а сверх неё запросы отклоняет сам gRPC
+    capacity = service.scheduler.capacity
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=capacity),
+        maximum_concurrent_rpcs=capacity,
+        options=SERVER_OPTIONS,
+    )
+    fm_pb2_grpc.add_QnAServicer_to_server(service, server)
+
+    # Загрузка модели в Ollama идёт в фоне, не задерживая старт сервера
+    if OLLAMA_WARMUP:
+        threading.Thread(target=service.llm.warm_up, name="ollama-warmup", daemon=True).start()
+
     port = os.environ.get("GRPC_PORT", "50051")
     server.add_insecure_port(f"[::]:{port}")
     server.start()
-    
+    # при нескольких воркерах метрики отдаёт launcher.py
+    if not metrics.MULTIPROCESS:
+        metrics.start_http_server()
+
+    # SIGTERM: новые запросы не принимаются, начатые дорабатывают SERVER_GRACE_PERIOD
+    def drain(signum, frame):
+        logger.info(f"Signal {signum} received, draining for up to {SERVER_GRACE_PERIOD:.0f}s")
+        server.stop(SERVER_GRACE_PERIOD)
+    signal.signal(signal.SIGTERM, drain)
+
     logger.info(f"ML gRPC server running on port {port}")
     server.wait_for_termination()
 
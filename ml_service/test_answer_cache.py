@@ -0,0 +1,73 @@
+import time
+
+import fakeredis
+import numpy as np
+
+from answer_cache import AnswerCache
+
+CONTEXTS = [{"chunk_id": "c1", "text": "Отпуск - 28 дней.", "score": 0.9}]
+
+
+class FakeCache:
+    def __init__(self):
+        self.client = fakeredis.FakeRedis()
+
+
+def rotated(similarity):
+    """Unit vector with the given cosine to e0"""
+    vector = np.zeros(8, dtype=np.float32)
+    vector[0], vector[1] = similarity, np.sqrt(1 - similarity ** 2)
+    return vector
+
+
+def ask(cache, question, embedding, answer=None, user_id="u"):
+    hit, version = cache.lookup(user_id, question, embedding)
+    if hit is None and answer is not None:
+        cache.store(user_id, question, embedding, answer, CONTEXTS, version)
+    return hit
+
+
+def test_same_and_near_duplicate_questions_hit():
+    cache = AnswerCache(FakeCache())
+    assert ask(cache, "Сколько дней отпуска?", rotated(1.0), answer="28") is None
+
+    hit = ask(cache, "  сколько ДНЕЙ отпуска? ", rotated(0.5))
+    assert hit == {"answer": "28", "contexts": CONTEXTS}
+    assert ask(cache, "Какой длины отпуск?", rotated(0.97))["answer"] == "28"
+    assert ask(cache, "Когда выплачивают премию?", rotated(0.9)) is None
+    assert ask(cache, "Сколько дней отпуска?", rotated(1.0), user_id="other") is None
+
+
+def test_corpus_change_invalidates_answers():
+    cache = AnswerCache(FakeCache())
+    ask(cache, "Сколько дней отпуска?", rotated(1.0), answer="28")
+    cache.invalidate("u")
+    assert ask(cache, "Сколько дней отпуска?", rotated(1.0)) is None
+
+
+def test_answer_generated_during_corpus_change_is_not_served():
+    cache = AnswerCache(FakeCache())
+    _, version = cache.lookup("u", "Сколько дней отпуска?", rotated(1.0))
+    cache.invalidate("u")
+    cache.store("u", "Сколько дней отпуска?", rotated(1.0), "устарело", CONTEXTS, version)
+    assert ask(cache, "Сколько дней отпуска?", rotated(1.0)) is None
+
+
+def test_entries_expire_and_least_recently_used_are_evicted(monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_MAX_ENTRIES", "2")
+    monkeypatch.setenv("ANSWER_CACHE_TTL", "60")
+    cache = AnswerCache(FakeCache())
+    ask(cache, "первый", rotated(1.0), answer="1")
+    time.sleep(0.01)
+    ask(cache, "второй", rotated(0.0), answer="2")
+    time.sleep(0.01)
+    assert ask(cache, "первый", rotated(1.0))["answer"] == "1"
+    time.sleep(0.01)
+    ask(cache, "третий", -rotated(1.0), answer="3")
+
+    assert ask(cache, "второй", rotated(0.0)) is None
+    assert ask(cache, "первый", rotated(1.0))["answer"] == "1"
+    assert ask(cache, "третий", -rotated(1.0))["answer"] == "3"
+    answers_key, embeddings_key, lru_key = cache._keys("u", 0, "")
+    assert cache.client.hlen(answers_key) == cache.client.hlen(embeddings_key) == 2
+    assert all(0 < cache.client.ttl(key) <= 60 for key in (answers_key, embeddings_key, lru_key))
@@ -0,0 +1,35 @@
+import numpy as np
+
+from bench.__main__ import compare
+from bench.fakes import MemoryDatabase
+
+
+def test_memory_database_search_and_replace():
+    db = MemoryDatabase()
+    db.save_document("doc", "u", "Title", "a.txt", content_hash="h1")
+    db.save_chunks([
+        ("c0", "doc", "u", 0, 0, 5, "x0", "alpha", np.array([1.0, 0.0], dtype=np.float32)),
+        ("c1", "doc", "u", 1, 6, 10, "x1", "beta", np.array([0.0, 1.0], dtype=np.float32)),
+    ])
+    assert db.find_document_by_hash("u", "h1") == "doc"
+    assert [row[0] for row in db.search_chunks("u", [0.1, 1.0], top_k=2)] == ["c1", "c0"]
+
+    # черновик новой версии не виден, пока не перенесён в документ
+    db.save_document("draft", None, "Title", "a.txt", content_hash="h2")
+    db.save_chunks([("c2", "draft", None, 0, 0, 5, "x2", "gamma", np.array([0.0, 1.0], dtype=np.float32))])
+    assert db.list_user_documents("u") == ["Title"]
+    assert [row[0] for row in db.search_chunks("u", [0.0, 1.0], top_k=3)] == ["c1", "c0"]
+
+    db.replace_document_chunks("doc", "u", "Title", "h2", draft_id="draft", kept_chunks=[("c0", 1, 6, 11)])
+    assert db.get_chunk_hashes("doc") == {"x2": ["c2"], "x0": ["c0"]}
+    assert db.search_chunks("u", [1.0, 0.0], top_k=1)[0][:6] == ("c0", "alpha", 1.0, "doc", 1, 6)
+    db.clear_user_documents("u")
+    assert db.list_user_documents("u") == [] and db.search_chunks("u", [1.0, 0.0]) == []
+
+
+def test_compare_flags_slower_levels():
+    def report(p95, qps):
+        return {"levels": [{"concurrency": 8, "operations": {"query": {"p95_ms": p95, "qps": qps}}}]}
+
+    assert compare(report(110, 95), report(100, 100), tolerance=0.2) == []
+    assert len(compare(report(130, 70), report(100, 100), tolerance=0.2)) == 2
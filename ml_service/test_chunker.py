@@ -0,0 +1,40 @@
+import re
+
+from chunker import Chunker
+
+
+class WhitespaceTokenizer:
+    """Один токен на слово, с тем же интерфейсом, что у токенизаторов HF"""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False, **kwargs):
+        if isinstance(texts, str):
+            spans = [m.span() for m in re.finditer(r"\S+", texts)]
+            return {"input_ids": list(range(len(spans))), "offset_mapping": spans}
+        return {"input_ids": [text.split() for text in texts]}
+
+
+def test_chunks_keep_sentences_and_offsets():
+    text = "First sentence here.  Second one follows! Third? Fourth sentence is last."
+    chunker = Chunker(strategy="chars", chunk_size=45, overlap=25)
+    chunks = chunker.split(text, offset=100)
+
+    assert [chunk.text for chunk in chunks] == [
+        "First sentence here.  Second one follows!",
+        "Second one follows! Third?",
+        "Third? Fourth sentence is last.",
+    ]
+    for chunk in chunks:
+        assert text[chunk.start - 100:chunk.end - 100] == chunk.text
+
+
+def test_token_strategy_respects_budget():
+    tokenizer = WhitespaceTokenizer()
+    text = "one two three. four five six. " + " ".join(f"w{i}" for i in range(10)) + "."
+    chunker = Chunker(tokenizer=tokenizer, max_tokens=4, overlap_tokens=0)
+    chunks = chunker.split(text)
+
+    assert [chunk.text for chunk in chunks] == [
+        "one two three.", "four five six.", "w0 w1 w2 w3", "w4 w5 w6 w7", "w8 w9.",
+    ]
+    assert all(len(chunk.text.split()) <= 4 for chunk in chunks)
+    assert chunker.split("  \n\n ") == []
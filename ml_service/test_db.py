@@ -0,0 +1,99 @@
+import struct
+
+import numpy as np
+
+from db import Database, _version_tuple, encode_chunks_copy
+
+
+class Reader:
+    """Parser for the fields of a COPY binary stream"""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def take(self, size):
+        piece = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return piece
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))
+
+    def field(self):
+        size, = self.unpack("!i")
+        return None if size == -1 else self.take(size)
+
+
+def read_copy(stream):
+    # мелкие чтения проверяют, что строки не рвутся и не теряются на границах блоков
+    return b"".join(iter(lambda: stream.read(7), b""))
+
+
+def test_chunks_copy_matches_pgcopy_binary_format():
+    rows = [
+        ("c0", "doc", "u", 0, 0, 5, "h0", "alpha", np.array([1.5, -2.0, 0.25], dtype=np.float32)),
+        ("c1", "doc", None, 1, 6, 12, "h1", "бета", [0.0, 1.0, 3.0]),
+    ]
+    data = Reader(read_copy(encode_chunks_copy(rows)))
+
+    assert data.take(11) == b"PGCOPY\n\xff\r\n\x00"
+    assert data.unpack("!ii") == (0, 0)  # флаги и длина расширения заголовка
+    for chunk_id, doc_id, user_id, index, start, end, digest, text, embedding in rows:
+        assert data.unpack("!h") == (9,)
+        assert [data.field() for _ in range(3)] == [chunk_id.encode(), doc_id.encode(), user_id and user_id.encode()]
+        assert [struct.unpack("!i", data.field())[0] for _ in range(3)] == [index, start, end]
+        assert [data.field() for _ in range(2)] == [digest.encode(), text.encode()]
+
+        # pgvector: int16 размерность, int16 unused, затем big-endian float4
+        vector = Reader(data.field())
+        assert vector.unpack("!hh") == (3, 0)
+        assert vector.unpack("!3f") == tuple(np.float32(embedding))
+        assert vector.offset == len(vector.data)
+    assert data.unpack("!h") == (-1,)
+    assert data.offset == len(data.data)
+
+
+class FakeConnection:
+    """Connection whose cursor returns one prepared row"""
+
+    def __init__(self, row):
+        self.row = row
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return self.row
+
+
+def checked_database(extversion, iterative_scan="strict_order"):
+    # без __init__: пул и подключение к PostgreSQL не нужны
+    db = Database.__new__(Database)
+    db.iterative_scan = iterative_scan
+    db._read = lambda query: query(FakeConnection(extversion and (extversion,)))
+    db._check_pgvector()
+    return db
+
+
+def test_version_tuple():
+    assert _version_tuple("0.8.0") == (0, 8, 0)
+    assert _version_tuple("0.7.4") < (0, 8) <= _version_tuple("0.8")
+    assert _version_tuple("0.10.1-dev") == (0, 10, 1)
+    assert _version_tuple("dev") == ()
+
+
+def test_iterative_scan_is_turned_off_before_pgvector_0_8():
+    assert checked_database("0.7.4").iterative_scan == "off"
+    assert checked_database(None).iterative_scan == "off"
+    assert checked_database("0.8.0").iterative_scan == "strict_order"
+    assert checked_database("0.10.0", "relaxed_order").iterative_scan == "relaxed_order"
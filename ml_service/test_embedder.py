@@ -0,0 +1,43 @@
+import threading
+
+import numpy as np
+import pytest
+
+from embedder import EmbeddingBatcher
+
+
+def test_batcher_groups_concurrent_calls():
+    batch_sizes = []
+
+    def encode_batch(texts):
+        batch_sizes.append(len(texts))
+        return np.array([[len(t), 0.0] for t in texts])
+
+    batcher = EmbeddingBatcher(encode_batch, max_batch_size=8, max_wait=0.05)
+    texts = [f"text {'x' * i}" for i in range(8)]
+    results = [None] * len(texts)
+
+    def worker(i):
+        results[i] = batcher.submit(texts[i]).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(texts))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Каждый вызывающий получает свой вектор, а encode вызывается реже, чем запросов
+    for text, result in zip(texts, results):
+        assert result[0] == len(text)
+    assert sum(batch_sizes) == len(texts)
+    assert len(batch_sizes) < len(texts)
+
+
+def test_batcher_propagates_errors():
+    def encode_batch(texts):
+        raise RuntimeError("model failed")
+
+    batcher = EmbeddingBatcher(encode_batch, max_batch_size=4, max_wait=0.001)
+    future = batcher.submit("hello")
+    with pytest.raises(RuntimeError):
+        future.result(timeout=5)
@@ -9,6 +9,14 @@ def test_txt():
     print(f"  Content: {result}")
     assert len(result) > 0
 
+def test_iter_pages():
+    print("\nTesting streaming extraction...")
+    extractor = TextExtractor()
+    pages = list(extractor.iter_pages(b"Streamed document text.", "test.txt"))
+    print(f"  Pieces: {len(pages)}")
+    assert pages == ["Streamed document text."]
+    assert list(extractor.iter_pages(b"data", "test.xyz")) == []
+
 def test_chunking():
     print("\nTesting text chunking...")
     from embedder import Embedder
@@ -23,6 +31,7 @@ def test_chunking():
 if __name__ == "__main__":
     print("=== Text Extraction Tests ===\n")
     test_txt()
+    test_iter_pages()
     
     try:
         test_chunking()
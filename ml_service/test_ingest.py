@@ -0,0 +1,118 @@
+import time
+
+from bench.fakes import HashEmbedder, MemoryDatabase
+from ingest import IngestionPipeline
+from text_extractor import TextExtractor
+
+
+class NoCache:
+    client = None
+
+    def get_embedding(self, text):
+        return None
+
+    def set_embedding(self, text, embedding):
+        pass
+
+
+def ingest(pipeline, user_id, filename, text):
+    job = pipeline.submit(user_id, filename, filename, text=text)
+    deadline = time.monotonic() + 10
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.state == "done", job.error
+    return job
+
+
+def make_pipeline():
+    db = MemoryDatabase()
+    return db, IngestionPipeline(db, extractor=None, embedder=HashEmbedder(NoCache()))
+
+
+def sentences(prefix, count):
+    return " ".join(f"{prefix} sentence number {i} with some words." * 8 for i in range(count))
+
+
+def test_same_filename_with_other_content_is_a_new_document():
+    db, pipeline = make_pipeline()
+    first = ingest(pipeline, "u", "document.pdf", sentences("Alpha", 10))
+    second = ingest(pipeline, "u", "document.pdf", sentences("Omega", 10))
+
+    assert second.doc_id != first.doc_id
+    assert len(db.list_user_documents("u")) == 2
+    assert db.get_chunk_hashes(first.doc_id)
+
+
+def test_same_filename_with_mostly_same_content_is_replaced():
+    db, pipeline = make_pipeline()
+    text = sentences("Alpha", 10)
+    first = ingest(pipeline, "u", "report.txt", text)
+    second = ingest(pipeline, "u", "report.txt", text + " One more closing sentence.")
+
+    assert second.doc_id == first.doc_id
+    assert len(db.list_user_documents("u")) == 1
+    assert second.chunks_reused > 0
+    assert sum(len(ids) for ids in db.get_chunk_hashes(first.doc_id).values()) == second.chunks_total
+    # черновик новой версии перенесён в документ и удалён
+    assert db.list_user_documents(None) == []
+    assert first.pages_extracted == second.pages_extracted == 0
+
+
+def test_repeated_chunks_are_kept_and_reused_by_occurrence():
+    db, pipeline = make_pipeline()
+    repeated = sentences("Alpha", 1)
+    text = " ".join([repeated, sentences("Beta", 1), repeated, sentences("Gamma", 1), repeated])
+    first = ingest(pipeline, "u", "notes.txt", text)
+    hashes = db.get_chunk_hashes(first.doc_id)
+    assert sum(len(ids) for ids in hashes.values()) == first.chunks_total == first.chunks_stored
+    assert max(len(ids) for ids in hashes.values()) > 1
+
+    second = ingest(pipeline, "u", "notes.txt", text + " " + sentences("Delta", 1))
+    assert second.doc_id == first.doc_id
+    assert second.chunks_reused == first.chunks_total
+    assert second.chunks_stored == second.chunks_total
+    assert db.get_chunk_hashes(first.doc_id).keys() >= hashes.keys()
+
+
+def broken_pdf(source):
+    yield "First page text. " * 50
+    raise RuntimeError("page 2 is broken")
+
+
+def submit_broken_pdf(pipeline, filename):
+    extractor = TextExtractor()
+    extractor._iter_pdf_pages = broken_pdf
+    pipeline.extractor = extractor
+    pipeline.chunk_window = 16
+    job = pipeline.submit("u", filename, filename, source=b"%PDF")
+    deadline = time.monotonic() + 10
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job, deadline
+
+
+def test_extraction_error_fails_the_job():
+    db, pipeline = make_pipeline()
+    job, deadline = submit_broken_pdf(pipeline, "broken.pdf")
+
+    assert job.state == "failed" and "page 2" in job.error
+    assert job.pages_extracted == 1
+    # store-стадия убрала то, что успело сохраниться
+    while db.list_user_documents("u") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db.list_user_documents("u") == []
+
+
+def test_failed_update_keeps_the_previous_version():
+    db, pipeline = make_pipeline()
+    first = ingest(pipeline, "u", "report.pdf", sentences("Alpha", 10))
+    hashes = db.get_chunk_hashes(first.doc_id)
+
+    job, deadline = submit_broken_pdf(pipeline, "report.pdf")
+    assert job.state == "failed" and job.draft_id
+    # черновик с успевшими записаться чанками удаляется, прежняя версия не тронута
+    while db.get_chunk_hashes(job.draft_id) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db.get_chunk_hashes(job.draft_id) == {}
+    assert db.list_user_documents(None) == []
+    assert db.get_chunk_hashes(first.doc_id) == hashes
@@ -0,0 +1,58 @@
+import time
+
+from llm_client import OLLAMA_RAG_SYSTEM, LLMClient, OllamaSessions
+
+
+def test_sessions_ttl_and_key_mismatch():
+    sessions = OllamaSessions(ttl=0.05)
+    sessions.put("u", ["doc a"], [1, 2, 3])
+    assert sessions.get("u", ["doc a"]) == [1, 2, 3]
+    # другие документы - сессия сбрасывается
+    assert sessions.get("u", ["doc b"]) is None
+    assert sessions.get("u", ["doc a"]) is None
+
+    sessions.put("u", ["doc a"], [1, 2, 3])
+    time.sleep(0.06)
+    assert sessions.get("u", ["doc a"]) is None
+
+
+def test_sessions_drop_long_context_and_evict_lru():
+    sessions = OllamaSessions(maxsize=2, max_tokens=3)
+    sessions.put("u", ["d"], [1, 2, 3])
+    sessions.put("u", ["d"], [1, 2, 3, 4])
+    assert sessions.get("u", ["d"]) is None
+
+    sessions.put("a", ["d"], [1])
+    sessions.put("b", ["d"], [2])
+    sessions.get("a", ["d"])
+    sessions.put("c", ["d"], [3])
+    assert sessions.get("b", ["d"]) is None
+    assert sessions.get("a", ["d"]) == [1] and sessions.get("c", ["d"]) == [3]
+
+
+def test_ollama_request_sends_system_and_documents(monkeypatch):
+    monkeypatch.delenv("OLLAMA_SESSIONS", raising=False)
+    client = LLMClient()
+    client._session_saver("u", ["Первый документ."])
+    request = client._ollama_request("Что в документе?", ["Первый документ."], stream=True, user_id="u")
+
+    assert request["system"] == OLLAMA_RAG_SYSTEM
+    assert request["stream"] is True and "context" not in request
+    assert request["keep_alive"] == client.ollama_keep_alive
+    assert request["options"]["num_ctx"] == client.ollama_num_ctx
+    # system -> документы -> вопрос: у соседних запросов общее начало
+    prompt = request["prompt"]
+    assert prompt.startswith("Документы:\n[1] Первый документ.")
+    assert prompt.index("Первый документ.") < prompt.index("Вопрос: Что в документе?")
+    assert client._session_saver("u", ["Первый документ."]) is None
+
+
+def test_ollama_sessions_are_opt_in(monkeypatch):
+    monkeypatch.setenv("OLLAMA_SESSIONS", "1")
+    client = LLMClient()
+    client._session_saver("u", ["doc"])([7, 8, 9])
+    request = client._ollama_request("И ещё?", ["doc"], stream=False, user_id="u")
+
+    assert request["context"] == [7, 8, 9]
+    assert request["system"] == OLLAMA_RAG_SYSTEM
+    assert request["prompt"] == client._build_ollama_question("И ещё?")
@@ -0,0 +1,41 @@
+import grpc
+from prometheus_client import REGISTRY, generate_latest
+
+import metrics
+
+
+class FakeContext:
+    def __init__(self, code=None):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_rpc_tracks_in_flight_and_status():
+    before = sample("fm_rpc_seconds_count", {"method": "Query", "code": "RESOURCE_EXHAUSTED"})
+    context = FakeContext()
+    with metrics.rpc("Query", context):
+        assert sample("fm_rpc_in_flight", {"method": "Query"}) == 1
+        context._code = grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert sample("fm_rpc_in_flight", {"method": "Query"}) == 0
+    assert sample("fm_rpc_seconds_count", {"method": "Query", "code": "RESOURCE_EXHAUSTED"}) == before + 1
+
+
+def test_cache_lookups_and_generation_speed():
+    metrics.cache_lookup("answer", True)
+    metrics.cache_lookup("embedding_redis", 3, 1)
+    assert sample("fm_cache_lookups_total", {"cache": "embedding_redis", "result": "hit"}) >= 3
+    assert sample("fm_cache_lookups_total", {"cache": "embedding_redis", "result": "miss"}) >= 1
+
+    metrics.record_generation("ollama", 40, 2.0)
+    assert sample("fm_llm_tokens_total", {"backend": "ollama"}) >= 40
+    assert sample("fm_llm_tokens_per_second_sum", {"backend": "ollama"}) >= 20
+
+    with metrics.stage("search_vector"):
+        pass
+    assert b'fm_stage_seconds_count{stage="search_vector"}' in generate_latest(REGISTRY)
@@ -0,0 +1,17 @@
+from mode_store import ModeStore
+
+
+class NoCache:
+    client = None
+
+
+def test_modes_without_redis_keep_only_recent_users(monkeypatch):
+    monkeypatch.setenv("MODE_LOCAL_CACHE_SIZE", "2")
+    modes = ModeStore(NoCache())
+    modes.set("a", "online")
+    modes.set("b", "online")
+    assert modes.get("a") == "online"
+    modes.set("c", "online")
+
+    assert modes.get("a") == modes.get("c") == "online"
+    assert modes.get("b") == "offline"
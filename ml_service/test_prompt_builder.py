@@ -0,0 +1,34 @@
+from prompt_builder import Context, PromptBuilder
+
+
+class WordTokenizer:
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+    def decode(self, ids):
+        return " ".join(ids)
+
+
+def test_overlapping_chunks_are_merged():
+    document = "Alpha beta gamma. Delta epsilon zeta. Eta theta iota."
+    contexts = [
+        Context("c1", document[18:37], 0.9, "doc", 1, 18, 37),
+        Context("c0", document[0:26], 0.5, "doc", 0, 0, 26),
+        Context("c2", document[38:], 0.4, "doc", 2, 38, len(document)),
+    ]
+    builder = PromptBuilder(tokenizer=WordTokenizer(), budget=100)
+    assert builder.build(contexts) == [document]
+
+
+def test_duplicates_dropped_and_budget_respected():
+    contexts = [
+        Context("a", "one two three four", 0.9, "doc1", 0, 0, 18),
+        Context("b", "one two three four", 0.8, "doc2", 0, 0, 18),
+        Context("c", "five six seven eight nine", 0.7, "doc3", 0, 0, 25),
+        Context("d", "ten eleven", 0.6),
+    ]
+    builder = PromptBuilder(tokenizer=WordTokenizer(), budget=7)
+    assert builder.build(contexts) == ["one two three four", "ten eleven"]
+
+    builder = PromptBuilder(tokenizer=WordTokenizer(), budget=2)
+    assert builder.build(contexts[:1]) == ["one two"]
@@ -0,0 +1,49 @@
+import fakeredis
+import numpy as np
+
+from redis_cache import RedisCache, decode_embedding, encode_embedding
+
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def test_embedding_roundtrip():
+    vector = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+
+    data = encode_embedding(vector, MODEL)
+    assert len(data) < 384 * 4 + 16
+    assert np.array_equal(decode_embedding(data, MODEL), vector)
+
+    # Сжатые форматы теряют точность, но не направление вектора
+    for dtype in ("float16", "int8"):
+        decoded = decode_embedding(encode_embedding(vector, MODEL, dtype), MODEL)
+        cosine = decoded @ vector / (np.linalg.norm(decoded) * np.linalg.norm(vector))
+        assert decoded.dtype == np.float32
+        assert cosine > 0.999
+
+
+def test_embedding_from_other_model_is_ignored():
+    data = encode_embedding(np.ones(8, dtype=np.float32), MODEL)
+    assert decode_embedding(data, "other-model") is None
+
+
+def test_local_cache_keeps_its_own_read_only_copy():
+    cache = RedisCache(model=MODEL, client=fakeredis.FakeRedis())
+    batch = np.ones((4, 8), dtype=np.float32)
+    cache.set_many(["a", "b", "c", "d"], batch)
+
+    cached = cache.get_embedding("b")
+    assert batch.flags.writeable and not cached.flags.writeable
+    assert cached.base is None or cached.base is not batch
+    batch[1] = 0
+    assert cached.sum() == 8
+
+
+def test_redis_hit_is_cached_read_only():
+    client = fakeredis.FakeRedis()
+    vector = np.arange(8, dtype=np.float32)
+    client.set(RedisCache(model=MODEL, client=client)._make_key("a"), encode_embedding(vector, MODEL))
+
+    cache = RedisCache(model=MODEL, client=client)
+    loaded = cache.get_embedding("a")
+    assert np.array_equal(loaded, vector) and not loaded.flags.writeable
+    assert cache.get_many(["a", "b"])[0] is loaded
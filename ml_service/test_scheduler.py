@@ -0,0 +1,158 @@
+import asyncio
+import threading
+
+import grpc
+import pytest
+
+from scheduler import Lane, Rejected, Scheduler
+
+
+class FakeContext:
+    def __init__(self, remaining=None):
+        self.remaining = remaining
+        self.code = None
+        self.trailers = ()
+        self.callbacks = []
+
+    def time_remaining(self):
+        return self.remaining
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return True
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(lambda: callback(self))
+
+    def cancel(self):
+        for callback in self.callbacks:
+            callback()
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def set_trailing_metadata(self, metadata):
+        self.trailers = metadata
+
+
+def make_scheduler(limit, queue):
+    scheduler = Scheduler()
+    scheduler.lanes["interactive"] = Lane("interactive", limit, queue)
+    return scheduler
+
+
+def test_full_queue_is_rejected_with_retry_hint():
+    scheduler = make_scheduler(limit=1, queue=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with scheduler.admit("interactive", FakeContext()):
+            started.set()
+            release.wait()
+
+    def wait_in_queue():
+        with scheduler.admit("interactive", FakeContext(remaining=5)):
+            pass
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    started.wait()
+    waiter = threading.Thread(target=wait_in_queue)
+    waiter.start()
+    while scheduler.lanes["interactive"].waiting == 0:
+        pass
+
+    context = FakeContext()
+    with pytest.raises(Rejected) as rejected:
+        with scheduler.admit("interactive", context):
+            pass
+    rejected.value.apply(context)
+    assert context.code == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert context.trailers[0][0] == "grpc-retry-pushback-ms"
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert scheduler.lanes["interactive"].active == 0
+
+
+def test_deadline_expires_while_queued():
+    scheduler = make_scheduler(limit=1, queue=4)
+
+    async def run():
+        async with scheduler.aadmit("interactive", FakeContext()):
+            with pytest.raises(Rejected) as rejected:
+                async with scheduler.aadmit("interactive", FakeContext(remaining=0.05)):
+                    pass
+            assert rejected.value.code == grpc.StatusCode.DEADLINE_EXCEEDED
+        # слот освободился, ожидающих не осталось
+        async with scheduler.aadmit("interactive", FakeContext(remaining=1)):
+            pass
+
+    asyncio.run(run())
+    lane = scheduler.lanes["interactive"]
+    assert lane.active == 0 and lane.waiting == 0
+
+
+def test_check_keeps_llm_reserve():
+    scheduler = Scheduler()
+    scheduler.reserve["llm"] = 1.0
+    scheduler.check(FakeContext(remaining=0.5), "search")
+    scheduler.check(FakeContext(), "llm")
+    with pytest.raises(Rejected):
+        scheduler.check(FakeContext(remaining=0.5), "llm")
+
+
+def test_queue_wait_is_bounded_without_deadline():
+    scheduler = make_scheduler(limit=1, queue=4)
+    scheduler.lanes["interactive"].max_wait = 0.05
+
+    with scheduler.admit("interactive", FakeContext()):
+        with pytest.raises(Rejected) as rejected:
+            with scheduler.admit("interactive", FakeContext()):
+                pass
+    assert rejected.value.code == grpc.StatusCode.RESOURCE_EXHAUSTED
+    lane = scheduler.lanes["interactive"]
+    assert lane.active == 0 and lane.waiting == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = make_scheduler(limit=1, queue=4)
+    lane = scheduler.lanes["interactive"]
+    context = FakeContext()
+    errors = []
+
+    def wait_in_queue():
+        try:
+            with scheduler.admit("interactive", context):
+                pass
+        except Rejected as e:
+            errors.append(e.code)
+
+    with scheduler.admit("interactive", FakeContext()):
+        waiter = threading.Thread(target=wait_in_queue)
+        waiter.start()
+        while lane.waiting == 0:
+            pass
+        context.cancel()
+        waiter.join(timeout=5)
+        assert errors == [grpc.StatusCode.CANCELLED] and lane.waiting == 0
+    assert lane.active == 0
+
+    async def run():
+        context = FakeContext()
+        async with scheduler.aadmit("interactive", FakeContext()):
+            queued = asyncio.ensure_future(scheduler.aadmit("interactive", context).__aenter__())
+            while lane.waiting == 0:
+                await asyncio.sleep(0)
+            context.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await queued
+        assert lane.waiting == 0
+
+    asyncio.run(run())
+    assert lane.active == 0
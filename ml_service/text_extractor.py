@@ -1,19 +1,53 @@
+import codecs
 import io
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from PyPDF2 import PdfReader
 from docx import Document
 
 logger = logging.getLogger(__name__)
 
+# PdfReader последнего файла в процессе-воркере, чтобы не разбирать его на каждый диапазон
+_worker_reader = (None, None)
+
+def _extract_pdf_range(path, start, end):
+    """Runs in a worker process: extract text of pages [start, end)"""
+    global _worker_reader
+    cached_path, reader = _worker_reader
+    if cached_path != path:
+        reader = PdfReader(path)
+        _worker_reader = (path, reader)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
 class TextExtractor:
     """Extract text from various file formats"""
-    
+
+    def __init__(self):
+        # Бюджет на один документ
+        self.max_pages = int(os.environ.get("PDF_MAX_PAGES", "2000"))
+        self.time_budget = float(os.environ.get("PDF_TIME_BUDGET", "300"))
+        # Большие PDF разбираются диапазонами страниц в пуле процессов
+        self.workers = int(os.environ.get("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.parallel_min_pages = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "32"))
+        self.pages_per_task = int(os.environ.get("PDF_PAGES_PER_TASK", "8"))
+        # TXT из файла читается блоками, а не целиком
+        self.txt_block_size = 256 * 1024
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
     def extract(self, file_bytes, filename):
         """
         Extract text from file based on extension
         
         Args:
-            file_bytes: binary file content
+            file_bytes: binary file content (bytes or a binary file object)
             filename: original filename with extension
             
         Returns:
@@ -30,23 +64,137 @@ class TextExtractor:
         else:
             logger.warning(f"Unsupported format: {ext}")
             return ""
-    
+
+    def iter_pages(self, file_bytes, filename):
+        """
+        Extract text lazily: one page at a time for PDF, in blocks for TXT
+        read from a file object, as a single piece otherwise.
+        Pieces are meant to be concatenated as is. Unlike extract(), a PDF
+        that fails to parse raises, so a partly read document is not taken
+        for a complete one.
+
+        Args:
+            file_bytes: binary file content (bytes or a binary file object)
+            filename: original filename with extension
+
+        Yields:
+            str: next piece of text
+        """
+        ext = filename.lower().split('.')[-1]
+
+        if ext == 'pdf':
+            yield from self._iter_pdf_pages(file_bytes)
+        elif ext == 'txt' and not isinstance(file_bytes, (bytes, bytearray)):
+            yield from self._iter_txt_blocks(file_bytes)
+        else:
+            text = self.extract(file_bytes, filename)
+            if text:
+                yield text
+
+    def _as_stream(self, file_bytes):
+        if isinstance(file_bytes, (bytes, bytearray)):
+            return io.BytesIO(file_bytes)
+        file_bytes.seek(0)
+        return file_bytes
+
     def _extract_pdf(self, file_bytes):
         try:
-            pdf_file = io.BytesIO(file_bytes)
-            reader = PdfReader(pdf_file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-            return text.strip()
+            return "".join(self._iter_pdf_pages(file_bytes)).strip()
         except Exception as e:
             logger.error(f"PDF extraction failed: {e}")
             return ""
+
+    def _iter_pdf_pages(self, file_bytes):
+        reader = PdfReader(self._as_stream(file_bytes))
+        total = len(reader.pages)
+        pages = min(total, self.max_pages)
+        if pages < total:
+            logger.warning(f"PDF has {total} pages, only the first {pages} will be extracted")
+
+        deadline = time.monotonic() + self.time_budget
+        if self.workers > 1 and pages >= self.parallel_min_pages:
+            yield from self._iter_pdf_pages_parallel(file_bytes, pages, deadline)
+            return
+
+        for i in range(pages):
+            if time.monotonic() > deadline:
+                logger.warning(f"PDF time budget exceeded after {i} of {pages} pages")
+                return
+            yield (reader.pages[i].extract_text() or "") + "\n"
+
+    def _iter_pdf_pages_parallel(self, file_bytes, pages, deadline):
+        # Воркеры читают PDF с диска, а не получают копию байтов в каждой задаче
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            shutil.copyfileobj(self._as_stream(file_bytes), tmp)
+            tmp.flush()
+
+            ranges = [(start, min(start + self.pages_per_task, pages)) for start in range(0, pages, self.pages_per_task)]
+            done = 0
+            retried = False
+            while True:
+                pool = self._get_pool()
+                try:
+                    for page_texts in self._map_ranges(pool, tmp.name, ranges[done:], pages, deadline):
+                        done += 1
+                        for page_text in page_texts:
+                            yield page_text + "\n"
+                    return
+                except BrokenProcessPool:
+                    # Воркер умер (OOM, segfault в разборе): пул пересоздаётся,
+                    # и оставшиеся страницы пробуются ещё раз
+                    self._reset_pool(pool)
+                    if retried:
+                        raise
+                    retried = True
+                    logger.warning(f"PDF worker pool broke at page {ranges[done][0]} of {pages}, restarting it")
+
+    def _map_ranges(self, pool, path, ranges, pages, deadline):
+        """Yields page texts of each range in order, until the deadline"""
+        # Держим в работе не больше 2 задач на воркер, остальные подаём по мере выдачи
+        window = self.workers * 2
+        futures = [pool.submit(_extract_pdf_range, path, start, end) for start, end in ranges[:window]]
+        next_range = len(futures)
+
+        try:
+            for i in range(len(ranges)):
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise FutureTimeoutError()
+                    page_texts = futures[i].result(timeout=remaining)
+                except FutureTimeoutError:
+                    logger.warning(f"PDF time budget exceeded after {ranges[i][0]} of {pages} pages")
+                    return
+                if next_range < len(ranges):
+                    start, end = ranges[next_range]
+                    futures.append(pool.submit(_extract_pdf_range, path, start, end))
+                    next_range += 1
+                yield page_texts
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # forkserver: воркеры форкаются из чистого процесса, а не из сервера
+                # с живыми gRPC-потоками
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            return self._pool
+
+    def _reset_pool(self, pool):
+        """Drop a broken pool; another thread may have replaced it already"""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
     
     def _extract_docx(self, file_bytes):
         try:
-            docx_file = io.BytesIO(file_bytes)
-            doc = Document(docx_file)
+            doc = Document(self._as_stream(file_bytes))
             text = "\n".join([para.text for para in doc.paragraphs])
             return text.strip()
         except Exception as e:
@@ -54,6 +202,8 @@ class TextExtractor:
             return ""
     
     def _extract_txt(self, file_bytes):
+        if not isinstance(file_bytes, (bytes, bytearray)):
+            file_bytes = self._as_stream(file_bytes).read()
         try:
             return file_bytes.decode('utf-8').strip()
         except UnicodeDecodeError:
@@ -62,4 +212,26 @@ class TextExtractor:
             except Exception as e:
                 logger.error(f"TXT decoding failed: {e}")
                 return ""
-            
\ No newline at end of file
+
+    def _iter_txt_blocks(self, stream):
+        stream = self._as_stream(stream)
+        block = stream.read(self.txt_block_size)
+
+        # Кодировку определяем по первому блоку, как и _extract_txt
+        encoding = "utf-8"
+        try:
+            block.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # Обрезанный на границе блока многобайтовый символ — не повод менять кодировку
+            if e.start < len(block) - 3:
+                encoding = "cp1251"
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        while block:
+            text = decoder.decode(block)
+            if text:
+                yield text
+            block = stream.read(self.txt_block_size)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail